@@ -0,0 +1,138 @@
+import threading
+import time
+
+
+class AIWorker:
+    # Runs Search.run on a background thread so the caller's loop can keep
+    # drawing and handling events; the loop polls for the result every frame.
+    #
+    # Between its moves the worker can ponder: search the position after the
+    # opponent's predicted reply while they think. If they play it, the
+    # ponder search goes on as the search for the answer, with the time it
+    # has had counted against its budget; any other move cancels it, and
+    # only what it left in the transposition table is kept.
+
+    def __init__(self, search):
+        self.search = search
+        self.thread = None
+        self.stop_event = None
+        self.result = None
+        # While pondering, the predicted reply (0 when there was none and the
+        # position itself is searched, which fills the table for every reply).
+        self.ponder_move = None
+        # When the caller started waiting for the result, and whether the
+        # search answering it began as a ponder search.
+        self.waiting_since = None
+        self.answering_hit = False
+        self.ponder_hits = 0
+        self.ponder_misses = 0
+        self.saved_seconds = 0.0
+        self.hit_answers = 0
+        self.hit_latency = 0.0
+        self.searches = 0
+        self.search_latency = 0.0
+
+    def start(self, position, time_limit=None, node_limit=None):
+        self.cancel()
+        self.result = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(position, time_limit, node_limit, self.stop_event),
+                                       daemon=True)
+        self.thread.start()
+        self.waiting_since = time.perf_counter()
+        self.answering_hit = False
+
+    def _run(self, position, time_limit, node_limit, stop_event):
+        result = self.search.run(position, time_limit=time_limit, node_limit=node_limit, stop_event=stop_event)
+        if not stop_event.is_set():
+            self.result = result
+
+    def ponder(self, position, move):
+        # Searches position after move, the opponent's predicted reply (0 to
+        # search position itself), without limits until opponent_moved() or
+        # cancel().
+        position = position.copy()
+        if move:
+            position.make_move(move)
+        self.start(position)
+        self.waiting_since = None
+        self.ponder_move = move
+
+    def pondering(self):
+        return self.ponder_move is not None
+
+    def opponent_moved(self, move, time_limit=None, node_limit=None):
+        # Called with the opponent's move while pondering. On a ponder hit the
+        # search becomes the search for the answer under the given limits and
+        # True is returned; otherwise it is cancelled.
+        if self.ponder_move is None:
+            return False
+        if move == self.ponder_move:
+            self.search.limit(time_limit, node_limit)
+            already = self.search.elapsed()
+            self.ponder_hits += 1
+            self.saved_seconds += min(already, time_limit) if time_limit is not None else already
+            self.ponder_move = None
+            self.waiting_since = time.perf_counter()
+            self.answering_hit = True
+            return True
+        self.ponder_misses += 1
+        self.cancel()
+        return False
+
+    def idle(self):
+        return self.thread is None
+
+    def busy(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def poll(self):
+        # (move, score) once the search has finished, None while it runs.
+        if self.thread is None or self.thread.is_alive():
+            return None
+        self.thread = None
+        if self.waiting_since is not None:
+            latency = time.perf_counter() - self.waiting_since
+            if self.answering_hit:
+                self.hit_answers += 1
+                self.hit_latency += latency
+            else:
+                self.searches += 1
+                self.search_latency += latency
+            self.waiting_since = None
+        return self.result
+
+    def cancel(self):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+            self.result = None
+        self.ponder_move = None
+        self.waiting_since = None
+
+    def status(self):
+        search = self.search
+        return {
+            "depth": search.depth,
+            "nodes": search.nodes,
+            "best_move": search.best_move,
+            "score": search.best_score,
+            "elapsed": search.elapsed(),
+            "pondering": self.ponder_move,
+        }
+
+    def ponder_stats(self):
+        # Hit rate over the opponent moves made while pondering, and the wait
+        # for the answer: the search time hits had already had, and the mean
+        # time from the opponent's move to the result, on hits and otherwise.
+        pondered = self.ponder_hits + self.ponder_misses
+        return {
+            "hits": self.ponder_hits,
+            "misses": self.ponder_misses,
+            "hit_rate": self.ponder_hits / pondered if pondered else 0.0,
+            "saved_per_hit": self.saved_seconds / self.ponder_hits if self.ponder_hits else 0.0,
+            "saved_per_move": self.saved_seconds / pondered if pondered else 0.0,
+            "hit_latency": self.hit_latency / self.hit_answers if self.hit_answers else 0.0,
+            "search_latency": self.search_latency / self.searches if self.searches else 0.0,
+        }
@@ -0,0 +1,234 @@
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from bitboard import BISHOP, KNIGHT, PAWN, QUEEN, ROOK, Position, legal_moves, legal_moves_and_status
+from pgn import format_pgn, move_to_san, pgn_date
+from search import Search
+from tablebase import open_tablebases
+from transposition import TranspositionTable
+
+# Engine settings an arena configuration may give, as name=value pairs:
+# "depth=4", "time=0.1,hash=8". The names map to Search.run arguments.
+CONFIG_KEYS = {"depth": int, "time": float, "nodes": int, "hash": int}
+DEFAULT_CONFIG = "time=0.1"
+DEFAULT_HASH_MB = 8
+
+
+def parse_config(text):
+    config = {"hash": DEFAULT_HASH_MB}
+    for item in text.split(","):
+        name, _, value = item.partition("=")
+        name = name.strip()
+        if name not in CONFIG_KEYS or not value:
+            raise ValueError(f"bad engine setting {item!r}; expected {', '.join(CONFIG_KEYS)} as name=value")
+        config[name] = CONFIG_KEYS[name](value)
+    if not ("depth" in config or "time" in config or "nodes" in config):
+        raise ValueError(f"engine {text!r} has no depth, time or nodes limit")
+    return config
+
+
+def insufficient_material(position):
+    # Bare kings, or a single knight or bishop against a bare king.
+    for color in (0, 1):
+        pieces = position.pieces[color]
+        if pieces[PAWN] or pieces[ROOK] or pieces[QUEEN]:
+            return False
+    minors = sum(position.pieces[color][ptype].bit_count() for color in (0, 1) for ptype in (KNIGHT, BISHOP))
+    return minors <= 1
+
+
+def repetitions(position):
+    # How many times the current position has occurred, counting only the
+    # plies since the last capture or pawn move (which cannot be repeated).
+    history = position.history
+    # A game set up from a FEN can have a clock longer than its history.
+    earlier = history[max(0, len(history) - position.halfmove):] if position.halfmove else []
+    return 1 + sum(1 for record in earlier if record[5] == position.key)
+
+
+def game_over(position, max_plies, plies):
+    # (result, termination) once the game has ended, else None.
+    status = legal_moves_and_status(position)[1]
+    if status == "checkmate":
+        return ("0-1" if position.side == 0 else "1-0"), "checkmate"
+    if status == "stalemate":
+        return "1/2-1/2", "stalemate"
+    if position.halfmove >= 100:
+        return "1/2-1/2", "fifty-move rule"
+    if repetitions(position) >= 3:
+        return "1/2-1/2", "threefold repetition"
+    if insufficient_material(position):
+        return "1/2-1/2", "insufficient material"
+    # Endings the tablebases hold are adjudicated with their exact result.
+    found = open_tablebases().probe(position)
+    if found is not None:
+        result = found[0] if position.side == 0 else -found[0]
+        return {1: "1-0", -1: "0-1", 0: "1/2-1/2"}[result], "tablebase"
+    if plies >= max_plies:
+        return "1/2-1/2", "move limit"
+    return None
+
+
+def play_game(index, white, black, opening_seed, random_plies, max_plies):
+    # One game from the start position. The first random_plies moves are
+    # random (seeded, so both games of a pair share them); from then on each
+    # side searches with its own configuration and a fresh table.
+    configs = (white, black)
+    searches = [Search(TranspositionTable(config["hash"])) for config in configs]
+    nodes = [0, 0]
+    seconds = [0.0, 0.0]
+    rng = random.Random(opening_seed)
+    position = Position.initial()
+    sans = []
+    while True:
+        outcome = game_over(position, max_plies, len(sans))
+        if outcome:
+            break
+        side = position.side
+        if len(sans) < random_plies:
+            move = rng.choice(sorted(legal_moves(position)))
+        else:
+            config = configs[side]
+            search = searches[side]
+            move, _ = search.run(position, depth=config.get("depth"), time_limit=config.get("time"),
+                                 node_limit=config.get("nodes"))
+            nodes[side] += search.nodes
+            seconds[side] += search.elapsed()
+        sans.append(move_to_san(position, move))
+        position.make_move(move)
+    result, termination = outcome
+    return {
+        "index": index,
+        "result": result,
+        "termination": termination,
+        "sans": sans,
+        "nodes": nodes,
+        "seconds": seconds,
+    }
+
+
+def elo_difference(wins, draws, losses):
+    # Elo difference implied by the score, with a 95% interval from the
+    # spread of the per-game results. Unbounded when one side scored
+    # everything or nothing.
+    games = wins + draws + losses
+    if not games:
+        return 0.0, 0.0, 0.0
+    score = (wins + draws / 2) / games
+    deviation = math.sqrt((wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games)
+    margin = 1.96 * deviation / math.sqrt(games)
+
+    def elo(p):
+        if p <= 0:
+            return -math.inf
+        if p >= 1:
+            return math.inf
+        return 400 * math.log10(p / (1 - p))
+
+    return elo(score), elo(score - margin), elo(score + margin)
+
+
+def schedule(games, engine_a, engine_b, seed):
+    # Game 2k has A as White and 2k + 1 the reverse, from the same opening.
+    for index in range(games):
+        if index % 2 == 0:
+            yield index, engine_a, engine_b, seed + index // 2
+        else:
+            yield index, engine_b, engine_a, seed + index // 2
+
+
+def run_games(games, engine_a, engine_b, workers, seed, random_plies, max_plies):
+    # Yields finished games in completion order. At most two games per worker
+    # are queued at a time, so neither pending nor finished games pile up.
+    jobs = schedule(games, engine_a, engine_b, seed)
+    if workers <= 1:
+        for index, white, black, opening_seed in jobs:
+            yield play_game(index, white, black, opening_seed, random_plies, max_plies)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for job in jobs:
+            pending.add(executor.submit(play_game, *job, random_plies, max_plies))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play the engine against itself and write the games as PGN")
+    parser.add_argument("--engine-a", default=DEFAULT_CONFIG,
+                        help=f"first engine, as name=value pairs from {', '.join(CONFIG_KEYS)} "
+                             f"(default: {DEFAULT_CONFIG})")
+    parser.add_argument("--engine-b", default=DEFAULT_CONFIG, help="second engine, in the same form")
+    parser.add_argument("--games", type=int, default=10, help="number of games; colours alternate")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="games played at once")
+    parser.add_argument("--pgn", default="arena.pgn", help="file the games are appended to")
+    parser.add_argument("--random-plies", type=int, default=4, help="random opening moves before the engines play")
+    parser.add_argument("--max-plies", type=int, default=300, help="plies after which a game is drawn")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the random openings")
+    args = parser.parse_args()
+    try:
+        engine_a = parse_config(args.engine_a)
+        engine_b = parse_config(args.engine_b)
+    except ValueError as e:
+        parser.error(str(e))
+    names = {"A": f"A ({args.engine_a})", "B": f"B ({args.engine_b})"}
+
+    wins = draws = losses = 0
+    nodes = {"A": 0, "B": 0}
+    seconds = {"A": 0.0, "B": 0.0}
+    start = time.perf_counter()
+    date = pgn_date()
+    with open(args.pgn, "a") as pgn_file:
+        for finished, game in enumerate(run_games(args.games, engine_a, engine_b, args.workers, args.seed,
+                                                  args.random_plies, args.max_plies), 1):
+            a_is_white = game["index"] % 2 == 0
+            white, black = ("A", "B") if a_is_white else ("B", "A")
+            tags = {
+                "Event": "Arena",
+                "Site": "?",
+                "Date": date,
+                "Round": game["index"] + 1,
+                "White": names[white],
+                "Black": names[black],
+                "Termination": game["termination"],
+            }
+            pgn_file.write(format_pgn(tags, game["sans"], game["result"]))
+            pgn_file.flush()
+
+            result = game["result"]
+            if result == "1/2-1/2":
+                draws += 1
+            elif (result == "1-0") == a_is_white:
+                wins += 1
+            else:
+                losses += 1
+            for side, name in enumerate((white, black)):
+                nodes[name] += game["nodes"][side]
+                seconds[name] += game["seconds"][side]
+            print(f"game {finished}/{args.games} (round {game['index'] + 1}): {white}-{black} {result} "
+                  f"{game['termination']}, {len(game['sans'])} plies")
+
+    elo, low, high = elo_difference(wins, draws, losses)
+    print()
+    print(f"A vs B: +{wins} ={draws} -{losses}, score {(wins + draws / 2) / max(1, args.games):.1%}")
+    print(f"Elo difference: {elo:+.0f} (95% interval {low:+.0f} to {high:+.0f})")
+    for name in ("A", "B"):
+        rate = nodes[name] / seconds[name] if seconds[name] else 0.0
+        print(f"engine {name}: {nodes[name]:,} nodes, {rate:,.0f} nodes/s")
+    print(f"{args.games} games in {time.perf_counter() - start:.1f}s, written to {args.pgn}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from bitboard import BISHOP, BLACK, EMPTY, KNIGHT, QUEEN, ROOK, WHITE, Position
+from profiling import profiled
+from psqt import (ENDGAME_TABLES, ENDGAME_VALUES, MAX_PHASE, MIDDLEGAME_TABLES, MIDDLEGAME_VALUES, PHASE_WEIGHTS)
+
+# Evaluates many positions in one call. A board is 64 signed codes, a1
+# first (an (8, 8) array is indexed [rank][file], rank 1 first): 0 for an
+# empty square, piece type + 1 for White's pieces and minus that for
+# Black's. Batches are (N, 8, 8) or (N, 64) int8 arrays, or (N, 12) uint64
+# piece planes in Position.pieces order (White's six, then Black's).
+#
+# The score is the tapered material and piece-square score evaluate() in
+# search.py reads incrementally, plus a mobility term: pseudo-legal moves of
+# knights, bishops, rooks and queens (pins and checks are ignored). NumPy is
+# optional; without it the same numbers come from the pure-Python
+# evaluate_board, one board at a time.
+MOBILITY_WEIGHTS = {KNIGHT: 4, BISHOP: 5, ROOK: 2, QUEEN: 1}
+ROOK_DIRECTIONS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+KNIGHT_JUMPS = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+
+
+def _ray(sq, file_step, rank_step):
+    squares = []
+    file, rank = (sq & 7) + file_step, (sq >> 3) + rank_step
+    while 0 <= file < 8 and 0 <= rank < 8:
+        squares.append(rank * 8 + file)
+        file, rank = file + file_step, rank + rank_step
+    return squares
+
+
+# RAYS[sq] holds the four rook rays, then the four bishop rays, nearest
+# square first.
+RAYS = [[_ray(sq, *step) for step in ROOK_DIRECTIONS + BISHOP_DIRECTIONS] for sq in range(64)]
+KNIGHT_TARGETS = [[target for ray in (_ray(sq, *jump)[:1] for jump in KNIGHT_JUMPS) for target in ray]
+                  for sq in range(64)]
+
+
+def _signed_tables():
+    # Middlegame and endgame score of each signed code (+ 6, so index 6 is
+    # an empty square) on each square, from White's side.
+    middlegame = [[0] * 64 for _ in range(13)]
+    endgame = [[0] * 64 for _ in range(13)]
+    for ptype in range(6):
+        for sq in range(64):
+            middlegame[7 + ptype][sq] = MIDDLEGAME_VALUES[ptype] + MIDDLEGAME_TABLES[ptype][sq ^ 56]
+            endgame[7 + ptype][sq] = ENDGAME_VALUES[ptype] + ENDGAME_TABLES[ptype][sq ^ 56]
+            middlegame[5 - ptype][sq] = -(MIDDLEGAME_VALUES[ptype] + MIDDLEGAME_TABLES[ptype][sq])
+            endgame[5 - ptype][sq] = -(ENDGAME_VALUES[ptype] + ENDGAME_TABLES[ptype][sq])
+    return middlegame, endgame
+
+
+MIDDLEGAME_SCORES, ENDGAME_SCORES = _signed_tables()
+PHASE_BY_CODE = [PHASE_WEIGHTS[abs(code) - 1] if code else 0 for code in range(-6, 7)]
+MOBILITY_BY_CODE = [MOBILITY_WEIGHTS.get(abs(code) - 1, 0) if code else 0 for code in range(-6, 7)]
+
+
+def square_codes(squares):
+    # Position.squares as a board of signed codes.
+    return [0 if code == EMPTY else code + 1 if code < 6 else 5 - code for code in squares]
+
+
+def board_codes(position):
+    return square_codes(position.squares)
+
+
+def _mobility(board, sq, code):
+    ptype = abs(code) - 1
+    enemy = -1 if code > 0 else 1
+    if ptype == KNIGHT:
+        return sum(1 for target in KNIGHT_TARGETS[sq] if board[target] * enemy >= 0)
+    rays = RAYS[sq] if ptype == QUEEN else RAYS[sq][:4] if ptype == ROOK else RAYS[sq][4:]
+    count = 0
+    for ray in rays:
+        for target in ray:
+            if board[target]:
+                if board[target] * enemy > 0:
+                    count += 1
+                break
+            count += 1
+    return count
+
+
+@profiled
+def evaluate_board(board, side=WHITE):
+    # The scalar path: one board of 64 signed codes, scored for side.
+    middlegame = endgame = phase = mobility = 0
+    for sq, code in enumerate(board):
+        if not code:
+            continue
+        middlegame += MIDDLEGAME_SCORES[code + 6][sq]
+        endgame += ENDGAME_SCORES[code + 6][sq]
+        phase += PHASE_BY_CODE[code + 6]
+        weight = MOBILITY_BY_CODE[code + 6]
+        if weight:
+            mobility += weight * _mobility(board, sq, code) * (1 if code > 0 else -1)
+    phase = min(phase, MAX_PHASE)
+    score = (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE + mobility
+    return score if side == WHITE else -score
+
+
+if np is not None:
+    _SQUARES = np.arange(64)
+    _MIDDLEGAME = np.array(MIDDLEGAME_SCORES, dtype=np.int64)
+    _ENDGAME = np.array(ENDGAME_SCORES, dtype=np.int64)
+    _PHASE = np.array(PHASE_BY_CODE, dtype=np.int64)
+    _MOBILITY = np.array(MOBILITY_BY_CODE, dtype=np.int64)
+    # Ray squares padded to eight with square 64, an off-board column that
+    # reads as a blocker belonging to neither side, so every ray ends in one.
+    _OFF_BOARD = 64
+    _OFF_BOARD_CODE = 100
+    _RAY_INDEX = np.array([[ray + [_OFF_BOARD] * (8 - len(ray)) for ray in rays] for rays in RAYS])
+    _KNIGHT_INDEX = np.array([targets + [_OFF_BOARD] * (8 - len(targets)) for targets in KNIGHT_TARGETS])
+    # Which of the eight rays each piece type slides along.
+    _RAY_MASK = np.zeros((6, 8), dtype=np.int64)
+    _RAY_MASK[ROOK, :4] = _RAY_MASK[BISHOP, 4:] = _RAY_MASK[QUEEN] = 1
+    # Signed codes by Position.squares code + 1 (0 for EMPTY), and by
+    # Position.pieces plane.
+    _SQUARE_CODES = np.array([0] + [ptype + 1 for ptype in range(6)] + [-(ptype + 1) for ptype in range(6)],
+                             dtype=np.int8)
+    _PLANE_CODES = np.array([ptype + 1 for ptype in range(6)] + [-(ptype + 1) for ptype in range(6)], dtype=np.int8)
+
+
+def squares_to_boards(squares):
+    # An (N, 64) int8 batch from Position.squares lists.
+    return _SQUARE_CODES[np.array(squares, dtype=np.int64) + 1]
+
+
+def positions_to_boards(positions):
+    return squares_to_boards([position.squares for position in positions])
+
+
+def planes_to_boards(planes):
+    # An (N, 64) int8 batch from (N, 12) uint64 piece bitboards.
+    planes = np.asarray(planes, dtype=np.uint64)
+    bits = (planes[:, :, None] >> _SQUARES.astype(np.uint64)) & np.uint64(1)
+    return (bits.astype(np.int8) * _PLANE_CODES[None, :, None]).sum(axis=1, dtype=np.int8)
+
+
+def _as_boards(batch):
+    batch = np.asarray(batch)
+    if batch.ndim == 2 and batch.shape[1] == 12 and batch.dtype == np.uint64:
+        return planes_to_boards(batch)
+    return batch.reshape(len(batch), 64).astype(np.int8, copy=False)
+
+
+@profiled
+def evaluate_boards(batch, sides=None):
+    # Scores for a batch of boards: from White's side, or from the side to
+    # move when sides (one colour per board) is given. Returns an int64
+    # array, or a list when NumPy is missing.
+    if np is None:
+        sides = sides if sides is not None else [WHITE] * len(batch)
+        return [evaluate_board([code for row in board for code in row] if len(board) == 8 else board, side)
+                for board, side in zip(batch, sides)]
+    boards = _as_boards(batch)
+    codes = boards.astype(np.int64) + 6
+    middlegame = _MIDDLEGAME[codes, _SQUARES].sum(axis=1)
+    endgame = _ENDGAME[codes, _SQUARES].sum(axis=1)
+    phase = np.minimum(_PHASE[codes].sum(axis=1), MAX_PHASE)
+    scores = (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+
+    # Mobility is worked out only for the pieces that have a weight, as
+    # (board, square) pairs, rather than for all 64 squares of every board.
+    board_index, squares = np.nonzero(_MOBILITY[codes])
+    if len(board_index):
+        pieces = boards[board_index, squares].astype(np.int64)
+        signs = np.sign(pieces)
+        ptypes = np.abs(pieces) - 1
+        # Boards get a 65th, off-board square and are read flat, board b's
+        # square s at b * 65 + s; one take is much cheaper than indexing
+        # (board, square) pairs.
+        padded = np.concatenate([boards, np.full((len(boards), 1), _OFF_BOARD_CODE, dtype=np.int8)], axis=1).ravel()
+        offsets = board_index * 65
+
+        # Knights: targets not holding a piece of the knight's side.
+        targets = padded.take(offsets[:, None] + _KNIGHT_INDEX[squares]).astype(np.int64)
+        jumps = ((targets != _OFF_BOARD_CODE) & (targets * signs[:, None] <= 0)).sum(axis=1)
+
+        # Sliders: along each ray, the empty run plus the first piece when it
+        # is an enemy's. Every padded ray has a blocker, so the first nonzero
+        # square's index is the length of the run.
+        rays = padded.take(offsets[:, None, None] + _RAY_INDEX[squares])
+        empty_run = (rays != 0).argmax(axis=2)
+        first = np.take_along_axis(rays, empty_run[..., None], axis=2)[..., 0].astype(np.int64)
+        moves = empty_run + ((first != _OFF_BOARD_CODE) & (first * signs[:, None] < 0))
+        slides = (moves * _RAY_MASK[ptypes]).sum(axis=1)
+
+        mobility = np.where(ptypes == KNIGHT, jumps, slides) * _MOBILITY[pieces + 6] * signs
+        scores += np.bincount(board_index, weights=mobility, minlength=len(boards)).astype(np.int64)
+
+    if sides is not None:
+        scores = np.where(np.asarray(sides) == BLACK, -scores, scores)
+    return scores
+
+
+def evaluate_squares(squares):
+    # Scores from White's side of Position.squares lists; the search batches
+    # copies of the squares rather than whole Positions.
+    if np is None:
+        return [evaluate_board(square_codes(board)) for board in squares]
+    return evaluate_boards(squares_to_boards(squares))
+
+
+def evaluate_positions(positions):
+    # Scores of Positions, each from its side to move.
+    if np is None:
+        return [evaluate_board(board_codes(position), position.side) for position in positions]
+    return evaluate_boards(positions_to_boards(positions), [position.side for position in positions])
+
+
+def main():
+    # Batch analysis: every position of the games in a PGN file, or of the
+    # FENs in a text file (one per line), scored in one call and printed
+    # from White's side.
+    import argparse
+
+    from pgn import read_games, san_to_move
+    parser = argparse.ArgumentParser(description="Score many positions with the batch evaluation")
+    parser.add_argument("file", help="PGN file, or a file of FENs one per line")
+    args = parser.parse_args()
+
+    labels = []
+    positions = []
+    with open(args.file, encoding="utf-8", errors="replace") as source:
+        if args.file.endswith(".pgn"):
+            for number, (tags, sans, _) in enumerate(read_games(source), 1):
+                position = Position.from_fen(tags["FEN"]) if "FEN" in tags else Position.initial()
+                positions.append(position.copy())
+                labels.append(f"game {number} ply 0")
+                for ply, san in enumerate(sans, 1):
+                    move = san_to_move(position, san)
+                    if move is None:
+                        break
+                    position.make_move(move)
+                    positions.append(position.copy())
+                    labels.append(f"game {number} ply {ply} {san}")
+        else:
+            for line in source:
+                if line.strip():
+                    positions.append(Position.from_fen(line.strip()))
+                    labels.append(line.strip())
+    scores = evaluate_positions(positions)
+    for label, position, score in zip(labels, positions, scores):
+        print(f"{int(score) if position.side == WHITE else -int(score):>7}  {label}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
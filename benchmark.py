@@ -0,0 +1,729 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import engine
+from bitboard import Position, generate_pseudo_moves, legal_moves, move_from, move_to, parse_square, row_col
+from parallel import ParallelSearch
+from perft import PERFT_POSITIONS, timed_perft
+from pgn import san_to_move
+from search import Search
+from transposition import TranspositionTable
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+# A metric this much worse than its baseline is reported as a regression.
+REGRESSION_THRESHOLD = 0.15
+# Fresh processes a metric over the threshold is measured again in; it only
+# counts as a regression if none of them does better.
+RETRIES = 2
+# Metrics are rates where higher is better, except times and node counts,
+# which have these suffixes.
+LOWER_IS_BETTER = ("_ms", "_us", "_nodes")
+# Rates and times depend on the machine, so they are compared and stored
+# relative to the legacy generator's speed, measured between the passes of
+# each benchmark: a rate as a multiple of its moves/s, a time as the moves
+# it generates meanwhile. Counts are compared as they are.
+TIME_UNITS = {"_per_s": None, "_ms": 1e-3, "_us": 1e-6}
+
+# Speedup over the legacy list-board generator the bitboard one was to reach.
+MOVEGEN_TARGET = 10
+
+BENCH_POSITIONS = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+]
+
+# The first twenty positions of the Win at Chess suite (Fred Reinfeld's 300
+# tactics, as EPD), with the best move.
+TACTICS_POSITIONS = [
+    ("2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - 0 1", "Qg6"),
+    ("8/7p/5k2/5p2/p1p2P2/Pr1pPK2/1P1R3P/8 b - - 0 1", "Rxb2"),
+    ("5rk1/1ppb3p/p1pb4/6q1/3P1p1r/2P1R2P/PP1BQ1P1/5RKN w - - 0 1", "Rg3"),
+    ("r1bq2rk/pp3pbp/2p1p1pQ/7P/3P4/2PB1N2/PP3PPR/2KR4 w - - 0 1", "Qxh7+"),
+    ("5k2/6pp/p1qN4/1p1p4/3P4/2PKP2Q/PP3r2/3R4 b - - 0 1", "Qc4+"),
+    ("7k/p7/1R5K/6r1/6p1/6P1/8/8 w - - 0 1", "Rb7"),
+    ("rnbqkb1r/pppp1ppp/8/4P3/6n1/7P/PPPNPPP1/R1BQKBNR b KQkq - 0 1", "Ne3"),
+    ("r4q1k/p2bR1rp/2p2Q1N/5p2/5p2/2P5/PP3PPP/R5K1 w - - 0 1", "Rf7"),
+    ("3q1rk1/p4pp1/2pb3p/3p4/6Pr/1PNQ4/P1PB1PP1/4RRK1 b - - 0 1", "Bh2+"),
+    ("2br2k1/2q3rn/p2NppQ1/2p1P3/Pp5R/4P3/1P3PPP/3R2K1 w - - 0 1", "Rxh7"),
+    ("r1b1kb1r/3q1ppp/pBp1pn2/8/Np3P2/5B2/PPP3PP/R2Q1RK1 w kq - 0 1", "Bxc6"),
+    ("4k1r1/2p3r1/1pR1p3/3pP2p/3P2qP/P4N2/1PQ4P/5R1K b - - 0 1", "Qxf3+"),
+    ("5rk1/pp4p1/2n1p2p/2Npq3/2p5/6P1/P3P1BP/R4Q1K w - - 0 1", "Qxf8+"),
+    ("r2rb1k1/pp1q1p1p/2n1p1p1/2bp4/5P2/PP1BPR1Q/1BPN2PP/R5K1 w - - 0 1", "Qxh7+"),
+    ("1R6/1brk2p1/4p2p/p1P1Pp2/P7/6P1/1P4P1/2R3K1 w - - 0 1", "Rxb7"),
+    ("r4rk1/ppp2ppp/2n5/2bqp3/8/P2PB3/1PP1NPPP/R2Q1RK1 w - - 0 1", "Nc3"),
+    ("1k5r/pppbn1pp/4q1r1/1P3p2/2NPp3/1QP5/P4PPP/R1B1R1K1 w - - 0 1", "Ne5"),
+    ("R7/P4k2/8/8/8/8/r7/6K1 w - - 0 1", "Rh8"),
+    ("r1b2rk1/ppbn1ppp/4p3/1QP4q/3P4/N4N2/5PPP/R1B2RK1 w - - 0 1", "c6"),
+    ("r2qkb1r/1ppb1ppp/p7/4p3/P1Q1P3/2P5/5PPP/R1B2KNR b kq - 0 1", "Bb5"),
+]
+
+
+# Frozen copies of the original list-of-strings generator and check test,
+# verbatim, kept only as the baseline the bitboard code is measured against.
+# They read these two globals of the original GUI; the benchmark passes no
+# last move.
+BOARD_SIZE = 8
+last_move = None
+
+
+def legacy_get_legal_moves(board, row, col, current_player):
+    moves = []
+    piece = board[row][col]
+    if not piece or piece[0] != current_player:
+        return moves
+
+    def is_valid_move(r, c):
+        return 0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE
+
+    def is_empty_or_opponent(r, c, player):
+        target_piece = board[r][c]
+        return not target_piece or target_piece[0] != player
+
+    if piece[1] == 'P':
+        direction = -1 if current_player == 'w' else 1
+        new_row = row + direction
+        if is_valid_move(new_row, col) and not board[new_row][col]:
+            moves.append((new_row, col))
+            if (row == 6 and current_player == 'w') or (row == 1 and current_player == 'b'):
+                new_row_2 = row + 2 * direction
+                if not board[new_row_2][col] and not board[new_row][col]:
+                    moves.append((new_row_2, col))
+        new_row = row + direction
+        new_col_left = col - 1
+        if is_valid_move(new_row, new_col_left) and board[new_row][new_col_left] and board[new_row][new_col_left][0] != current_player:
+            moves.append((new_row, new_col_left))
+        new_col_right = col + 1
+        if is_valid_move(new_row, new_col_right) and board[new_row][new_col_right] and board[new_row][new_col_right][0] != current_player:
+            moves.append((new_row, new_col_right))
+        if last_move and last_move[0][1] != last_move[1][1]:
+            en_passant_row = last_move[1][0]
+            en_passant_col = last_move[1][1]
+            if row == en_passant_row - direction and (col - 1 == en_passant_col or col + 1 == en_passant_col):
+                moves.append((en_passant_row + direction, en_passant_col))
+
+    elif piece[1] == 'R':
+        directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+        for dr, dc in directions:
+            for i in range(1, BOARD_SIZE):
+                new_row, new_col = row + i * dr, col + i * dc
+                if not is_valid_move(new_row, new_col):
+                    break
+                if is_empty_or_opponent(new_row, new_col, current_player):
+                    moves.append((new_row, new_col))
+                if board[new_row][new_col]:
+                    break
+
+    elif piece[1] == 'N':
+        knight_moves = [
+            (-2, -1), (-2, 1), (-1, -2), (-1, 2),
+            (1, -2), (1, 2), (2, -1), (2, 1),
+        ]
+        for dr, dc in knight_moves:
+            new_row, new_col = row + dr, col + dc
+            if is_valid_move(new_row, new_col) and is_empty_or_opponent(new_row, new_col, current_player):
+                moves.append((new_row, new_col))
+
+    elif piece[1] == 'B':
+        directions = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+        for dr, dc in directions:
+            for i in range(1, BOARD_SIZE):
+                new_row, new_col = row + i * dr, col + i * dc
+                if not is_valid_move(new_row, new_col):
+                    break
+                if is_empty_or_opponent(new_row, new_col, current_player):
+                    moves.append((new_row, new_col))
+                if board[new_row][new_col]:
+                    break
+
+    elif piece[1] == 'Q':
+        directions = [(0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1)]
+        for dr, dc in directions:
+            for i in range(1, BOARD_SIZE):
+                new_row, new_col = row + i * dr, col + i * dc
+                if not is_valid_move(new_row, new_col):
+                    break
+                if is_empty_or_opponent(new_row, new_col, current_player):
+                    moves.append((new_row, new_col))
+                if board[new_row][new_col]:
+                    break
+
+    elif piece[1] == 'K':
+        king_moves = [
+            (0, 1), (0, -1), (1, 0), (-1, 0),
+            (1, 1), (1, -1), (-1, 1), (-1, -1),
+        ]
+        for dr, dc in king_moves:
+            new_row, new_col = row + dr, col + dc
+            if is_valid_move(new_row, new_col) and is_empty_or_opponent(new_row, new_col, current_player):
+                moves.append((new_row, new_col))
+        if piece[0] == 'w' and row == 7:
+            if board[7][4] == 'wK':
+                if board[7][0] == 'wR' and board[7][1] == '' and board[7][2] == '' and board[7][3] == '':
+                    moves.append((7, 2))
+                if board[7][7] == 'wR' and board[7][5] == '' and board[7][6] == '':
+                    moves.append((7, 6))
+        elif piece[0] == 'b' and row == 0:
+            if board[0][4] == 'bK':
+                if board[0][0] == 'bR' and board[0][1] == '' and board[0][2] == '' and board[0][3] == '':
+                    moves.append((0, 2))
+                if board[0][7] == 'bR' and board[0][5] == '' and board[0][6] == '':
+                    moves.append((0, 6))
+
+    return moves
+
+
+def legacy_all_moves(board, player):
+    moves = []
+    for r in range(8):
+        for c in range(8):
+            if board[r][c] and board[r][c][0] == player:
+                for move in legacy_get_legal_moves(board, r, c, player):
+                    moves.append((r, c, move[0], move[1]))
+    return moves
+
+
+def legacy_is_check(board, player):
+    king_pos = None
+    for r in range(BOARD_SIZE):
+        for c in range(BOARD_SIZE):
+            if board[r][c] and board[r][c][0] == player and board[r][c][1] == 'K':
+                king_pos = (r, c)
+                break
+        if king_pos:
+            break
+
+    if not king_pos:
+        return False
+
+    opponent = 'b' if player == 'w' else 'w'
+    for r in range(BOARD_SIZE):
+        for c in range(BOARD_SIZE):
+            if board[r][c] and board[r][c][0] == opponent:
+                opponent_moves = legacy_get_legal_moves(board, r, c, opponent)
+                if king_pos in opponent_moves:
+                    return True
+    return False
+
+
+# The legacy generator's speed on BENCH_POSITIONS, in moves/s, measured in
+# passes between the current benchmark's own: the reference its rates and
+# times are expressed against (see TIME_UNITS).
+reference_rates = []
+_reference_boards = None
+
+
+def reference_pass():
+    global _reference_boards
+    if _reference_boards is None:
+        positions = [Position.from_fen(fen) for fen in BENCH_POSITIONS]
+        _reference_boards = [(position.to_board(), 'wb'[position.side]) for position in positions]
+    count = 0
+    start = time.perf_counter()
+    for board, player in _reference_boards:
+        count += len(legacy_all_moves(board, player))
+    reference_rates.append(count / (time.perf_counter() - start))
+
+
+def reference_passes(seconds):
+    # Reference passes for seconds, next to a measurement that took as long.
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        reference_pass()
+
+
+# Shortest stretch of calls timed at once. A single sweep over a handful of
+# positions is over in microseconds, while the caches still hold the
+# reference pass's code and data rather than the function's.
+PASS_SECONDS = 0.005
+
+
+def sweeps_per_pass(function, arguments):
+    start = time.perf_counter()
+    for args in arguments:
+        function(*args)
+    return max(1, int(PASS_SECONDS / (time.perf_counter() - start)))
+
+
+def timed_pass(function, arguments, sweeps):
+    # Seconds per sweep over the arguments, over a pass of sweeps of them.
+    start = time.perf_counter()
+    for _ in range(sweeps):
+        for args in arguments:
+            function(*args)
+    return (time.perf_counter() - start) / sweeps
+
+
+def sweep_seconds(function, arguments, seconds):
+    # Median time of one sweep over the arguments, timed in passes of
+    # PASS_SECONDS or more, each after a reference pass so that the two see
+    # the same conditions.
+    sweeps = sweeps_per_pass(function, arguments)
+    times = []
+    deadline = time.perf_counter() + seconds
+    while True:
+        reference_pass()
+        times.append(timed_pass(function, arguments, sweeps))
+        if time.perf_counter() >= deadline:
+            return statistics.median(times)
+
+
+def calls_per_second(function, arguments, seconds):
+    return len(arguments) / sweep_seconds(function, arguments, seconds)
+
+
+def bench_movegen(args):
+    positions = [Position.from_fen(fen) for fen in BENCH_POSITIONS]
+    boards = [(position.to_board(), 'wb'[position.side]) for position in positions]
+    single = [(position,) for position in positions]
+    generators = [("legacy list board", legacy_all_moves, boards),
+                  ("bitboard pseudo", generate_pseudo_moves, single),
+                  ("bitboard legal", legal_moves, single)]
+
+    # The generators take turns, a pass each, and a speedup is the median
+    # over the turns of a generator's rate over the legacy one's in the same
+    # turn: measured one after the other, they would see the machine run at
+    # different speeds. The legacy passes are the reference passes too.
+    counts = [sum(len(generate(*args)) for args in arguments) for _, generate, arguments in generators]
+    sweeps = [sweeps_per_pass(generate, arguments) for _, generate, arguments in generators]
+    times = [[] for _ in generators]
+    deadline = time.perf_counter() + args.seconds * len(generators)
+    while not times[0] or time.perf_counter() < deadline:
+        for (_, generate, arguments), passes, count in zip(generators, times, sweeps):
+            passes.append(timed_pass(generate, arguments, count))
+    reference_rates.extend(counts[0] / seconds for seconds in times[0])
+
+    legacy_rate = statistics.median(reference_rates)
+    rates = []
+    print(f"{'generator':<22}{'moves/s':>14}{'us/position':>14}{'speedup':>10}")
+    for (name, _, _), count, passes in zip(generators, counts, times):
+        speedup = statistics.median(legacy / seconds * count / counts[0] for legacy, seconds in zip(times[0], passes))
+        rates.append(speedup * legacy_rate)
+        print(f"{name:<22}{count / statistics.median(passes):>14,.0f}"
+              f"{statistics.median(passes) / len(positions) * 1e6:>14.1f}{speedup:>9.1f}x")
+    # The legacy generator is pseudo-legal, so the target is for the
+    # pseudo-legal one; the legal one also rejects the moves that leave the
+    # king in check.
+    speedup = rates[1] / legacy_rate
+    verdict = "met" if speedup >= MOVEGEN_TARGET else "MISSED"
+    print(f"{MOVEGEN_TARGET}x target: {verdict} ({speedup:.1f}x)")
+    return {"movegen.pseudo_moves_per_s": rates[1], "movegen.legal_moves_per_s": rates[2]}
+
+
+def bench_check(args):
+    seconds = args.seconds
+    positions = [Position.from_fen(fen) for fen in BENCH_POSITIONS]
+    legacy = [(position.to_board(), 'wb'[position.side]) for position in positions]
+    bitboard = [(position, position.side) for position in positions]
+
+    legacy_rate = calls_per_second(legacy_is_check, legacy, seconds)
+    bitboard_rate = calls_per_second(Position.in_check, bitboard, seconds)
+
+    print(f"{'is_check':<22}{'calls/s':>14}{'us/call':>14}{'speedup':>10}")
+    for name, rate in (("legacy list board", legacy_rate), ("square_attacked", bitboard_rate)):
+        print(f"{name:<22}{rate:>14,.0f}{1e6 / rate:>14.2f}{rate / legacy_rate:>9.1f}x")
+    return {"check.in_check_us": 1e6 / bitboard_rate}
+
+
+# Depth per perft position, chosen so that each takes a fraction of a second.
+PERFT_DEPTHS = {"start": 4, "kiwipete": 3, "endgame": 4, "promotions": 3, "middlegame": 3}
+
+
+def bench_perft(args):
+    print(f"{'perft':<12}{'depth':>6}{'nodes':>12}{'nodes/s':>14}")
+    total_nodes = 0
+    total_seconds = 0.0
+    for name, depth in PERFT_DEPTHS.items():
+        fen, counts = PERFT_POSITIONS[name]
+        runs = []
+        for _ in range(3):
+            nodes, run_seconds = timed_perft(fen, depth)
+            reference_passes(run_seconds)
+            runs.append(run_seconds)
+        seconds = statistics.median(runs)
+        if nodes != counts[depth - 1]:
+            raise SystemExit(f"perft {name} depth {depth}: {nodes} nodes, expected {counts[depth - 1]}")
+        total_nodes += nodes
+        total_seconds += seconds
+        print(f"{name:<12}{depth:>6}{nodes:>12,}{nodes / seconds:>14,.0f}")
+    print(f"{'total':<12}{'':>6}{total_nodes:>12,}{total_nodes / total_seconds:>14,.0f}")
+    return {"perft.nodes_per_s": total_nodes / total_seconds}
+
+
+# The king walks out and back, which loses White the right to castle though
+# the pieces end up where castling needs them.
+KING_WALK = ["e2e4", "e7e5", "g1f3", "b8c6", "f1c4", "g8f6", "e1e2", "f6g8", "e2e1", "g8f6"]
+
+
+def check_api():
+    # The GUI calls must know more than a list board shows: replays
+    # KING_WALK through them and checks White is not offered castling.
+    position = Position.initial()
+    for text in KING_WALK:
+        start, end = row_col(parse_square(text[:2])), row_col(parse_square(text[2:]))
+        if not engine.move_piece(position, *start, *end):
+            raise SystemExit(f"api: {text} refused after {' '.join(KING_WALK[:KING_WALK.index(text)])}")
+    targets = engine.get_legal_moves(position, 7, 4)
+    if (7, 6) in targets or (7, 2) in targets:
+        raise SystemExit(f"api: castling offered after the king has moved ({' '.join(KING_WALK)})")
+
+
+def bench_api(args):
+    # The GUI-facing calls, with the status cache emptied before every call
+    # so each one pays for a fresh position.
+    check_api()
+    seconds = args.seconds
+    positions = [(Position.from_fen(fen),) for fen in BENCH_POSITIONS]
+    first_moves = [row_col(move_from(legal_moves(position)[0])) + row_col(move_to(legal_moves(position)[0]))
+                   for position, in positions]
+
+    def get_legal_moves(position, row, col):
+        engine.STATUS_CACHE.clear()
+        return engine.get_legal_moves(position, row, col)
+
+    def move_piece(position, start_row, start_col, end_row, end_col):
+        engine.STATUS_CACHE.clear()
+        return engine.move_piece(position.copy(), start_row, start_col, end_row, end_col)
+
+    def is_check(position):
+        engine.STATUS_CACHE.clear()
+        return engine.is_check(position, 'wb'[position.side])
+
+    metrics = {}
+    print(f"{'engine call':<22}{'calls/s':>14}{'us/call':>14}")
+    for name, function, arguments in (
+            ("get_legal_moves", get_legal_moves,
+             [position + move[:2] for position, move in zip(positions, first_moves)]),
+            ("move_piece", move_piece, [position + move for position, move in zip(positions, first_moves)]),
+            ("is_check", is_check, positions)):
+        rate = calls_per_second(function, arguments, seconds)
+        metrics[f"api.{name}_us"] = 1e6 / rate
+        print(f"{name:<22}{rate:>14,.0f}{1e6 / rate:>14.1f}")
+    return metrics
+
+
+def bench_search(args):
+    # The single-process search at a fixed depth from an empty table, so
+    # that the node count is the same on every run.
+    positions = [Position.from_fen(fen) for fen in BENCH_POSITIONS]
+    table = TranspositionTable(engine.AI_HASH_MB)
+    nodes = 0
+    seconds = 0.0
+    for position in positions:
+        # Each position is searched three times, by a fresh search so that
+        # the runs are the same, and the median run counted.
+        runs = []
+        for _ in range(3):
+            table.clear()
+            search = Search(table)
+            start = time.perf_counter()
+            search.run(position, depth=args.depth)
+            runs.append(time.perf_counter() - start)
+            reference_passes(runs[-1])
+        nodes += search.nodes
+        seconds += statistics.median(runs)
+    print(f"search, depth {args.depth}, {len(positions)} positions: {nodes:,} nodes in {seconds:.2f}s, "
+          f"{nodes / seconds:,.0f} nodes/s")
+    return {"search.nodes_per_s": nodes / seconds}
+
+
+def bench_tactics(args):
+    # The tactical suite at a fixed depth, with leaves scored statically and
+    # with the quiescence search. A position counts as solved when the
+    # search plays the suite's move; "nodes to solve" adds up the nodes
+    # searched until the iteration that first found it, over the positions
+    # solved in both modes.
+    suite = []
+    for fen, san in TACTICS_POSITIONS:
+        position = Position.from_fen(fen)
+        suite.append((position, san_to_move(position, san)))
+
+    results = {}
+    for name, quiescence in (("static leaves", False), ("quiescence", True)):
+        search = Search(TranspositionTable(engine.AI_HASH_MB), quiescence=quiescence)
+        found_at = []
+        nodes = 0
+        start = time.perf_counter()
+        for position, best in suite:
+            search.table.clear()
+            solve_nodes = []
+            search.run(position.copy(), depth=args.depth,
+                       on_iteration=lambda search: solve_nodes.append(search.nodes if search.best_move == best else None))
+            nodes += search.nodes
+            # Nodes up to the iteration from which the move stayed found.
+            solved = None
+            for count in reversed(solve_nodes):
+                if count is None:
+                    break
+                solved = count
+            found_at.append(solved)
+        results[name] = (found_at, nodes, time.perf_counter() - start)
+
+    both = [index for index in range(len(suite)) if all(found[index] is not None for found, _, _ in results.values())]
+    print(f"tactics, {len(suite)} positions, depth {args.depth}")
+    print(f"{'leaves':<16}{'solved':>8}{'nodes':>12}{'nodes to solve':>16}{'seconds':>10}")
+    for name, (found_at, nodes, seconds) in results.items():
+        solved = sum(count is not None for count in found_at)
+        print(f"{name:<16}{solved:>8}{nodes:>12,}{sum(found_at[index] for index in both):>16,}{seconds:>10.2f}")
+    found_at, nodes, _ = results["quiescence"]
+    return {"tactics.solved": sum(count is not None for count in found_at), "tactics.total_nodes": nodes}
+
+
+def bench_parallel(args):
+    counts = sorted({count for count in (1, 2, 4, 8, 16, 32, 64) if count <= args.workers} | {args.workers})
+    positions = [Position.from_fen(fen) for fen in BENCH_POSITIONS]
+
+    print(f"parallel search, depth {args.depth}, {len(positions)} positions")
+    print(f"{'workers':<10}{'seconds':>10}{'nodes':>12}{'nodes/s':>12}{'speedup':>10}  matches")
+    reference = None
+    base_time = None
+    for count in counts:
+        # Pool start-up is not part of the measurement.
+        with ParallelSearch(workers=count) as search:
+            if search.executor is not None:
+                list(search.executor.map(abs, range(count)))
+            results = []
+            nodes = 0
+            start = time.perf_counter()
+            for position in positions:
+                search.table.clear()
+                results.append(search.run(position, depth=args.depth))
+                nodes += search.nodes
+            seconds = time.perf_counter() - start
+        if reference is None:
+            reference = results
+            base_time = seconds
+        matches = sum(result == expected for result, expected in zip(results, reference))
+        print(f"{count:<10}{seconds:>10.2f}{nodes:>12,}{nodes / seconds:>12,.0f}{base_time / seconds:>9.2f}x"
+              f"  {matches}/{len(positions)}")
+    # Speedups depend on the core count, so nothing is tracked against the baseline.
+    return {}
+
+
+def leaf_positions(fens):
+    # Every position two plies from each of fens: a search frontier's worth
+    # of boards.
+    leaves = []
+    for fen in fens:
+        position = Position.from_fen(fen)
+        for move in legal_moves(position):
+            position.make_move(move)
+            for reply in legal_moves(position):
+                position.make_move(reply)
+                leaves.append(position.copy())
+                position.unmake_move()
+            position.unmake_move()
+    return leaves
+
+
+def bench_batcheval(args):
+    # batch_eval's scalar path against its NumPy path on the same boards,
+    # whole-batch and in frontier-sized chunks (one node's children).
+    import batch_eval
+    positions = leaf_positions(BENCH_POSITIONS)
+    boards = [batch_eval.board_codes(position) for position in positions]
+    scalar_rate = calls_per_second(batch_eval.evaluate_board, [(board,) for board in boards], args.seconds)
+    rates = [("scalar evaluate_board", scalar_rate)]
+    metrics = {"batcheval.scalar_positions_per_s": scalar_rate}
+    if batch_eval.np is not None:
+        array = batch_eval.positions_to_boards(positions)
+        expected = [batch_eval.evaluate_board(board) for board in boards]
+        if batch_eval.evaluate_boards(array).tolist() != expected:
+            raise SystemExit("batcheval: NumPy scores differ from the scalar path")
+        chunks = [(array[start:start + 32],) for start in range(0, len(array), 32)]
+        whole_rate = calls_per_second(batch_eval.evaluate_boards, [(array,)], args.seconds) * len(array)
+        chunk_rate = calls_per_second(batch_eval.evaluate_boards, chunks, args.seconds) * len(array) / len(chunks)
+        rates += [(f"numpy, batch {len(array)}", whole_rate), ("numpy, batch 32", chunk_rate)]
+        metrics["batcheval.numpy_positions_per_s"] = whole_rate
+
+    print(f"batch evaluation of {len(positions):,} leaf positions")
+    print(f"{'path':<22}{'positions/s':>14}{'us/position':>14}{'speedup':>10}")
+    for name, rate in rates:
+        print(f"{name:<22}{rate:>14,.0f}{1e6 / rate:>14.2f}{rate / scalar_rate:>9.1f}x")
+    return metrics
+
+
+IMPORT_SCRIPT = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import {module}\n"
+    "print(time.perf_counter() - start, 'pygame' in sys.modules)\n"
+)
+
+
+def bench_import(args):
+    # Each import runs in a fresh interpreter; the first run is a warm-up
+    # (it writes the bytecode cache where allowed), and the fastest of the
+    # others is reported.
+    metrics = {}
+    print(f"{'module':<22}{'ms':>14}  pygame loaded")
+    for module in ("engine", "chessapp"):
+        command = [sys.executable, "-c", IMPORT_SCRIPT.format(module=module)]
+        subprocess.run(command, check=True, capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        times = []
+        for _ in range(5):
+            output = subprocess.run(command, check=True, capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+            times.append(float(output[0]))
+        print(f"{module:<22}{min(times) * 1000:>14.1f}  {output[1] == 'True'}")
+        metrics[f"import.{module}_ms"] = min(times) * 1000
+    return metrics
+
+
+BENCHMARKS = {
+    "movegen": bench_movegen,
+    "check": bench_check,
+    "perft": bench_perft,
+    "api": bench_api,
+    "search": bench_search,
+    "tactics": bench_tactics,
+    "parallel": bench_parallel,
+    "batcheval": bench_batcheval,
+    "import": bench_import,
+}
+
+
+def relative(metrics, reference):
+    # metrics with rates and times expressed against reference (see
+    # TIME_UNITS).
+    scaled = {}
+    for name, value in metrics.items():
+        for suffix, unit in TIME_UNITS.items():
+            if name.endswith(suffix):
+                value = value / reference if unit is None else value * unit * reference
+                break
+        scaled[name] = value
+    return scaled
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, baseline, metrics):
+    baseline = dict(baseline, **{name: float(f"{value:.4g}") if isinstance(value, float) else value
+                                 for name, value in metrics.items()})
+    with open(path, "w") as f:
+        json.dump(dict(sorted(baseline.items())), f, indent=2)
+        f.write("\n")
+    print(f"Baseline saved to {path}")
+
+
+def best_of(metrics, other):
+    # Each metric at the better of its two values.
+    best = dict(metrics)
+    for name, value in other.items():
+        if name in best:
+            value = (min if name.endswith(LOWER_IS_BETTER) else max)(best[name], value)
+        best[name] = value
+    return best
+
+
+def rerun(names, args):
+    # The relative metrics of benchmarks names, run in a fresh process: the
+    # speed of pure Python code shifts with each process's memory layout, by
+    # more than the regression threshold on some machines.
+    path = os.path.join(os.path.dirname(BASELINE_FILE), f".benchmark-{os.getpid()}.json")
+    command = [sys.executable, os.path.abspath(__file__), *names, "--seconds", str(args.seconds),
+               "--depth", str(args.depth), "--workers", str(args.workers), "--retries", "0", "--json", path]
+    try:
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(path) as f:
+            return json.load(f)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def compare(metrics, baseline, threshold):
+    # Prints each metric against its baseline and returns the names of the
+    # ones that got worse by more than threshold.
+    regressions = []
+    print(f"{'metric':<34}{'baseline':>14}{'now':>14}{'change':>10}")
+    for name, value in metrics.items():
+        if name not in baseline:
+            print(f"{name:<34}{'-':>14}{value:>14,.4g}")
+            continue
+        base = baseline[name]
+        change = value / base - 1
+        if name.endswith(LOWER_IS_BETTER):
+            change = -change if base else 0.0
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<34}{base:>14,.4g}{value:>14,.4g}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chess engine benchmarks")
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark",
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--seconds", type=float, default=2.0, help="time spent on each measurement")
+    parser.add_argument("--depth", type=int, default=4, help="search depth for search benchmarks")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="largest worker count for the parallel benchmark")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store this run's results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="fractional slowdown reported as a regression")
+    parser.add_argument("--retries", type=int, default=RETRIES,
+                        help="fresh processes a regression is re-measured in before it is reported")
+    parser.add_argument("--json", metavar="PATH", help="also write this run's metrics to PATH")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {name}")
+    metrics = {}
+    for name in args.benchmarks or BENCHMARKS:
+        reference_rates.clear()
+        measured = BENCHMARKS[name](args)
+        if measured:
+            if not reference_rates:
+                reference_passes(args.seconds / 2)
+            reference = statistics.median(reference_rates)
+            metrics.update(relative(measured, reference))
+            print(f"reference: legacy generator at {reference:,.0f} moves/s")
+        print()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(metrics, f)
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if args.save_baseline:
+        # The median over this process and the retries, against which a
+        # comparison goes by the best of as many: only a slowdown beyond the
+        # spread between processes is reported.
+        names = [name for name in args.benchmarks or BENCHMARKS if name != "parallel"]
+        runs = [metrics] + [rerun(names, args) for _ in range(args.retries)]
+        metrics = {name: statistics.median(run[name] for run in runs) for name in metrics}
+        save_baseline(args.baseline, baseline, metrics)
+        return 0
+    regressions = compare(metrics, baseline, args.threshold)
+    for _ in range(args.retries):
+        if not regressions:
+            break
+        names = sorted({name.split(".")[0] for name in regressions})
+        print(f"\nMeasuring {', '.join(names)} again in a fresh process")
+        metrics = best_of(metrics, rerun(names, args))
+        regressions = compare(metrics, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
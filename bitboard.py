@@ -0,0 +1,912 @@
+import random
+
+from profiling import profiled
+from psqt import (ENDGAME_TABLES, ENDGAME_VALUES, MIDDLEGAME_TABLES, MIDDLEGAME_VALUES, PHASE_WEIGHTS, pack_score)
+
+WHITE = 0
+BLACK = 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+EMPTY = -1
+
+COLOR_CHARS = 'wb'
+PIECE_CHARS = 'PNBRQK'
+FEN_CHARS = 'PNBRQKpnbrqk'
+FILE_CHARS = 'abcdefgh'
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+FULL = (1 << 64) - 1
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+NOT_FILE_A = FULL ^ FILE_A
+NOT_FILE_H = FULL ^ FILE_H
+RANK_1 = 0xFF
+RANK_3 = RANK_1 << 16
+RANK_6 = RANK_1 << 40
+RANK_8 = RANK_1 << 56
+PROMOTION_RANKS = RANK_1 | RANK_8
+
+WHITE_OO = 1
+WHITE_OOO = 2
+BLACK_OO = 4
+BLACK_OOO = 8
+
+# A move is a plain int: from | to << 6 | promotion piece type << 12 | flags.
+PROMOTION_SHIFT = 12
+FLAG_CAPTURE = 1 << 15
+FLAG_EN_PASSANT = 1 << 16
+FLAG_CASTLE = 1 << 17
+FLAG_DOUBLE_PUSH = 1 << 18
+
+
+def square(row, col):
+    return (7 - row) * 8 + col
+
+
+def row_col(sq):
+    return 7 - (sq >> 3), sq & 7
+
+
+def square_name(sq):
+    return FILE_CHARS[sq & 7] + str((sq >> 3) + 1)
+
+
+def parse_square(name):
+    return (int(name[1]) - 1) * 8 + FILE_CHARS.index(name[0])
+
+
+def move_from(move):
+    return move & 63
+
+
+def move_to(move):
+    return (move >> 6) & 63
+
+
+def move_promotion(move):
+    return (move >> PROMOTION_SHIFT) & 7
+
+
+def move_to_uci(move):
+    text = square_name(move & 63) + square_name((move >> 6) & 63)
+    promotion = (move >> PROMOTION_SHIFT) & 7
+    if promotion:
+        text += PIECE_CHARS[promotion].lower()
+    return text
+
+
+def _step_table(steps):
+    table = []
+    for sq in range(64):
+        rank, file = sq >> 3, sq & 7
+        bb = 0
+        for df, dr in steps:
+            f, r = file + df, rank + dr
+            if 0 <= f < 8 and 0 <= r < 8:
+                bb |= 1 << (r * 8 + f)
+        table.append(bb)
+    return table
+
+
+def _ray_table(df, dr):
+    table = []
+    for sq in range(64):
+        rank, file = sq >> 3, sq & 7
+        bb = 0
+        f, r = file + df, rank + dr
+        while 0 <= f < 8 and 0 <= r < 8:
+            bb |= 1 << (r * 8 + f)
+            f, r = f + df, r + dr
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _step_table([(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)])
+KING_ATTACKS = _step_table([(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)])
+# Squares attacked by a pawn of each colour standing on a square.
+PAWN_ATTACKS = [_step_table([(-1, 1), (1, 1)]), _step_table([(-1, -1), (1, -1)])]
+
+# Rays going towards higher square indices find their nearest blocker with the
+# lowest set bit, the others with the highest set bit.
+RAY_N = _ray_table(0, 1)
+RAY_NE = _ray_table(1, 1)
+RAY_E = _ray_table(1, 0)
+RAY_NW = _ray_table(-1, 1)
+RAY_S = _ray_table(0, -1)
+RAY_SW = _ray_table(-1, -1)
+RAY_W = _ray_table(-1, 0)
+RAY_SE = _ray_table(1, -1)
+
+
+
+def _between_table():
+    # BETWEEN[a * 64 + b]: the squares strictly between a and b when they
+    # share a rank, file or diagonal, otherwise none.
+    table = [0] * (64 * 64)
+    for ray in (RAY_N, RAY_NE, RAY_E, RAY_NW, RAY_S, RAY_SW, RAY_W, RAY_SE):
+        for frm in range(64):
+            targets = ray[frm]
+            while targets:
+                bit = targets & -targets
+                to = bit.bit_length() - 1
+                table[frm * 64 + to] = ray[frm] ^ ray[to] ^ bit
+                targets ^= bit
+    return table
+
+
+BETWEEN = _between_table()
+
+# Castling rights that survive a move touching each square.
+CASTLING_MASK = [15] * 64
+CASTLING_MASK[0] = 15 ^ WHITE_OOO
+CASTLING_MASK[4] = 15 ^ (WHITE_OO | WHITE_OOO)
+CASTLING_MASK[7] = 15 ^ WHITE_OO
+CASTLING_MASK[56] = 15 ^ BLACK_OOO
+CASTLING_MASK[60] = 15 ^ (BLACK_OO | BLACK_OOO)
+CASTLING_MASK[63] = 15 ^ BLACK_OO
+
+# King destination -> (rook from, rook to).
+CASTLING_ROOKS = {6: (7, 5), 2: (0, 3), 62: (63, 61), 58: (56, 59)}
+
+# Zobrist keys, fixed by seed so hashes are stable between runs and processes.
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST_PIECES = [_zobrist_random.getrandbits(64) for _ in range(12 * 64)]
+ZOBRIST_SIDE = _zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = [_zobrist_random.getrandbits(64) for _ in range(16)]
+ZOBRIST_EP = [_zobrist_random.getrandbits(64) for _ in range(8)]
+
+
+def _piece_square_scores():
+    # Packed material plus piece-square score by code * 64 + square, positive
+    # for White's pieces and negative for Black's. The tables are printed a8
+    # first, so White's square sq is entry sq ^ 56 and Black's is entry sq.
+    scores = [0] * (12 * 64)
+    for ptype in range(6):
+        for sq in range(64):
+            scores[ptype * 64 + sq] = pack_score(MIDDLEGAME_VALUES[ptype] + MIDDLEGAME_TABLES[ptype][sq ^ 56],
+                                                 ENDGAME_VALUES[ptype] + ENDGAME_TABLES[ptype][sq ^ 56])
+            scores[(6 + ptype) * 64 + sq] = -pack_score(MIDDLEGAME_VALUES[ptype] + MIDDLEGAME_TABLES[ptype][sq],
+                                                        ENDGAME_VALUES[ptype] + ENDGAME_TABLES[ptype][sq])
+    return scores
+
+
+PIECE_SQUARE_SCORES = _piece_square_scores()
+PHASES = PHASE_WEIGHTS * 2
+
+
+# Only the inner squares of a ray can block it, so the attack set of a slider
+# depends on occupancy & mask alone. Every such masked occupancy is computed
+# up front, per square, with its attack set (a stand-in for magic bitboard
+# tables): a ray's inner squares give each of its blocker subsets, and the
+# subsets of a square's rays combine into its masked occupancies.
+EDGES_RANKS = RANK_1 | RANK_8
+EDGES_FILES = FILE_A | FILE_H
+ROOK_RAYS = ((RAY_N, True, RANK_8), (RAY_E, True, FILE_H), (RAY_S, False, RANK_1), (RAY_W, False, FILE_A))
+BISHOP_RAYS = tuple((table, positive, EDGES_RANKS | EDGES_FILES)
+                    for table, positive in ((RAY_NE, True), (RAY_NW, True), (RAY_SE, False), (RAY_SW, False)))
+
+
+def _slider_table(sq, rays):
+    entries = [(0, 0)]
+    for table, positive, edge in rays:
+        ray = table[sq]
+        inner = ray & ~edge
+        blocked = []
+        subset = 0
+        while True:
+            attacks = ray
+            if subset:
+                nearest = (subset & -subset).bit_length() - 1 if positive else subset.bit_length() - 1
+                attacks ^= table[nearest]
+            blocked.append((subset, attacks))
+            subset = (subset - inner) & inner
+            if not subset:
+                break
+        entries = [(occ | subset, attacks | ray_attacks) for occ, attacks in entries for subset, ray_attacks in blocked]
+    return dict(entries)
+
+
+ROOK_MASKS = [(RAY_N[sq] & ~RANK_8) | (RAY_S[sq] & ~RANK_1) | (RAY_E[sq] & ~FILE_H) | (RAY_W[sq] & ~FILE_A)
+              for sq in range(64)]
+BISHOP_MASKS = [(RAY_NE[sq] | RAY_NW[sq] | RAY_SE[sq] | RAY_SW[sq]) & ~(EDGES_RANKS | EDGES_FILES)
+                for sq in range(64)]
+ROOK_TABLES = [_slider_table(sq, ROOK_RAYS) for sq in range(64)]
+BISHOP_TABLES = [_slider_table(sq, BISHOP_RAYS) for sq in range(64)]
+# Attacks on an empty board, where pinners and x-rays are looked for.
+ROOK_LINES = [table[0] for table in ROOK_TABLES]
+BISHOP_LINES = [table[0] for table in BISHOP_TABLES]
+
+
+def rook_attacks(sq, occ):
+    return ROOK_TABLES[sq][occ & ROOK_MASKS[sq]]
+
+
+def bishop_attacks(sq, occ):
+    return BISHOP_TABLES[sq][occ & BISHOP_MASKS[sq]]
+
+
+def pawn_attacks_bb(pawns, color):
+    if color == WHITE:
+        return (((pawns & NOT_FILE_A) << 7) | ((pawns & NOT_FILE_H) << 9)) & FULL
+    return ((pawns & NOT_FILE_H) >> 7) | ((pawns & NOT_FILE_A) >> 9)
+
+
+def square_attacked(position, sq, by_color, occ=None):
+    # A square is attacked by a piece exactly when the same piece standing on
+    # the square would attack it back, so each piece type costs one table or
+    # ray lookup from the square itself instead of a scan of the attackers.
+    pieces = position.pieces[by_color]
+    if PAWN_ATTACKS[by_color ^ 1][sq] & pieces[PAWN] or KNIGHT_ATTACKS[sq] & pieces[KNIGHT]:
+        return True
+    if KING_ATTACKS[sq] & pieces[KING]:
+        return True
+    if occ is None:
+        occ = position.occupied[0] | position.occupied[1]
+    bishops = pieces[BISHOP] | pieces[QUEEN]
+    if bishops and BISHOP_TABLES[sq][occ & BISHOP_MASKS[sq]] & bishops:
+        return True
+    rooks = pieces[ROOK] | pieces[QUEEN]
+    return bool(rooks and ROOK_TABLES[sq][occ & ROOK_MASKS[sq]] & rooks)
+
+
+def attackers_to(position, sq, occ):
+    # Pieces of both sides attacking sq, with sliders seen through occ.
+    white = position.pieces[WHITE]
+    black = position.pieces[BLACK]
+    bishops = white[BISHOP] | white[QUEEN] | black[BISHOP] | black[QUEEN]
+    rooks = white[ROOK] | white[QUEEN] | black[ROOK] | black[QUEEN]
+    return ((PAWN_ATTACKS[BLACK][sq] & white[PAWN]) | (PAWN_ATTACKS[WHITE][sq] & black[PAWN])
+            | (KNIGHT_ATTACKS[sq] & (white[KNIGHT] | black[KNIGHT])) | (KING_ATTACKS[sq] & (white[KING] | black[KING]))
+            | (bishop_attacks(sq, occ) & bishops) | (rook_attacks(sq, occ) & rooks))
+
+
+class Position:
+    __slots__ = ('pieces', 'occupied', 'squares', 'side', 'castling', 'ep', 'halfmove', 'fullmove', 'key',
+                 'history', 'kings', 'score', 'phase')
+
+    def __init__(self):
+        self.pieces = [[0] * 6, [0] * 6]
+        self.occupied = [0, 0]
+        self.squares = [EMPTY] * 64
+        self.side = WHITE
+        self.castling = 0
+        self.ep = -1
+        self.halfmove = 0
+        self.fullmove = 1
+        self.key = 0
+        # Undo records: (move, captured piece code, castling, ep, halfmove, key,
+        # score, phase).
+        self.history = []
+        # King squares by colour, -1 when a side has no king.
+        self.kings = [-1, -1]
+        # Material and piece-square sums from White's side, packed middlegame
+        # and endgame (see psqt.py), and the game phase they are blended by;
+        # kept up to date move by move like the key.
+        self.score = 0
+        self.phase = 0
+
+    def copy(self):
+        position = Position.__new__(Position)
+        position.pieces = [self.pieces[0][:], self.pieces[1][:]]
+        position.occupied = self.occupied[:]
+        position.squares = self.squares[:]
+        position.side = self.side
+        position.castling = self.castling
+        position.ep = self.ep
+        position.halfmove = self.halfmove
+        position.fullmove = self.fullmove
+        position.key = self.key
+        position.history = self.history[:]
+        position.kings = self.kings[:]
+        position.score = self.score
+        position.phase = self.phase
+        return position
+
+    def compute_key(self):
+        key = ZOBRIST_CASTLING[self.castling]
+        for sq, code in enumerate(self.squares):
+            if code != EMPTY:
+                key ^= ZOBRIST_PIECES[code * 64 + sq]
+        if self.side == BLACK:
+            key ^= ZOBRIST_SIDE
+        if self.ep >= 0:
+            key ^= ZOBRIST_EP[self.ep & 7]
+        return key
+
+    def compute_score(self):
+        # (score, phase) from scratch, for checking the incremental ones.
+        score = phase = 0
+        for sq, code in enumerate(self.squares):
+            if code != EMPTY:
+                score += PIECE_SQUARE_SCORES[code * 64 + sq]
+                phase += PHASES[code]
+        return score, phase
+
+    def put(self, sq, color, ptype):
+        bit = 1 << sq
+        self.pieces[color][ptype] |= bit
+        self.occupied[color] |= bit
+        self.squares[sq] = color * 6 + ptype
+        self.key ^= ZOBRIST_PIECES[(color * 6 + ptype) * 64 + sq]
+        self.score += PIECE_SQUARE_SCORES[(color * 6 + ptype) * 64 + sq]
+        self.phase += PHASE_WEIGHTS[ptype]
+        if ptype == KING:
+            self.kings[color] = sq
+
+    def remove(self, sq):
+        code = self.squares[sq]
+        if code == EMPTY:
+            return
+        color, ptype = divmod(code, 6)
+        bit = 1 << sq
+        self.pieces[color][ptype] ^= bit
+        self.occupied[color] ^= bit
+        self.squares[sq] = EMPTY
+        self.key ^= ZOBRIST_PIECES[code * 64 + sq]
+        self.score -= PIECE_SQUARE_SCORES[code * 64 + sq]
+        self.phase -= PHASE_WEIGHTS[ptype]
+        if ptype == KING:
+            self.kings[color] = -1
+
+    @classmethod
+    def initial(cls):
+        return cls.from_fen(START_FEN)
+
+    @classmethod
+    def from_fen(cls, fen):
+        fields = fen.split()
+        position = cls()
+        rank = 7
+        file = 0
+        for char in fields[0]:
+            if char == '/':
+                rank -= 1
+                file = 0
+            elif char.isdigit():
+                file += int(char)
+            else:
+                code = FEN_CHARS.index(char)
+                position.put(rank * 8 + file, code // 6, code % 6)
+                file += 1
+        position.side = WHITE if len(fields) < 2 or fields[1] == 'w' else BLACK
+        if len(fields) > 2:
+            for char, right in (('K', WHITE_OO), ('Q', WHITE_OOO), ('k', BLACK_OO), ('q', BLACK_OOO)):
+                if char in fields[2]:
+                    position.castling |= right
+        if len(fields) > 3 and fields[3] != '-':
+            position.ep = parse_square(fields[3])
+        if len(fields) > 5:
+            position.halfmove = int(fields[4])
+            position.fullmove = int(fields[5])
+        position.key = position.compute_key()
+        return position
+
+    def fen(self):
+        rows = []
+        for rank in range(7, -1, -1):
+            text = ''
+            empty = 0
+            for file in range(8):
+                code = self.squares[rank * 8 + file]
+                if code == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += FEN_CHARS[code]
+            if empty:
+                text += str(empty)
+            rows.append(text)
+        castling = ''.join(char for char, right in (('K', WHITE_OO), ('Q', WHITE_OOO), ('k', BLACK_OO), ('q', BLACK_OOO))
+                           if self.castling & right) or '-'
+        ep = square_name(self.ep) if self.ep >= 0 else '-'
+        return f"{'/'.join(rows)} {COLOR_CHARS[self.side]} {castling} {ep} {self.halfmove} {self.fullmove}"
+
+    def piece_at(self, row, col):
+        code = self.squares[square(row, col)]
+        if code == EMPTY:
+            return ''
+        return COLOR_CHARS[code // 6] + PIECE_CHARS[code % 6]
+
+    def to_board(self):
+        return [[self.piece_at(row, col) for col in range(8)] for row in range(8)]
+
+    def attacks_by(self, color):
+        pieces = self.pieces[color]
+        occ = self.occupied[0] | self.occupied[1]
+        attacks = pawn_attacks_bb(pieces[PAWN], color)
+        bb = pieces[KNIGHT]
+        while bb:
+            bit = bb & -bb
+            attacks |= KNIGHT_ATTACKS[bit.bit_length() - 1]
+            bb ^= bit
+        bb = pieces[BISHOP] | pieces[QUEEN]
+        while bb:
+            bit = bb & -bb
+            attacks |= bishop_attacks(bit.bit_length() - 1, occ)
+            bb ^= bit
+        bb = pieces[ROOK] | pieces[QUEEN]
+        while bb:
+            bit = bb & -bb
+            attacks |= rook_attacks(bit.bit_length() - 1, occ)
+            bb ^= bit
+        bb = pieces[KING]
+        if bb:
+            attacks |= KING_ATTACKS[bb.bit_length() - 1]
+        return attacks
+
+    def in_check(self, color=None):
+        if color is None:
+            color = self.side
+        king_sq = self.kings[color]
+        return king_sq >= 0 and square_attacked(self, king_sq, color ^ 1)
+
+    def make_move(self, move):
+        frm = move & 63
+        to = (move >> 6) & 63
+        us = self.side
+        them = us ^ 1
+        squares = self.squares
+        pieces = self.pieces
+        occupied = self.occupied
+        code = squares[frm]
+        ptype = code - us * 6
+        from_bit = 1 << frm
+        to_bit = 1 << to
+        key = self.key
+        score = self.score
+        captured = squares[to]
+        self.history.append((move, captured, self.castling, self.ep, self.halfmove, key, score, self.phase))
+        key ^= ZOBRIST_SIDE ^ ZOBRIST_PIECES[code * 64 + frm]
+        score -= PIECE_SQUARE_SCORES[code * 64 + frm]
+
+        self.halfmove += 1
+        if move & FLAG_EN_PASSANT:
+            cap_sq = to - 8 if us == WHITE else to + 8
+            cap_bit = 1 << cap_sq
+            pieces[them][PAWN] ^= cap_bit
+            occupied[them] ^= cap_bit
+            key ^= ZOBRIST_PIECES[squares[cap_sq] * 64 + cap_sq]
+            score -= PIECE_SQUARE_SCORES[squares[cap_sq] * 64 + cap_sq]
+            squares[cap_sq] = EMPTY
+        elif move & FLAG_CAPTURE:
+            pieces[them][captured - them * 6] ^= to_bit
+            occupied[them] ^= to_bit
+            key ^= ZOBRIST_PIECES[captured * 64 + to]
+            score -= PIECE_SQUARE_SCORES[captured * 64 + to]
+            self.phase -= PHASES[captured]
+            self.halfmove = 0
+
+        pieces[us][ptype] ^= from_bit
+        squares[frm] = EMPTY
+        promotion = (move >> PROMOTION_SHIFT) & 7
+        if promotion:
+            ptype = promotion
+            code = us * 6 + promotion
+            self.phase += PHASE_WEIGHTS[promotion]
+        pieces[us][ptype] |= to_bit
+        occupied[us] ^= from_bit | to_bit
+        squares[to] = code
+        key ^= ZOBRIST_PIECES[code * 64 + to]
+        score += PIECE_SQUARE_SCORES[code * 64 + to]
+        if ptype == KING:
+            self.kings[us] = to
+
+        if move & FLAG_CASTLE:
+            rook_from, rook_to = CASTLING_ROOKS[to]
+            rook_bits = (1 << rook_from) | (1 << rook_to)
+            pieces[us][ROOK] ^= rook_bits
+            occupied[us] ^= rook_bits
+            rook = squares[rook_from]
+            squares[rook_to] = rook
+            squares[rook_from] = EMPTY
+            key ^= ZOBRIST_PIECES[rook * 64 + rook_from] ^ ZOBRIST_PIECES[rook * 64 + rook_to]
+            score += PIECE_SQUARE_SCORES[rook * 64 + rook_to] - PIECE_SQUARE_SCORES[rook * 64 + rook_from]
+
+        if ptype == PAWN or promotion:
+            self.halfmove = 0
+        if self.ep >= 0:
+            key ^= ZOBRIST_EP[self.ep & 7]
+        if move & FLAG_DOUBLE_PUSH:
+            self.ep = (frm + to) >> 1
+            key ^= ZOBRIST_EP[self.ep & 7]
+        else:
+            self.ep = -1
+        castling = self.castling & CASTLING_MASK[frm] & CASTLING_MASK[to]
+        if castling != self.castling:
+            key ^= ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_CASTLING[castling]
+            self.castling = castling
+        if us == BLACK:
+            self.fullmove += 1
+        self.side = them
+        self.key = key
+        self.score = score
+
+    def unmake_move(self):
+        move, captured, self.castling, self.ep, self.halfmove, self.key, self.score, self.phase = self.history.pop()
+        frm = move & 63
+        to = (move >> 6) & 63
+        them = self.side
+        us = them ^ 1
+        self.side = us
+        if us == BLACK:
+            self.fullmove -= 1
+        squares = self.squares
+        pieces = self.pieces
+        occupied = self.occupied
+        from_bit = 1 << frm
+        to_bit = 1 << to
+
+        code = squares[to]
+        promotion = (move >> PROMOTION_SHIFT) & 7
+        if promotion:
+            pieces[us][promotion] ^= to_bit
+            pieces[us][PAWN] |= from_bit
+            code = us * 6 + PAWN
+        else:
+            pieces[us][code - us * 6] ^= from_bit | to_bit
+            if code - us * 6 == KING:
+                self.kings[us] = frm
+        occupied[us] ^= from_bit | to_bit
+        squares[frm] = code
+        squares[to] = captured
+
+        if move & FLAG_EN_PASSANT:
+            cap_sq = to - 8 if us == WHITE else to + 8
+            cap_bit = 1 << cap_sq
+            pieces[them][PAWN] |= cap_bit
+            occupied[them] |= cap_bit
+            squares[cap_sq] = them * 6 + PAWN
+        elif captured != EMPTY:
+            pieces[them][captured - them * 6] |= to_bit
+            occupied[them] |= to_bit
+        elif move & FLAG_CASTLE:
+            rook_from, rook_to = CASTLING_ROOKS[to]
+            rook_bits = (1 << rook_from) | (1 << rook_to)
+            pieces[us][ROOK] ^= rook_bits
+            occupied[us] ^= rook_bits
+            squares[rook_from] = squares[rook_to]
+            squares[rook_to] = EMPTY
+
+
+# Move lists are memoised: the same piece seldom sees more than a handful of
+# different target sets during a game, and a cached tuple turns the per-target
+# bit loop into a single list.extend(). Piece moves are kept per origin square
+# keyed by (targets, captures), pawn moves per side keyed by the four
+# bulk-shifted target sets of PAWN_KINDS, and the squares of a piece set keyed
+# by its bitboard. Tuple keys hash faster than the same sets packed into one
+# wide integer.
+_PIECE_MOVES = [{} for _ in range(64)]
+_PAWN_MOVES = [{}, {}]
+_SQUARES = {}
+_KNIGHT_ZONES = {}
+_KNIGHT_MOVES = {}
+_CACHE_LIMIT = 1 << 14
+
+
+def _piece_moves(frm, key):
+    table = _PIECE_MOVES[frm]
+    if len(table) >= _CACHE_LIMIT:
+        table.clear()
+    targets, captures = key
+    moves = []
+    while targets:
+        bit = targets & -targets
+        move = frm | ((bit.bit_length() - 1) << 6)
+        moves.append(move | FLAG_CAPTURE if bit & captures else move)
+        targets ^= bit
+    moves.sort(key=lambda move: not move & FLAG_CAPTURE)
+    moves = table[key] = tuple(moves)
+    return moves
+
+
+def _pawn_moves(color, key):
+    table = _PAWN_MOVES[color]
+    if len(table) >= _CACHE_LIMIT:
+        table.clear()
+    moves = []
+    for targets, (offset, flags) in zip(key, PAWN_KINDS[color]):
+        while targets:
+            bit = targets & -targets
+            to = bit.bit_length() - 1
+            move = (to - offset) | (to << 6) | flags
+            if bit & PROMOTION_RANKS:
+                moves.append(move | (QUEEN << PROMOTION_SHIFT))
+                moves.append(move | (ROOK << PROMOTION_SHIFT))
+                moves.append(move | (BISHOP << PROMOTION_SHIFT))
+                moves.append(move | (KNIGHT << PROMOTION_SHIFT))
+            else:
+                moves.append(move)
+            targets ^= bit
+    moves = table[key] = tuple(moves)
+    return moves
+
+
+def _knight_zone(knights):
+    if len(_KNIGHT_ZONES) >= _CACHE_LIMIT:
+        _KNIGHT_ZONES.clear()
+    zone = 0
+    for frm in _SQUARES.get(knights) or _squares(knights):
+        zone |= KNIGHT_ATTACKS[frm]
+    _KNIGHT_ZONES[knights] = zone
+    return zone
+
+
+def _knight_moves(key):
+    if len(_KNIGHT_MOVES) >= _CACHE_LIMIT:
+        _KNIGHT_MOVES.clear()
+    knights, land, captures = key
+    moves = []
+    for frm in _SQUARES.get(knights) or _squares(knights):
+        targets = KNIGHT_ATTACKS[frm] & land
+        if targets:
+            moves += _piece_moves(frm, (targets, targets & captures))
+    moves = _KNIGHT_MOVES[key] = tuple(moves)
+    return moves
+
+
+def _squares(bb):
+    if len(_SQUARES) >= _CACHE_LIMIT:
+        _SQUARES.clear()
+    squares = []
+    rest = bb
+    while rest:
+        bit = rest & -rest
+        squares.append(bit.bit_length() - 1)
+        rest ^= bit
+    squares = _SQUARES[bb] = tuple(squares)
+    return squares
+
+
+# The shift and flags of each kind of pawn move, by colour: left capture,
+# right capture, push and double push.
+PAWN_KINDS = (((7, FLAG_CAPTURE), (9, FLAG_CAPTURE), (8, 0), (16, FLAG_DOUBLE_PUSH)),
+              ((-9, FLAG_CAPTURE), (-7, FLAG_CAPTURE), (-8, 0), (-16, FLAG_DOUBLE_PUSH)))
+
+
+def generate_pseudo_moves(position, captures=True, quiets=True, legality=None):
+    # captures and quiets pick the stages to generate, so a search can try
+    # the tactical moves before paying for the rest: captures covers every
+    # capture and promotion, quiets everything else (castling included).
+    # Given the position's legality (see _legality), only legal moves are
+    # generated: see generate_legal.
+    moves = []
+    us = position.side
+    own = position.occupied[us]
+    enemy = position.occupied[us ^ 1]
+    occ = own | enemy
+    empty = FULL ^ occ
+    pieces = position.pieces[us]
+    if captures and quiets:
+        not_own = FULL ^ own
+        pushes = FULL
+    elif captures:
+        not_own = enemy
+        pushes = PROMOTION_RANKS
+    else:
+        not_own = empty
+        pushes = FULL ^ PROMOTION_RANKS
+    if legality is None:
+        pinned = 0
+        land = not_own
+    else:
+        checkers, evasions, pinned, pin_lines = legality
+        # Where a piece other than the king may land.
+        land = not_own & evasions
+
+    pawns = pieces[PAWN]
+    if pawns:
+        # The unpinned pawns move in one go; each pinned one on its own,
+        # along its pin line. Each group comes with the squares its pushes,
+        # captures and double pushes may land on. En passant is generated
+        # from all of them.
+        hits = enemy if captures else 0
+        doubles = FULL if quiets else 0
+        if legality is not None:
+            pushes &= evasions
+            hits &= evasions
+            doubles &= evasions
+        if pinned & pawns:
+            groups = [(pawns & ~pinned, pushes, hits, doubles)]
+            bb = pinned & pawns
+            while bb:
+                bit = bb & -bb
+                bb ^= bit
+                line = pin_lines[bit.bit_length() - 1]
+                groups.append((bit, pushes & line, hits & line, doubles & line))
+        else:
+            groups = ((pawns, pushes, hits, doubles),)
+        pawn_cache = _PAWN_MOVES[us]
+        for group, push_mask, hit_mask, double_mask in groups:
+            if us == WHITE:
+                single = (group << 8) & empty
+                double = ((single & RANK_3) << 8) & empty & double_mask
+                left = ((group & NOT_FILE_A) << 7) & hit_mask
+                right = ((group & NOT_FILE_H) << 9) & hit_mask
+            else:
+                single = (group >> 8) & empty
+                double = ((single & RANK_6) >> 8) & empty & double_mask
+                left = ((group & NOT_FILE_A) >> 9) & hit_mask
+                right = ((group & NOT_FILE_H) >> 7) & hit_mask
+            single &= push_mask
+            if left or right or single or double:
+                key = (left, right, single, double)
+                moves += pawn_cache.get(key) or _pawn_moves(us, key)
+        if position.ep >= 0 and captures:
+            ep = position.ep
+            if us == WHITE:
+                origins = PAWN_ATTACKS[BLACK][ep] & pawns
+            else:
+                origins = PAWN_ATTACKS[WHITE][ep] & pawns
+            for frm in (_SQUARES.get(origins) or _squares(origins)) if origins else ():
+                move = frm | (ep << 6) | FLAG_CAPTURE | FLAG_EN_PASSANT
+                # En passant empties two squares of a rank at once, so it is
+                # tried on the board.
+                if legality is not None:
+                    position.make_move(move)
+                    illegal = square_attacked(position, position.kings[us], us ^ 1)
+                    position.unmake_move()
+                    if illegal:
+                        continue
+                moves.append(move)
+
+    piece_cache = _PIECE_MOVES
+    squares = _SQUARES
+    bb = pieces[KNIGHT] & ~pinned if pinned else pieces[KNIGHT]
+    if bb:
+        zone = _KNIGHT_ZONES.get(bb) or _knight_zone(bb)
+        targets = land & zone
+        if targets:
+            key = (bb, targets, enemy & zone)
+            moves += _KNIGHT_MOVES.get(key) or _knight_moves(key)
+    bb = pieces[BISHOP] | pieces[QUEEN]
+    for frm in (squares.get(bb) or _squares(bb)) if bb else ():
+        targets = BISHOP_TABLES[frm][occ & BISHOP_MASKS[frm]] & land
+        if pinned and pinned >> frm & 1:
+            targets &= pin_lines[frm]
+        if targets:
+            key = (targets, targets & enemy)
+            moves += piece_cache[frm].get(key) or _piece_moves(frm, key)
+    bb = pieces[ROOK] | pieces[QUEEN]
+    for frm in (squares.get(bb) or _squares(bb)) if bb else ():
+        targets = ROOK_TABLES[frm][occ & ROOK_MASKS[frm]] & land
+        if pinned and pinned >> frm & 1:
+            targets &= pin_lines[frm]
+        if targets:
+            key = (targets, targets & enemy)
+            moves += piece_cache[frm].get(key) or _piece_moves(frm, key)
+    frm = position.kings[us]
+    if frm >= 0:
+        targets = KING_ATTACKS[frm] & not_own
+        if targets and legality is not None:
+            # Attacks are looked at with the king lifted off the board, so it
+            # cannot step back along a checking ray.
+            them = us ^ 1
+            without_king = occ ^ (1 << frm)
+            safe = 0
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                if not square_attacked(position, bit.bit_length() - 1, them, without_king):
+                    safe |= bit
+            targets = safe
+        if targets:
+            key = (targets, targets & enemy)
+            moves += _PIECE_MOVES[frm].get(key) or _piece_moves(frm, key)
+        if position.castling and quiets and (legality is None or not checkers):
+            for right, between, move, crossed, landed in CASTLING_MOVES[us]:
+                if position.castling & right and not occ & between:
+                    if legality is not None and (square_attacked(position, crossed, us ^ 1, occ)
+                                                 or square_attacked(position, landed, us ^ 1, occ)):
+                        continue
+                    moves.append(move)
+    return moves
+
+
+# Castling moves by colour, each with its right, the squares between king and
+# rook, which must be empty, and the squares the king crosses and lands on,
+# which a legal castling also needs safe (it only castles out of no check, so
+# the one it stands on is safe already).
+CASTLING_MOVES = (((WHITE_OO, 0x60, 4 | (6 << 6) | FLAG_CASTLE, 5, 6),
+                   (WHITE_OOO, 0x0E, 4 | (2 << 6) | FLAG_CASTLE, 3, 2)),
+                  ((BLACK_OO, 0x60 << 56, 60 | (62 << 6) | FLAG_CASTLE, 61, 62),
+                   (BLACK_OOO, 0x0E << 56, 60 | (58 << 6) | FLAG_CASTLE, 59, 58)))
+
+
+def _legality(position):
+    # What settles the legality of this position's moves: the pieces giving
+    # check, the squares a move other than the king's must land on (the
+    # checker or its line; none against a double check), the pinned pieces
+    # and, by square, the line each may move along (its king to its pinner).
+    us = position.side
+    king_sq = position.kings[us]
+    own = position.occupied[us]
+    occ = own | position.occupied[us ^ 1]
+    enemy = position.pieces[us ^ 1]
+    diagonal = enemy[BISHOP] | enemy[QUEEN]
+    straight = enemy[ROOK] | enemy[QUEEN]
+    checkers = (PAWN_ATTACKS[us][king_sq] & enemy[PAWN]) | (KNIGHT_ATTACKS[king_sq] & enemy[KNIGHT])
+    if diagonal:
+        checkers |= BISHOP_TABLES[king_sq][occ & BISHOP_MASKS[king_sq]] & diagonal
+    if straight:
+        checkers |= ROOK_TABLES[king_sq][occ & ROOK_MASKS[king_sq]] & straight
+    if not checkers:
+        evasions = FULL
+    elif checkers & (checkers - 1):
+        evasions = 0
+    else:
+        evasions = checkers | BETWEEN[king_sq * 64 + checkers.bit_length() - 1]
+
+    pinned = 0
+    pin_lines = None
+    pinners = (ROOK_LINES[king_sq] & straight) | (BISHOP_LINES[king_sq] & diagonal)
+    while pinners:
+        bit = pinners & -pinners
+        pinners ^= bit
+        line = BETWEEN[king_sq * 64 + bit.bit_length() - 1]
+        blockers = line & occ
+        if blockers and not blockers & (blockers - 1) and blockers & own:
+            pinned |= blockers
+            if pin_lines is None:
+                pin_lines = {}
+            pin_lines[blockers.bit_length() - 1] = line | bit
+    return checkers, evasions, pinned, pin_lines
+
+
+@profiled
+def generate_legal(position, captures=True, quiets=True, legality=None):
+    # The legal moves of the chosen stages (see generate_pseudo_moves) and
+    # the position's legality, which callers generating the stages one at a
+    # time pass back in for the next; its first entry is the bitboard of
+    # pieces giving check.
+    #
+    # No move is made to test it: the legality masks the targets as they
+    # are generated. A piece other than the king lands on an evasion square
+    # and, when pinned, stays on its pin line; the king's squares are
+    # checked for attacks. Only en passant is still tried on the board.
+    if position.kings[position.side] < 0:
+        return generate_pseudo_moves(position, captures, quiets), (0, FULL, 0, None)
+    if legality is None:
+        legality = _legality(position)
+    return generate_pseudo_moves(position, captures, quiets, legality), legality
+
+
+def legal_moves(position, captures=True, quiets=True):
+    return generate_legal(position, captures, quiets)[0]
+
+
+def legal_moves_and_status(position):
+    # Every legal move together with the game status the same generation
+    # settles: "checkmate" or "stalemate" when there is no move, else None.
+    moves, legality = generate_legal(position)
+    if moves:
+        return moves, None
+    return moves, "checkmate" if legality[0] else "stalemate"
+
+
+def parse_uci(position, text):
+    for move in legal_moves(position):
+        if move_to_uci(move) == text:
+            return move
+    return None
+
+
+def encode_move(position, frm, to, promotion=QUEEN):
+    # Builds the move for a from/to pair without checking that it is legal;
+    # only for moves that already came out of the generator.
+    code = position.squares[frm]
+    ptype = code % 6
+    move = frm | (to << 6)
+    if position.squares[to] != EMPTY:
+        move |= FLAG_CAPTURE
+    if ptype == PAWN:
+        if to == position.ep and (frm - to) & 7:
+            move |= FLAG_CAPTURE | FLAG_EN_PASSANT
+        elif abs(to - frm) == 16:
+            move |= FLAG_DOUBLE_PUSH
+        elif (1 << to) & PROMOTION_RANKS:
+            move |= promotion << PROMOTION_SHIFT
+    elif ptype == KING and abs(to - frm) == 2:
+        move |= FLAG_CASTLE
+    return move
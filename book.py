@@ -0,0 +1,183 @@
+import argparse
+import mmap
+import random
+import struct
+import sys
+
+from bitboard import FLAG_CASTLE, KING, START_FEN, Position, legal_moves, move_to_uci
+from pgn import read_games, san_to_move
+
+# Entries use the Polyglot .bin layout: big-endian key (64 bits), move (16),
+# weight (16) and learn (32), sorted by key. The move field is Polyglot's too
+# (to square, from square, promotion piece, castling as king takes own rook).
+# The keys are this engine's Zobrist keys, not Polyglot's random table, so
+# books are built with build_book below rather than taken from elsewhere.
+ENTRY = struct.Struct(">QHHI")
+MAX_WEIGHT = 0xFFFF
+
+# King destination -> rook square, the Polyglot spelling of castling.
+CASTLING_TO_ROOK = {6: 7, 2: 0, 62: 63, 58: 56}
+ROOK_TO_CASTLING = {(4, 7): 6, (4, 0): 2, (60, 63): 62, (60, 56): 58}
+
+
+def encode_book_move(move):
+    frm = move & 63
+    to = (move >> 6) & 63
+    if move & FLAG_CASTLE:
+        to = CASTLING_TO_ROOK[to]
+    return (move & 0x7000) | (frm << 6) | to
+
+
+def decode_book_move(position, book_move):
+    # The legal move a book move stands for, or None if it is not legal here
+    # (a key collision, or a book built for something else).
+    frm = (book_move >> 6) & 63
+    to = book_move & 63
+    promotion = (book_move >> 12) & 7
+    if position.squares[frm] % 6 == KING and (frm, to) in ROOK_TO_CASTLING:
+        to = ROOK_TO_CASTLING[frm, to]
+    for move in legal_moves(position):
+        if move & 63 == frm and (move >> 6) & 63 == to and (move >> 12) & 7 == promotion:
+            return move
+    return None
+
+
+class OpeningBook:
+    # The file is memory-mapped and binary searched in place, so opening a
+    # book is free and a probe touches a handful of pages.
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.count = 0
+        self.data = None
+        size = self.file.seek(0, 2)
+        if size:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.count = size // ENTRY.size
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def key_at(self, index):
+        return ENTRY.unpack_from(self.data, index * ENTRY.size)[0]
+
+    def entries(self, key):
+        # (book move, weight) of every entry for key.
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        while low < self.count:
+            entry_key, book_move, weight, _ = ENTRY.unpack_from(self.data, low * ENTRY.size)
+            if entry_key != key:
+                break
+            found.append((book_move, weight))
+            low += 1
+        return found
+
+    def moves(self, position):
+        # (move, weight) of the legal book moves for position.
+        found = []
+        for book_move, weight in self.entries(position.key):
+            move = decode_book_move(position, book_move)
+            if move is not None:
+                found.append((move, weight))
+        return found
+
+    def choose(self, position, rng=random):
+        # A book move picked in proportion to its weight, or 0 when the
+        # position is not in the book.
+        moves = [(move, weight) for move, weight in self.moves(position) if weight]
+        if not moves:
+            return 0
+        pick = rng.randrange(sum(weight for _, weight in moves))
+        for move, weight in moves:
+            pick -= weight
+            if pick < 0:
+                return move
+        return moves[-1][0]
+
+
+def build_book(pgn_path, book_path, plies=20, min_games=1):
+    # Every move played in the first plies of each game scores 2 for a win
+    # of the side that played it, 1 for a draw and nothing for a loss; moves
+    # seen in fewer than min_games games are left out. Returns (games read,
+    # entries written).
+    counts = {}
+    games = 0
+    with open(pgn_path, encoding="utf-8", errors="replace") as pgn_file:
+        for tags, sans, result in read_games(pgn_file):
+            if tags.get("FEN", START_FEN) != START_FEN or tags.get("Variant", "Standard") != "Standard":
+                continue
+            games += 1
+            position = Position.initial()
+            for san in sans[:plies]:
+                move = san_to_move(position, san)
+                if move is None:
+                    break
+                if result == "1/2-1/2":
+                    score = 1
+                elif result == ("1-0" if position.side == 0 else "0-1"):
+                    score = 2
+                else:
+                    score = 0
+                entry = counts.setdefault((position.key, encode_book_move(move)), [0, 0])
+                entry[0] += score
+                entry[1] += 1
+                position.make_move(move)
+
+    entries = [(key, book_move, score) for (key, book_move), (score, seen) in counts.items() if seen >= min_games]
+    # Weights are scaled to fit 16 bits; a move that was played but never
+    # scored keeps weight 1 so it stays in the book.
+    top = max((score for _, _, score in entries), default=0)
+    scale = min(1.0, MAX_WEIGHT / top) if top else 1.0
+    entries.sort(key=lambda entry: (entry[0], -entry[2], entry[1]))
+    with open(book_path, "wb") as book_file:
+        for key, book_move, score in entries:
+            book_file.write(ENTRY.pack(key, book_move, max(1, int(score * scale)), 0))
+    return games, len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from a PGN file")
+    build.add_argument("pgn", help="PGN file to read")
+    build.add_argument("book", help="book file to write")
+    build.add_argument("--plies", type=int, default=20, help="plies of each game to take")
+    build.add_argument("--min-games", type=int, default=1, help="games a move must appear in")
+    probe = commands.add_parser("probe", help="list the book moves for a position")
+    probe.add_argument("book", help="book file to read")
+    probe.add_argument("--fen", default=START_FEN, help="position to look up (default: the start position)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        games, entries = build_book(args.pgn, args.book, args.plies, args.min_games)
+        print(f"{games} games, {entries} entries written to {args.book}")
+        return 0
+    with OpeningBook(args.book) as book:
+        moves = book.moves(Position.from_fen(args.fen))
+        total = sum(weight for _, weight in moves)
+        for move, weight in sorted(moves, key=lambda item: -item[1]):
+            print(f"{move_to_uci(move):<8}{weight:>8}{weight / total:>8.1%}")
+        if not moves:
+            print("not in book")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
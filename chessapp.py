@@ -1,11 +1,18 @@
-import pygame
-import sys
 import os
-import json
-import random
-import time
+import sys
+
+import profiling
+from ai_worker import AIWorker
+from bitboard import START_FEN, move_to_uci
+from engine import (AI_NODE_BUDGET, AI_PONDER, AI_TIME_BUDGET, SAVES_DIR, STORE_FILE, book_move, close_search,
+                    get_search, init_board, legal_move, position_status, predicted_reply, report_ai_search)
+from history import MoveHistory
+from profiling import profiled
+from storage import GameStore, restore_game
 
-pygame.init()
+# The pygame frontend; the rules and the AI live in engine.py. pygame is
+# imported by main(), so importing this module needs no display.
+pygame = None
 
 BLACK_BOARD_COLOR = (125, 193, 235)
 WHITE_BOARD_COLOR = (255, 255, 255)
@@ -19,15 +26,16 @@ CHECK_COLOR = (255, 0, 0, 128)
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
 BOARD_SIZE = 8
-SQUARE_SIZE = SCREEN_WIDTH // BOARD_SIZE
 MENU_WIDTH = 200
+SQUARE_SIZE = min(SCREEN_WIDTH - MENU_WIDTH, SCREEN_HEIGHT) // BOARD_SIZE
+MENU_COLOR = (220, 220, 220)
+# The loop sleeps to this rate; frames in which nothing changed draw nothing.
+FPS = 30
+# How often the profiling overlay's figures are refreshed, in frames.
+PROFILE_REFRESH_FRAMES = 15
+PROFILE_OVERLAY_LINES = 14
 
-FONT = pygame.font.Font(None, 36)
-BUTTON_FONT = pygame.font.Font(None, 24)
-
-SAVES_DIR = "saves"
-if not os.path.exists(SAVES_DIR):
-    os.makedirs(SAVES_DIR)
+PIECE_SIZE_FACTOR = 0.7
 
 def load_image(name):
     path = name
@@ -43,29 +51,47 @@ def scale_image(image, factor):
     return pygame.transform.scale(image, (int(image.get_width() * factor), int(image.get_height() * factor)))
 
 def get_piece_images(piece_size):
-    pieces = {
-        'wR': scale_image(load_image("wR.png"), piece_size),
-        'wN': scale_image(load_image("wN.png"), piece_size),
-        'wB': scale_image(load_image("wB.png"), piece_size),
-        'wQ': scale_image(load_image("wQ.png"), piece_size),
-        'wK': scale_image(load_image("wK.png"), piece_size),
-        'wP': scale_image(load_image("wp.png"), piece_size),
-        'bR': scale_image(load_image("bR.png"), piece_size),
-        'bN': scale_image(load_image("bN.png"), piece_size),
-        'bB': scale_image(load_image("bB.png"), piece_size),
-        'bQ': scale_image(load_image("bQ.png"), piece_size),
-        'bK': scale_image(load_image("wK.png"), piece_size),
-        'bP': scale_image(load_image("bp.png"), piece_size),
-    }
+    pieces = {}
+    for piece, name in (('wR', "wR.png"), ('wN', "wN.png"), ('wB', "wB.png"), ('wQ', "wQ.png"),
+                        ('wK', "wK.png"), ('wP', "wp.png"), ('bR', "bR.png"), ('bN', "bN.png"),
+                        ('bB', "bB.png"), ('bQ', "bQ.png"), ('bK', "bK.png"), ('bP', "bp.png")):
+        image = load_image(name)
+        pieces[piece] = scale_image(image, piece_size / image.get_width())
     return pieces
 
+TEXT_CACHE = {}
+
+def render_text(font, text, color):
+    # Font.render is the slowest call in a frame, and the same few strings
+    # are drawn over and over.
+    key = (font, text, color)
+    surface = TEXT_CACHE.get(key)
+    if surface is None:
+        if len(TEXT_CACHE) > 256:
+            TEXT_CACHE.clear()
+        surface = TEXT_CACHE[key] = font.render(text, True, color)
+    return surface
+
 def get_square_rect(row, col):
     return pygame.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
 
-def draw_board(screen, board, selected_square, legal_moves, last_move, check_square):
+@profiled
+def draw_board(screen, board, selected_square, legal_moves, last_move, check_square, drawn=None, dirty_rects=None):
+    # drawn maps each square to what was last painted on it; when given, only
+    # squares whose piece or highlights changed are repainted and their rects
+    # are appended to dirty_rects.
     for row in range(BOARD_SIZE):
         for col in range(BOARD_SIZE):
+            if drawn is not None:
+                state = (board[row][col], selected_square == (row, col), bool(legal_moves) and (row, col) in legal_moves,
+                         bool(last_move) and (last_move[0] == (row, col) or last_move[1] == (row, col)),
+                         check_square == (row, col))
+                if drawn.get((row, col)) == state:
+                    continue
+                drawn[row, col] = state
             rect = get_square_rect(row, col)
+            if dirty_rects is not None:
+                dirty_rects.append(rect)
             color = WHITE_BOARD_COLOR if (row + col) % 2 == 0 else BLACK_BOARD_COLOR
             pygame.draw.rect(screen, color, rect)
 
@@ -83,32 +109,63 @@ def draw_board(screen, board, selected_square, legal_moves, last_move, check_squ
 
             piece = board[row][col]
             if piece:
-                screen.blit(PIECE_IMAGES[piece], rect.topleft)
+                image = PIECE_IMAGES[piece]
+                screen.blit(image, image.get_rect(center=rect.center))
                 
-def draw_menu(screen, game_state, current_player, selected_square, game_over_text):
+@profiled
+def draw_menu(screen, game_state, current_player, selected_square, game_over_text, ai_status=None,
+              drawn=None, dirty_rects=None, overlay=None):
+    # drawn remembers the text on each status line and whether the buttons
+    # are up; when given, only lines whose text changed are repainted and
+    # their rects are appended to dirty_rects. overlay, the profiling lines,
+    # takes the place of the buttons while it is shown.
     menu_x = SCREEN_WIDTH - MENU_WIDTH
-    pygame.draw.rect(screen, (220, 220, 220), (menu_x, 0, MENU_WIDTH, SCREEN_HEIGHT))
-
-    title_text = FONT.render("Chess Game", True, (0, 0, 0))
-    title_rect = title_text.get_rect(center=(menu_x + MENU_WIDTH // 2, 30))
-    screen.blit(title_text, title_rect)
-
-    state_text = FONT.render(f"State: {game_state}", True, (0, 0, 0))
-    state_rect = state_text.get_rect(center=(menu_x + MENU_WIDTH // 2, 80))
-    screen.blit(state_text, state_rect)
-    
-    player_text = FONT.render(f"Player: {current_player}", True, (0, 0, 0))
-    player_rect = player_text.get_rect(center=(menu_x + MENU_WIDTH // 2, 110))
-    screen.blit(player_text, player_rect)
-    
-    selected_text = FONT.render(f"Selected: {selected_square}", True, (0, 0, 0))
-    selected_rect = selected_text.get_rect(center=(menu_x + MENU_WIDTH // 2, 140))
-    screen.blit(selected_text, selected_rect)
-    
-    if game_over_text:
-        game_over_display_text = FONT.render(game_over_text, True, (255, 0, 0))
-        game_over_rect = game_over_display_text.get_rect(center=(menu_x + MENU_WIDTH // 2, 170))
-        screen.blit(game_over_display_text, game_over_rect)
+    full_redraw = drawn is None or not drawn
+    if full_redraw:
+        pygame.draw.rect(screen, MENU_COLOR, (menu_x, 0, MENU_WIDTH, SCREEN_HEIGHT))
+        if dirty_rects is not None:
+            dirty_rects.append(pygame.Rect(menu_x, 0, MENU_WIDTH, SCREEN_HEIGHT))
+
+    best_move = None
+    ai_line = None
+    if ai_status:
+        best_move = move_to_uci(ai_status["best_move"]) if ai_status["best_move"] else "-"
+        ai_line = f"AI thinking... depth {ai_status['depth'] + 1}"
+        if ai_status["pondering"] is not None:
+            on = f" {move_to_uci(ai_status['pondering'])}" if ai_status["pondering"] else ""
+            ai_line = f"Pondering{on}, depth {ai_status['depth'] + 1}"
+    lines = [
+        (30, FONT, "Chess Game", (0, 0, 0)),
+        (80, FONT, f"State: {game_state}", (0, 0, 0)),
+        (110, FONT, f"Player: {current_player}", (0, 0, 0)),
+        (140, FONT, f"Selected: {selected_square}", (0, 0, 0)),
+        (170, FONT, game_over_text, (255, 0, 0)),
+        (200, BUTTON_FONT, ai_line, (0, 0, 160)),
+        (222, BUTTON_FONT, ai_status and f"{ai_status['nodes']:,} nodes, best {best_move}", (0, 0, 160)),
+    ]
+    if overlay is not None:
+        # Always every slot, so that a line that has gone is painted over.
+        overlay = (list(overlay) + [None] * PROFILE_OVERLAY_LINES)[:PROFILE_OVERLAY_LINES]
+        lines += [(260 + index * 22, BUTTON_FONT, text, (90, 0, 90)) for index, text in enumerate(overlay)]
+    for y, font, text, color in lines:
+        if drawn is not None:
+            if not full_redraw and drawn.get(y) == text:
+                continue
+            drawn[y] = text
+        height = 30 if font is FONT else 22
+        line_rect = pygame.Rect(menu_x, y - height // 2, MENU_WIDTH, height)
+        if not full_redraw:
+            pygame.draw.rect(screen, MENU_COLOR, line_rect)
+            if dirty_rects is not None:
+                dirty_rects.append(line_rect)
+        if text:
+            text_surface = render_text(font, text, color)
+            if text_surface.get_width() > MENU_WIDTH - 10:
+                text_surface = render_text(BUTTON_FONT, text, color)
+            screen.blit(text_surface, text_surface.get_rect(center=line_rect.center))
+
+    if overlay is not None:
+        return []
 
     button_y_start = 250
     button_spacing = 50
@@ -117,20 +174,22 @@ def draw_menu(screen, game_state, current_player, selected_square, game_over_tex
 
     def draw_button(text, y_offset, action=None):
         rect = pygame.Rect(menu_x + 10, button_y_start + y_offset, button_width, button_height)
-        pygame.draw.rect(screen, (100, 100, 100), rect)
-        pygame.draw.rect(screen, (200, 200, 200), rect, 2)
-        text_surface = BUTTON_FONT.render(text, True, (255, 255, 255))
-        text_rect = text_surface.get_rect(center=rect.center)
-        screen.blit(text_surface, text_rect)
+        if full_redraw:
+            pygame.draw.rect(screen, (100, 100, 100), rect)
+            pygame.draw.rect(screen, (200, 200, 200), rect, 2)
+            text_surface = render_text(BUTTON_FONT, text, (255, 255, 255))
+            text_rect = text_surface.get_rect(center=rect.center)
+            screen.blit(text_surface, text_rect)
         return rect
 
     button_actions = [
-        ("New Game", lambda: init_board()),
-        ("Save Game", lambda: save_game(board, current_player, game_state, selected_square, last_move)),
+        ("New Game", lambda: new_game()),
+        ("Save Game", lambda: save_game()),
         ("Load Game", lambda: load_game()),
         ("Play vs AI", lambda: play_vs_ai()),
         ("Undo Move", lambda: undo_move()),
-        ("Exit", lambda: sys.exit()),
+        ("Redo Move", lambda: redo_move()),
+        ("Exit", lambda: exit_game()),
     ]
     
     button_rects = []
@@ -175,309 +234,141 @@ def display_message(screen, message):
                 if ok_button_rect.collidepoint(event.pos):
                     return
 
-def init_board():
-    board = [
-        ['bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR'],
-        ['bP', 'bP', 'bP', 'bP', 'bP', 'bP', 'bP', 'bP'],
-        ['', '', '', '', '', '', '', ''],
-        ['', '', '', '', '', '', '', ''],
-        ['', '', '', '', '', '', '', ''],
-        ['', '', '', '', '', '', '', ''],
-        ['wP', 'wP', 'wP', 'wP', 'wP', 'wP', 'wP', 'wP'],
-        ['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR'],
-    ]
-    return board
-
-def get_legal_moves(board, row, col, current_player):
-    moves = []
-    piece = board[row][col]
-    if not piece or piece[0] != current_player:
-        return moves
-
-    def is_valid_move(r, c):
-        return 0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE
-
-    def is_empty_or_opponent(r, c, player):
-        target_piece = board[r][c]
-        return not target_piece or target_piece[0] != player
-
-    if piece[1] == 'P':
-        direction = -1 if current_player == 'w' else 1
-        new_row = row + direction
-        if is_valid_move(new_row, col) and not board[new_row][col]:
-            moves.append((new_row, col))
-            if (row == 6 and current_player == 'w') or (row == 1 and current_player == 'b'):
-                new_row_2 = row + 2 * direction
-                if not board[new_row_2][col] and not board[new_row][col]:
-                    moves.append((new_row_2, col))
-        new_row = row + direction
-        new_col_left = col - 1
-        if is_valid_move(new_row, new_col_left) and board[new_row][new_col_left] and board[new_row][new_col_left][0] != current_player:
-            moves.append((new_row, new_col_left))
-        new_col_right = col + 1
-        if is_valid_move(new_row, new_col_right) and board[new_row][new_col_right] and board[new_row][new_col_right][0] != current_player:
-            moves.append((new_row, new_col_right))
-        if last_move and last_move[0][1] != last_move[1][1]:
-            en_passant_row = last_move[1][0]
-            en_passant_col = last_move[1][1]
-            if row == en_passant_row - direction and (col - 1 == en_passant_col or col + 1 == en_passant_col):
-                moves.append((en_passant_row + direction, en_passant_col))
-
-    elif piece[1] == 'R':
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-        for dr, dc in directions:
-            for i in range(1, BOARD_SIZE):
-                new_row, new_col = row + i * dr, col + i * dc
-                if not is_valid_move(new_row, new_col):
-                    break
-                if is_empty_or_opponent(new_row, new_col, current_player):
-                    moves.append((new_row, new_col))
-                if board[new_row][new_col]:
-                    break
-
-    elif piece[1] == 'N':
-        knight_moves = [
-            (-2, -1), (-2, 1), (-1, -2), (-1, 2),
-            (1, -2), (1, 2), (2, -1), (2, 1),
-        ]
-        for dr, dc in knight_moves:
-            new_row, new_col = row + dr, col + dc
-            if is_valid_move(new_row, new_col) and is_empty_or_opponent(new_row, new_col, current_player):
-                moves.append((new_row, new_col))
-
-    elif piece[1] == 'B':
-        directions = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
-        for dr, dc in directions:
-            for i in range(1, BOARD_SIZE):
-                new_row, new_col = row + i * dr, col + i * dc
-                if not is_valid_move(new_row, new_col):
-                    break
-                if is_empty_or_opponent(new_row, new_col, current_player):
-                    moves.append((new_row, new_col))
-                if board[new_row][new_col]:
-                    break
-
-    elif piece[1] == 'Q':
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1)]
-        for dr, dc in directions:
-            for i in range(1, BOARD_SIZE):
-                new_row, new_col = row + i * dr, col + i * dc
-                if not is_valid_move(new_row, new_col):
-                    break
-                if is_empty_or_opponent(new_row, new_col, current_player):
-                    moves.append((new_row, new_col))
-                if board[new_row][new_col]:
-                    break
-
-    elif piece[1] == 'K':
-        king_moves = [
-            (0, 1), (0, -1), (1, 0), (-1, 0),
-            (1, 1), (1, -1), (-1, 1), (-1, -1),
-        ]
-        for dr, dc in king_moves:
-            new_row, new_col = row + dr, col + dc
-            if is_valid_move(new_row, new_col) and is_empty_or_opponent(new_row, new_col, current_player):
-                moves.append((new_row, new_col))
-        if piece[0] == 'w' and row == 7:
-            if board[7][4] == 'wK':
-                if board[7][0] == 'wR' and board[7][1] == '' and board[7][2] == '' and board[7][3] == '':
-                    moves.append((7, 2))
-                if board[7][7] == 'wR' and board[7][5] == '' and board[7][6] == '':
-                    moves.append((7, 6))
-        elif piece[0] == 'b' and row == 0:
-            if board[0][4] == 'bK':
-                if board[0][0] == 'bR' and board[0][1] == '' and board[0][2] == '' and board[0][3] == '':
-                    moves.append((0, 2))
-                if board[0][7] == 'bR' and board[0][5] == '' and board[0][6] == '':
-                    moves.append((0, 6))
-
-    return moves
-
-def move_piece(board, start_row, start_col, end_row, end_col, current_player):
-    legal_moves = get_legal_moves(board, start_row, start_col, current_player)
-    if (end_row, end_col) in legal_moves:
-        piece = board[start_row][start_col]
-        board[start_row][start_col] = ''
-        board[end_row][end_col] = piece
-        
-        if piece[1] == 'K':
-            if start_col - end_col == 2:
-                board[start_row][start_col-1] = board[start_row][0]
-                board[start_row][0] = ''
-            elif start_col - end_col == -2:
-                board[start_row][start_col+1] = board[start_row][7]
-                board[start_row][7] = ''
-        
-        if piece[1] == 'P':
-            if end_col != start_col and board[end_row][end_col] == '':
-                board[start_row][end_col] = ''
-        
-        return True
-    else:
-        return False
-
-def is_check(board, player):
-    king_pos = None
-    for r in range(BOARD_SIZE):
-        for c in range(BOARD_SIZE):
-            if board[r][c] and board[r][c][0] == player and board[r][c][1] == 'K':
-                king_pos = (r, c)
-                break
-        if king_pos:
-            break
-
-    if not king_pos:
-        return False
-
-    opponent = 'b' if player == 'w' else 'w'
-    for r in range(BOARD_SIZE):
-        for c in range(BOARD_SIZE):
-            if board[r][c] and board[r][c][0] == opponent:
-                opponent_moves = get_legal_moves(board, r, c, opponent)
-                if king_pos in opponent_moves:
-                    return True
-    return False
-
-def is_checkmate(board, player):
-    if not is_check(board, player):
-        return False
-
-    for r in range(BOARD_SIZE):
-        for c in range(BOARD_SIZE):
-            if board[r][c] and board[r][c][0] == player:
-                if get_legal_moves(board, r, c, player):
-                    return False
-    return True
-
-def is_stalemate(board, player):
-    if is_check(board, player):
-        return False
-
-    for r in range(BOARD_SIZE):
-        for c in range(BOARD_SIZE):
-            if board[r][c] and board[r][c][0] == player:
-                if get_legal_moves(board, r, c, player):
-                    return False
-    return True
-
-def save_game(board, current_player, game_state, selected_square, last_move):
-    timestamp = time.strftime("%Y%m%d-%H%M%S")
-    filename = os.path.join(SAVES_DIR, f"save_{timestamp}.json")
-    game_data = {
-        "board": board,
-        "current_player": current_player,
-        "game_state": game_state,
-        "selected_square": selected_square,
-        "last_move": last_move,
-    }
+def switch_player():
+    global current_player
+    current_player = 'b' if current_player == 'w' else 'w'
+    
+def show_history():
+    # Puts the board, side to move and last move of move_history's current
+    # ply on screen, as the game over it was if the game had ended there, and
+    # trims the stored game to that ply.
+    global board, current_player, selected_square, game_state, last_move, game_over_text
+    board = move_history.board()
+    current_player = move_history.player()
+    last_move = move_history.last_move()
+    selected_square = None
+    game_state = "Playing"
+    game_over_text = None
+    result = position_status(move_history.position).result
+    if result:
+        # A finished game shows the side that made the last move, as it did
+        # when it ended.
+        switch_player()
+        game_state = "Game Over"
+        game_over_text = f"{current_player.upper()} wins by checkmate!" if result == "checkmate" else "Stalemate!"
+    if game_id is not None:
+        GAME_STORE.truncate(game_id, move_history.ply)
+
+def undo_move():
+    AI_WORKER.cancel()
+    if move_history.undo():
+        show_history()
+
+def redo_move():
+    AI_WORKER.cancel()
+    if move_history.redo():
+        show_history()
+
+def go_to_ply(ply):
+    AI_WORKER.cancel()
+    if ply != move_history.ply:
+        move_history.go_to(ply)
+        show_history()
+
+def new_game():
+    global play_ai
+    play_ai = False
+    reset_game()
+
+def play_vs_ai():
+    global play_ai
+    play_ai = True
+    reset_game()
+
+def reset_game():
+    global board, current_player, selected_square, game_state, last_move, game_over_text, game_id, move_history
+    AI_WORKER.cancel()
+    board = init_board()
+    current_player = 'w'
+    selected_square = None
+    game_state = "Playing"
+    game_over_text = None
+    last_move = None
+    move_history = MoveHistory()
+    game_id = None
+
+def record_move(move):
+    # Plays move, legal in move_history's position, there and appends it to
+    # the store; a game gets its row there with its first move or save.
+    global board, last_move, game_id
+    move_history.push(move)
+    board = move_history.board()
+    last_move = move_history.last_move()
+    if game_id is None:
+        game_id = GAME_STORE.new_game(START_FEN)
+    game_id = GAME_STORE.append_move(game_id, move_history.ply - 1, move)
+
+def save_game():
+    global game_id
     try:
-        with open(filename, "w") as f:
-            json.dump(game_data, f)
-        print(f"Game saved to {filename}")
+        if game_id is None:
+            game_id = GAME_STORE.new_game(START_FEN)
+        GAME_STORE.save(game_id)
+        print(f"Game {game_id} saved to {STORE_FILE}")
         return "Game Saved!"
     except Exception as e:
         print(f"Error saving game: {e}")
         return f"Error saving game: {e}"
 
 def load_game():
-    save_files = [f for f in os.listdir(SAVES_DIR) if f.startswith("save_") and f.endswith(".json")]
-    if not save_files:
-        print("No saved games found.")
-        return None, None, None, None, None
-
-    save_files.sort(key=lambda x: os.path.getmtime(os.path.join(SAVES_DIR, x)), reverse=True)
-    latest_save = save_files[0]
-    filename = os.path.join(SAVES_DIR, latest_save)
-
+    # Restores the most recently saved game with its whole move history, so
+    # undo keeps working past the point it was loaded at.
+    global move_history, game_id
     try:
-        with open(filename, "r") as f:
-            game_data = json.load(f)
-        print(f"Game loaded from {filename}")
-        board = game_data["board"]
-        current_player = game_data["current_player"]
-        game_state = game_data["game_state"]
-        selected_square = tuple(game_data["selected_square"]) if game_data["selected_square"] else None
-        last_move = game_data["last_move"]
-        return board, current_player, game_state, selected_square, last_move
+        saved = GAME_STORE.latest_save()
+        if saved is None:
+            print("No saved games found.")
+            return "No saved games found."
+        start_fen, moves = GAME_STORE.load(saved)
+        AI_WORKER.cancel()
+        move_history = restore_game(start_fen, moves)
+        game_id = saved
     except Exception as e:
         print(f"Error loading game: {e}")
-        return None, None, None, None, None
-
-def get_ai_move(board, player):
-    def minimax(board, depth, maximizing_player, alpha, beta):
-        if depth == 0 or is_game_over(board):
-            return evaluate_board(board), None, None
-
-        if maximizing_player:
-            best_move = None
-            max_eval = -float('inf')
-            for r in range(BOARD_SIZE):
-                for c in range(BOARD_SIZE):
-                    if board[r][c] and board[r][c][0] == player:
-                        possible_moves = get_legal_moves(board, r, c, player)
-                        for move in possible_moves:
-                            new_board = [row[:] for row in board]
-                            move_piece(new_board, r, c, move[0], move[1], player)
-                            evaluation, _, _ = minimax(new_board, depth - 1, False, alpha, beta)
-                            if evaluation > max_eval:
-                                max_eval = evaluation
-                                best_move = (r, c, move[0], move[1])
-                            alpha = max(alpha, evaluation)
-                            if beta <= alpha:
-                                break
-                        if beta <= alpha:
-                            break
-            return max_eval, best_move[0], best_move[1], best_move[2], best_move[3]
-        else:
-            min_eval = float('inf')
-            best_move = None
-            for r in range(BOARD_SIZE):
-                for c in range(BOARD_SIZE):
-                    if board[r][c] and board[r][c][0] != player:
-                        possible_moves = get_legal_moves(board, r, c, player)
-                        for move in possible_moves:
-                            new_board = [row[:] for row in board]
-                            move_piece(new_board, r, c, move[0], move[1], player)
-                            evaluation, _, _ = minimax(new_board, depth - 1, True, alpha, beta)
-                            if evaluation < min_eval:
-                                min_eval = evaluation
-                                best_move = (r, c, move[0], move[1])
-                            beta = min(beta, evaluation)
-                            if beta <= alpha:
-                                break
-                        if beta <= alpha:
-                            break
-            return min_eval, best_move[0], best_move[1], best_move[2], best_move[3]
-
-    def evaluate_board(board):
-        evaluation = 0
-        piece_values = {
-            'P': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 100,
-        }
-        for r in range(BOARD_SIZE):
-            for c in range(BOARD_SIZE):
-                piece = board[r][c]
-                if piece:
-                    value = piece_values[piece[1]]
-                    if piece[0] == 'w':
-                        evaluation += value
-                    else:
-                        evaluation -= value
-        return evaluation
-
-    def is_game_over(board):
-        return is_checkmate(board, 'w') or is_checkmate(board, 'b') or is_stalemate(board, 'w') or is_stalemate(board, 'b')
-
-    depth = 2
-    alpha = -float('inf')
-    beta = float('inf')
-    _, start_row, start_col, end_row, end_col = minimax(board, depth, True, alpha, beta)
-    return start_row, start_col, end_row, end_col
+        return f"Error loading game: {e}"
+    show_history()
+    print(f"Game {game_id} loaded from {STORE_FILE}")
+
+def start_pondering(ai_move):
+    # While the human thinks, the AI searches the position after the reply
+    # it expects to ai_move, the move it has just played.
+    position = move_history.position
+    AI_WORKER.ponder(position, predicted_reply(AI_WORKER.search, position, ai_move))
+
+def answer_ponder(move):
+    # The human's move keeps the ponder search if it was the one predicted.
+    if AI_WORKER.opponent_moved(move, AI_TIME_BUDGET, AI_NODE_BUDGET):
+        print(f"AI ponder hit on {move_to_uci(move)}: {AI_WORKER.search.elapsed():.2f}s already searched")
+
+def report_ponder():
+    stats = AI_WORKER.ponder_stats()
+    if stats["hits"] or stats["misses"]:
+        print(f"AI pondering: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%}); "
+              f"{stats['saved_per_hit']:.2f}s saved per hit, {stats['saved_per_move']:.2f}s per move; "
+              f"answers took {stats['hit_latency']:.2f}s after hits, {stats['search_latency']:.2f}s after searches")
+
+def write_profile():
+    if profiling.ENABLED:
+        profiling.stop_sampler()
+        print(f"Profile written to {', '.join(profiling.dump())}")
+
+def exit_game():
+    AI_WORKER.cancel()
+    report_ponder()
+    close_search()
+    write_profile()
+    sys.exit()
 
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Chess Game")
-PIECE_SIZE_FACTOR = 0.7
-PIECE_IMAGES = get_piece_images(SQUARE_SIZE * PIECE_SIZE_FACTOR)
 board = init_board()
 current_player = 'w'
 selected_square = None
@@ -485,114 +376,166 @@ game_state = "Playing"
 game_over_text = None
 last_move = None
 play_ai = False
-undo_stack = []
-
-def switch_player():
-    global current_player
-    current_player = 'b' if current_player == 'w' else 'w'
-    
-def undo_move():
-    global board, current_player, selected_square, game_state, last_move
-    if undo_stack:
-        board, current_player, selected_square, last_move = undo_stack.pop()
-        game_state = "Playing"
-        game_over_text = None
-
-def play_vs_ai():
-    global play_ai
-    play_ai = True
-    global board, current_player, selected_square, game_state, last_move
-    board = init_board()
-    current_player = 'w'
-    selected_square = None
-    game_state = "Playing"
-    last_move = None
-
-def find_king(board, player):
-    for r in range(BOARD_SIZE):
-        for c in range(BOARD_SIZE):
-            if board[r][c] and board[r][c][0] == player and board[r][c][1] == 'K':
-                return r, c
-    return None
-
-running = True
-button_rects = []
-
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            x, y = event.pos
+# Every move of the game, for undo, redo and jumping to a ply.
+move_history = MoveHistory()
+game_id = None
+GAME_STORE = None
+FONT = None
+BUTTON_FONT = None
+PIECE_IMAGES = None
+AI_WORKER = None
+
+def main():
+    global pygame, FONT, BUTTON_FONT, PIECE_IMAGES, AI_WORKER, GAME_STORE
+    global selected_square, game_state, game_over_text
+    import pygame
+    pygame.init()
+    FONT = pygame.font.Font(None, 36)
+    BUTTON_FONT = pygame.font.Font(None, 24)
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("Chess Game")
+    PIECE_IMAGES = get_piece_images(SQUARE_SIZE * PIECE_SIZE_FACTOR)
+    AI_WORKER = AIWorker(get_search())
+    os.makedirs(SAVES_DIR, exist_ok=True)
+    GAME_STORE = GameStore(STORE_FILE)
+    profiling.start_sampler()
+    # F3 shows the profiling figures in place of the buttons.
+    show_profile = False
+    overlay = None
+    frames = 0
+
+    running = True
+    button_rects = []
+    clock = pygame.time.Clock()
+    # What is on screen, so each frame repaints only what changed.
+    drawn_squares = {}
+    drawn_menu = {}
+    drawn_view = None
+    dirty_rects = []
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.WINDOWEXPOSED:
+                drawn_squares.clear()
+                drawn_menu.clear()
+            elif event.type == pygame.KEYDOWN:
+                # Left and right step back and forward through the game, Home
+                # and End jump to its start and its last recorded move.
+                if event.key == pygame.K_LEFT:
+                    undo_move()
+                elif event.key == pygame.K_RIGHT:
+                    redo_move()
+                elif event.key == pygame.K_HOME:
+                    go_to_ply(0)
+                elif event.key == pygame.K_END:
+                    go_to_ply(len(move_history))
+                elif event.key == pygame.K_F3:
+                    show_profile = not show_profile
+                    overlay = profiling.overlay_lines() if show_profile else None
+                    drawn_menu.clear()
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                x, y = event.pos
             
-            for button_rect, button_action in button_rects:
-                if button_rect.collidepoint(x, y):
-                    result = button_action()
-                    if isinstance(result, tuple):
-                        board, current_player, game_state, selected_square, last_move = result
-                        if board is None:
-                            board = init_board()
-                            current_player = 'w'
-                            game_state = "Playing"
-                            selected_square = None
-                            last_move = None
-                    elif isinstance(result, str):
-                        display_message(screen, result)
-                    break
+                for button_rect, button_action in button_rects:
+                    if button_rect.collidepoint(x, y):
+                        result = button_action()
+                        if isinstance(result, str):
+                            display_message(screen, result)
+                            drawn_squares.clear()
+                            drawn_menu.clear()
+                        break
             
-            if 0 <= x < SCREEN_WIDTH- MENU_WIDTH and 0 <= y < SCREEN_HEIGHT:
-                col = x // SQUARE_SIZE
-                row = y // SQUARE_SIZE
+                ai_to_move = play_ai and current_player == 'b'
+                if 0 <= x < SCREEN_WIDTH- MENU_WIDTH and 0 <= y < SCREEN_HEIGHT and not ai_to_move:
+                    col = x // SQUARE_SIZE
+                    row = y // SQUARE_SIZE
 
-                if selected_square:
-                    start_row, start_col = selected_square
+                    if selected_square:
+                        start_row, start_col = selected_square
                     
-                    undo_stack.append(( [row[:] for row in board], current_player, selected_square, last_move))
-                    if move_piece(board, start_row, start_col, row, col, current_player):
-                        last_move = ( (start_row, start_col), (row, col) )
+                        move = legal_move(move_history.position, start_row, start_col, row, col)
+                        if move:
+                            record_move(move)
                         
-                        if is_checkmate(board, 'w' if current_player == 'b' else 'b'):
-                            game_state = "Game Over"
-                            game_over_text = f"{current_player.upper()} wins by checkmate!"
-                        elif is_stalemate(board, 'w' if current_player == 'b' else 'b'):
-                            game_state = "Game Over"
-                            game_over_text = "Stalemate!"
+                            result = position_status(move_history.position).result
+                            if result == "checkmate":
+                                game_state = "Game Over"
+                                game_over_text = f"{current_player.upper()} wins by checkmate!"
+                            elif result == "stalemate":
+                                game_state = "Game Over"
+                                game_over_text = "Stalemate!"
+                            else:
+                                switch_player()
+                            if play_ai:
+                                if result:
+                                    AI_WORKER.cancel()
+                                else:
+                                    answer_ponder(move)
+                            selected_square = None
                         else:
-                            switch_player()
-                        selected_square = None
+                            selected_square = row, col
                     else:
                         selected_square = row, col
-                else:
-                    selected_square = row, col
                     
-    draw_board(screen, board, selected_square, get_legal_moves(board, selected_square[0], selected_square[1], current_player) if selected_square else [], last_move, (find_king(board, 'w') if is_check(board, 'w') else find_king(board, 'b') if is_check(board, 'b') else None))
-    button_rects = draw_menu(screen, game_state, current_player, selected_square, game_over_text)
-    pygame.display.flip()
+        view = (move_history.position.key, current_player, selected_square, last_move)
+        if view != drawn_view or not drawn_squares:
+            drawn_view = view
+            status = position_status(move_history.position)
+            draw_board(screen, board, selected_square, status.moves.get(selected_square, []), last_move, status.check_square(),
+                       drawn_squares, dirty_rects)
+        if show_profile and not frames % PROFILE_REFRESH_FRAMES:
+            overlay = profiling.overlay_lines()
+        button_rects = draw_menu(screen, game_state, current_player, selected_square, game_over_text,
+                                 AI_WORKER.status() if AI_WORKER.busy() else None, drawn_menu, dirty_rects, overlay)
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
+            dirty_rects.clear()
+        clock.tick(FPS)
+        frames += 1
+        if profiling.ENABLED:
+            # The time the frame took to handle and draw, without the wait.
+            profiling.record_frame(clock.get_rawtime() / 1000)
     
-    if play_ai and current_player == 'b' and game_state == 'Playing':
-        pygame.time.delay(500)
-        
-        undo_stack.append(( [row[:] for row in board], current_player, selected_square, last_move))
-        
-        ai_start_row, ai_start_col, ai_end_row, ai_end_col = get_ai_move(board, 'b')
-        if move_piece(board, ai_start_row, ai_start_col, ai_end_row, ai_end_col, 'b'):
-            last_move = ( (ai_start_row, ai_start_col), (ai_end_row, ai_end_col) )
-            if is_checkmate(board, 'w'):
-                game_state = "Game Over"
-                game_over_text = "AI wins by checkmate!"
-            elif is_stalemate(board, 'w'):
-                game_state = "Game Over"
-                game_over_text = "Stalemate!"
+        if play_ai and current_player == 'b' and game_state == 'Playing':
+            ai_move = 0
+            if AI_WORKER.idle():
+                position = move_history.position.copy()
+                # A book move is played straight away, without a search.
+                ai_move = book_move(position)
+                if ai_move:
+                    print(f"AI book move: {move_to_uci(ai_move)}")
+                else:
+                    AI_WORKER.start(position, AI_TIME_BUDGET, AI_NODE_BUDGET)
             else:
-                switch_player()
-        selected_square = None
-
-def find_king(board, player):
-    for r in range(BOARD_SIZE):
-        for c in range(BOARD_SIZE):
-            if board[r][c] and board[r][c][0] == player and board[r][c][1] == 'K':
-                return r, c
-    return None
-
-pygame.quit()
-sys.exit()
+                ai_result = AI_WORKER.poll()
+                if ai_result and ai_result[0]:
+                    report_ai_search(AI_WORKER.search)
+                    ai_move = ai_result[0]
+            if ai_move:
+                # The search's move is legal in the position it was given.
+                record_move(ai_move)
+                result = position_status(move_history.position).result
+                if result == "checkmate":
+                    game_state = "Game Over"
+                    game_over_text = "AI wins by checkmate!"
+                elif result == "stalemate":
+                    game_state = "Game Over"
+                    game_over_text = "Stalemate!"
+                else:
+                    switch_player()
+                    if AI_PONDER:
+                        start_pondering(ai_move)
+                selected_square = None
+
+    AI_WORKER.cancel()
+    report_ponder()
+    close_search()
+    GAME_STORE.close()
+    write_profile()
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import os
+import sys
+
+from bitboard import (BLACK, COLOR_CHARS, START_FEN, WHITE, Position, encode_move, legal_moves, legal_moves_and_status,
+                      move_from, move_to, move_to_uci, parse_uci, row_col, square)
+import profiling
+from profiling import profiled
+from search import MATE_BOUND, MATE_SCORE, Search, evaluate, tablebase_score
+from transposition import TranspositionTable
+
+# The rules and the AI, with no display or pygame dependency.
+# Squares are the GUI's (row, col), row 0 being rank 8; positions are
+# bitboard Positions, which unlike the GUI's list boards know the castling
+# rights and en-passant square.
+
+AI_HASH_MB = 16
+# Per-move search budget: seconds of thinking, and optionally a node cap.
+AI_TIME_BUDGET = 1.0
+AI_NODE_BUDGET = None
+# Processes searching root moves in parallel; 1 searches in this process.
+AI_WORKERS = 1
+# Whether the GUI's AI searches on the human's time (see ai_worker.py).
+AI_PONDER = True
+
+SAVES_DIR = "saves"
+# The game store (see storage.py) every move is recorded in.
+STORE_FILE = os.path.join(SAVES_DIR, "games.sqlite3")
+# Opening book (see book.py) the AI plays from while it has the position;
+# the AI searches every move when the file does not exist.
+BOOK_FILE = "book.bin"
+
+def init_board():
+    board = [
+        ['bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR'],
+        ['bP', 'bP', 'bP', 'bP', 'bP', 'bP', 'bP', 'bP'],
+        ['', '', '', '', '', '', '', ''],
+        ['', '', '', '', '', '', '', ''],
+        ['', '', '', '', '', '', '', ''],
+        ['', '', '', '', '', '', '', ''],
+        ['wP', 'wP', 'wP', 'wP', 'wP', 'wP', 'wP', 'wP'],
+        ['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR'],
+    ]
+    return board
+
+class PositionStatus:
+    # Everything the GUI asks about one position: legal targets by square,
+    # check for both sides, king squares and the result. Built once per
+    # position by position_status and read until the next move or undo.
+
+    def __init__(self, position):
+        position = position.copy()
+        self.position = position
+        self.player = COLOR_CHARS[position.side]
+        self.moves = {}
+        moves, self.result = legal_moves_and_status(position)
+        for move in moves:
+            targets = self.moves.setdefault(row_col(move_from(move)), [])
+            target = row_col(move_to(move))
+            if target not in targets:
+                targets.append(target)
+        self.kings = {}
+        self.check = {}
+        for color, name in ((WHITE, 'w'), (BLACK, 'b')):
+            self.kings[name] = row_col(position.kings[color]) if position.kings[color] >= 0 else None
+            self.check[name] = position.in_check(color)
+
+    def check_square(self):
+        for player in ('w', 'b'):
+            if self.check[player]:
+                return self.kings[player]
+        return None
+
+# Keyed on the Zobrist key, which covers the castling rights and en-passant
+# square a list board cannot show.
+STATUS_CACHE = {}
+
+@profiled
+def position_status(position):
+    status = STATUS_CACHE.get(position.key)
+    if status is None:
+        if len(STATUS_CACHE) > 16:
+            STATUS_CACHE.clear()
+        status = STATUS_CACHE[position.key] = PositionStatus(position)
+    return status
+
+@profiled
+def get_legal_moves(position, row, col):
+    return position_status(position).moves.get((row, col), [])
+
+def legal_move(position, start_row, start_col, end_row, end_col):
+    # The engine move for a move of the GUI's in position, or 0 when it is
+    # not legal there. Promotions are to a queen.
+    if (end_row, end_col) not in get_legal_moves(position, start_row, start_col):
+        return 0
+    return encode_move(position, square(start_row, start_col), square(end_row, end_col))
+
+@profiled
+def move_piece(position, start_row, start_col, end_row, end_col):
+    # Plays a move of the GUI's on position. Returns the engine move played
+    # (never 0), or False.
+    move = legal_move(position, start_row, start_col, end_row, end_col)
+    if not move:
+        return False
+    position.make_move(move)
+    return move
+
+@profiled
+def is_check(position, player):
+    # Too cheap to be worth building a status for.
+    return position.in_check(COLOR_CHARS.index(player))
+
+_ai_search = None
+
+def get_search():
+    # Created on first use: the table allocation and the process-pool import
+    # are only paid for by callers that actually search.
+    global _ai_search
+    if _ai_search is None:
+        from parallel import ParallelSearch
+        # Lives for the whole session so the AI reuses the work of earlier moves.
+        _ai_search = ParallelSearch(AI_WORKERS, TranspositionTable(AI_HASH_MB), AI_HASH_MB)
+    return _ai_search
+
+def close_search():
+    global _ai_search
+    if _ai_search is not None:
+        _ai_search.close()
+        _ai_search = None
+
+_book = None
+_book_stat = None
+
+def get_book():
+    # Opened on first use, and again (closing the old one) if the file has
+    # been replaced or rewritten since, which its inode and mtime tell.
+    global _book, _book_stat
+    try:
+        stat = os.stat(BOOK_FILE)
+    except OSError:
+        return None
+    stamp = (stat.st_mtime_ns, stat.st_ino)
+    if _book is None or _book_stat != stamp:
+        from book import OpeningBook
+        if _book is not None:
+            _book.close()
+        _book = OpeningBook(BOOK_FILE)
+        _book_stat = stamp
+    return _book
+
+def book_move(position):
+    # The book's move for position (a copy is fine), or 0 when the position
+    # is not in the book or there is no book.
+    book = get_book()
+    return book.choose(position) if book is not None else 0
+
+def predicted_reply(search, position, played):
+    # The reply search expects to played, the move it just chose that led to
+    # position: the next move of its principal variation, else the table's
+    # move for position. 0 when it has none that is legal there.
+    if len(search.pv) > 1 and search.pv[0] == played:
+        move = search.pv[1]
+    else:
+        entry = search.table.probe(position.key)
+        move = entry[3] if entry else 0
+    return move if move in legal_moves(position) else 0
+
+def report_ai_search(search):
+    if profiling.ENABLED:
+        profiling.record_search(search)
+    if not search.depth and search.tablebase_hits:
+        print(f"AI tablebase move: {format_score(search.best_score)}")
+        return
+    stats = search.table.stats()
+    print(f"AI search: depth {search.depth}, {search.nodes} nodes in {search.elapsed():.2f}s; "
+          f"hash: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%}), "
+          f"{stats['hashfull'] / 10:.1f}% full of {stats['size_mb']} MB; "
+          f"{search.tablebase_hits} tablebase hits")
+
+def format_score(score):
+    if score > MATE_BOUND:
+        return f"mate {(MATE_SCORE - score + 1) // 2}"
+    if score < -MATE_BOUND:
+        return f"mate -{(MATE_SCORE + score) // 2}"
+    return f"cp {score}"
+
+def main():
+    # argparse is imported here: it pulls in re and friends, which cost more
+    # to import than the engine itself.
+    import argparse
+    parser = argparse.ArgumentParser(description="Headless chess engine")
+    parser.add_argument("command", choices=["eval", "move", "moves"],
+                        help="eval: static evaluation and game status; move: search for the best move; "
+                             "moves: list the legal moves")
+    parser.add_argument("--fen", default=START_FEN, help="position to analyse (default: the start position)")
+    parser.add_argument("--moves", nargs="*", default=[], metavar="UCI", help="moves to play from --fen first")
+    parser.add_argument("--depth", type=int, help="search depth for move")
+    parser.add_argument("--time", type=float, help="seconds to search for move")
+    parser.add_argument("--nodes", type=int, help="node budget for move")
+    parser.add_argument("--hash", type=int, default=AI_HASH_MB, help="transposition table size in MB")
+    parser.add_argument("--batch-eval", action="store_true",
+                        help="for move: score the last ply in batches, with mobility (see batch_eval.py)")
+    parser.add_argument("--book", default=BOOK_FILE, help=f"opening book for move (default: {BOOK_FILE} if present)")
+    args = parser.parse_args()
+
+    try:
+        position = Position.from_fen(args.fen)
+    except (ValueError, IndexError) as e:
+        parser.error(f"bad FEN: {e}")
+    for text in args.moves:
+        move = parse_uci(position, text)
+        if move is None:
+            parser.error(f"illegal move: {text}")
+        position.make_move(move)
+
+    if args.command == "moves":
+        print(" ".join(sorted(move_to_uci(move) for move in legal_moves(position))))
+    elif args.command == "eval":
+        status = legal_moves_and_status(position)[1]
+        if status:
+            print(status)
+        else:
+            # Reported from White's point of view; exact when the tablebases
+            # have the position.
+            from tablebase import open_tablebases
+            found = open_tablebases().probe(position)
+            score = tablebase_score(found, 0) if found is not None else evaluate(position)
+            if position.side == BLACK:
+                score = -score
+            print(f"{format_score(score)}{' check' if position.in_check() else ''}{' (tablebase)' if found is not None else ''}")
+    else:
+        if os.path.exists(args.book):
+            from book import OpeningBook
+            with OpeningBook(args.book) as book:
+                move = book.choose(position)
+            if move:
+                print(f"bestmove {move_to_uci(move)} (book)")
+                return 0
+        search = Search(TranspositionTable(args.hash), batch_eval=args.batch_eval)
+        time_limit = args.time
+        if args.depth is None and time_limit is None and args.nodes is None:
+            time_limit = AI_TIME_BUDGET
+        move, score = search.run(position, depth=args.depth, time_limit=time_limit, node_limit=args.nodes)
+        if not move:
+            print("bestmove (none)")
+            return 1
+        print(f"info depth {search.depth} score {format_score(score)} nodes {search.nodes} "
+              f"time {search.elapsed() * 1000:.0f} pv {' '.join(move_to_uci(move) for move in search.pv)}")
+        print(f"bestmove {move_to_uci(move)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
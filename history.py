@@ -0,0 +1,111 @@
+from array import array
+
+from bitboard import COLOR_CHARS, START_FEN, Position, move_from, move_to, row_col
+
+# The GUI's record of the game being played: every move as one packed
+# 64-bit delta, enough to take it back without replaying the game, and the
+# position's FEN every CHECKPOINT_INTERVAL plies, so that a jump to any ply
+# replays at most that many moves. Moves after the current ply are kept
+# until a different move is played there, which is what redo walks through.
+CHECKPOINT_INTERVAL = 32
+
+# Delta layout: the move (19 bits), then the state make_move overwrites,
+# each offset so that it is never negative: captured piece code + 1 (4
+# bits), castling rights (4), en-passant square + 1 (7) and the halfmove
+# clock above those. The Zobrist key and evaluation sums are recomputed on
+# undo rather than stored.
+MOVE_MASK = (1 << 19) - 1
+CAPTURED_SHIFT = 19
+CASTLING_SHIFT = 23
+EP_SHIFT = 27
+HALFMOVE_SHIFT = 34
+
+
+def pack_delta(record):
+    # A Position.history record as a delta.
+    move, captured, castling, ep, halfmove = record[:5]
+    return (move | ((captured + 1) << CAPTURED_SHIFT) | (castling << CASTLING_SHIFT) | ((ep + 1) << EP_SHIFT)
+            | (halfmove << HALFMOVE_SHIFT))
+
+
+def unpack_delta(delta):
+    # (move, captured, castling, ep, halfmove)
+    return (delta & MOVE_MASK, ((delta >> CAPTURED_SHIFT) & 15) - 1, (delta >> CASTLING_SHIFT) & 15,
+            ((delta >> EP_SHIFT) & 127) - 1, delta >> HALFMOVE_SHIFT)
+
+
+class MoveHistory:
+    def __init__(self, start_fen=START_FEN):
+        self.start_fen = start_fen
+        self.position = Position.from_fen(start_fen)
+        self.deltas = array('Q')
+        # checkpoints[i] is the FEN at ply i * CHECKPOINT_INTERVAL.
+        self.checkpoints = [start_fen]
+        self.ply = 0
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def moves(self):
+        # Every recorded move, including those past the current ply.
+        return [delta & MOVE_MASK for delta in self.deltas]
+
+    def push(self, move):
+        # Plays move (a legal move here) at the current ply, dropping the
+        # moves that had been undone.
+        del self.deltas[self.ply:]
+        del self.checkpoints[self.ply // CHECKPOINT_INTERVAL + 1:]
+        position = self.position
+        position.make_move(move)
+        self.deltas.append(pack_delta(position.history.pop()))
+        self.ply += 1
+        if not self.ply % CHECKPOINT_INTERVAL:
+            self.checkpoints.append(position.fen())
+
+    def undo(self):
+        if not self.ply:
+            return False
+        self.ply -= 1
+        position = self.position
+        # The delta stands in for the history record make_move would have
+        # kept; the key and sums it lacks are recomputed afterwards.
+        position.history.append(unpack_delta(self.deltas[self.ply]) + (0, 0, 0))
+        position.unmake_move()
+        position.key = position.compute_key()
+        position.score, position.phase = position.compute_score()
+        return True
+
+    def redo(self):
+        if self.ply == len(self.deltas):
+            return False
+        position = self.position
+        position.make_move(self.deltas[self.ply] & MOVE_MASK)
+        position.history.pop()
+        self.ply += 1
+        return True
+
+    def go_to(self, ply):
+        # Moves to any recorded ply: step by step when it is close, else from
+        # the nearest checkpoint before it.
+        ply = max(0, min(ply, len(self.deltas)))
+        if abs(ply - self.ply) > CHECKPOINT_INTERVAL:
+            index = ply // CHECKPOINT_INTERVAL
+            self.position = Position.from_fen(self.checkpoints[index])
+            self.ply = index * CHECKPOINT_INTERVAL
+        while self.ply > ply:
+            self.undo()
+        while self.ply < ply:
+            self.redo()
+
+    def last_move(self):
+        # The GUI's ((row, col), (row, col)) of the move that led here.
+        if not self.ply:
+            return None
+        move = self.deltas[self.ply - 1]
+        return row_col(move_from(move)), row_col(move_to(move))
+
+    def board(self):
+        return self.position.to_board()
+
+    def player(self):
+        return COLOR_CHARS[self.position.side]
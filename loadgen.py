@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from bitboard import Position, legal_moves, move_to_uci, parse_uci
+from server import DEFAULT_PORT
+
+# Load generator for server.py: plays many games against the server's AI at
+# once, each on its own connection, with the human side choosing random
+# legal moves, and reports the move throughput and the latency of each move
+# request (the human move plus the AI's answer) as the client saw it.
+
+
+class Stats:
+
+    def __init__(self):
+        self.latencies = []
+        self.plies = 0
+        self.games = 0
+        self.finished = 0
+        self.busy = 0
+        self.errors = []
+
+
+async def request(reader, writer, message):
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("server closed the connection")
+    return json.loads(line)
+
+
+async def request_until_accepted(reader, writer, message, stats, rng):
+    # Sends message again for as long as the server is too busy for it,
+    # spreading the retries so refused games do not all come back at once.
+    while True:
+        reply = await request(reader, writer, message)
+        if reply["ok"] or reply["error"] != "busy":
+            return reply
+        stats.busy += 1
+        await asyncio.sleep(reply["retry_after"] * rng.uniform(0.5, 1.5))
+
+
+async def play_game(index, args, stats, opening):
+    rng = random.Random(args.seed + index)
+    try:
+        async with opening:
+            if args.unix:
+                reader, writer = await asyncio.open_unix_connection(args.unix)
+            else:
+                reader, writer = await asyncio.open_connection(args.host, args.port)
+    except OSError as e:
+        stats.errors.append(str(e))
+        return
+    try:
+        new = {"op": "new", "ai": "w" if index % 2 else "b"}
+        for name in ("depth", "time", "nodes"):
+            if getattr(args, name) is not None:
+                new[name] = getattr(args, name)
+        reply = await request_until_accepted(reader, writer, new, stats, rng)
+        if not reply["ok"]:
+            stats.errors.append(reply["error"])
+            return
+        stats.games += 1
+        game = reply["game"]
+        # The client's copy of the game, to pick its moves from.
+        position = Position.initial()
+        for text in reply["played"]:
+            position.make_move(parse_uci(position, text))
+        stats.plies += len(reply["played"])
+        while reply["result"] is None and reply["ply"] < args.plies:
+            move = move_to_uci(rng.choice(sorted(legal_moves(position))))
+            # Time spent refused as busy counts towards the move's latency.
+            started = time.perf_counter()
+            reply = await request_until_accepted(reader, writer, {"op": "move", "game": game, "move": move}, stats, rng)
+            if not reply["ok"]:
+                stats.errors.append(reply["error"])
+                return
+            stats.latencies.append(time.perf_counter() - started)
+            for text in reply["played"]:
+                position.make_move(parse_uci(position, text))
+            stats.plies += len(reply["played"])
+        stats.finished += 1
+        await request(reader, writer, {"op": "close", "game": game})
+    except (ConnectionError, OSError) as e:
+        stats.errors.append(str(e))
+    finally:
+        writer.close()
+
+
+def percentile(values, fraction):
+    # values is sorted.
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def run(args):
+    stats = Stats()
+    # Connections are opened a few at a time so the listen backlog is not
+    # overrun before the first games start.
+    opening = asyncio.Semaphore(max(1, args.ramp))
+    started = time.perf_counter()
+    await asyncio.gather(*(play_game(index, args, stats, opening) for index in range(args.games)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(stats.latencies)
+    print(f"{stats.games} games started, {stats.finished} played to the end or {args.plies} plies, "
+          f"in {elapsed:.1f}s")
+    print(f"{len(latencies)} move requests, {stats.plies} plies: {len(latencies) / elapsed:,.1f} moves/s, "
+          f"{stats.plies / elapsed:,.1f} plies/s")
+    if latencies:
+        print(f"move latency: mean {sum(latencies) / len(latencies) * 1000:.1f} ms, "
+              f"p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms, "
+              f"max {latencies[-1] * 1000:.1f} ms")
+    print(f"{stats.busy} busy replies retried, {len(stats.errors)} errors")
+    for error in sorted(set(stats.errors))[:5]:
+        print(f"  {error}")
+    return 1 if stats.errors else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play many concurrent games against server.py and time them")
+    parser.add_argument("--host", default="127.0.0.1", help="server address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"server TCP port (default: {DEFAULT_PORT})")
+    parser.add_argument("--unix", metavar="PATH", help="connect to a Unix socket at PATH instead of TCP")
+    parser.add_argument("--games", type=int, default=200, help="games played at once")
+    parser.add_argument("--plies", type=int, default=40, help="plies after which a game is closed")
+    parser.add_argument("--depth", type=int, help="AI search depth for the games")
+    parser.add_argument("--time", type=float, help="AI seconds per move for the games")
+    parser.add_argument("--nodes", type=int, help="AI node budget per move for the games")
+    parser.add_argument("--ramp", type=int, default=50, help="connections opened at once while starting")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the random moves")
+    args = parser.parse_args()
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from bitboard import Position
+from search import DEFAULT_HASH_MB, INFINITY, Search, SearchTimeout, score_to_table
+from transposition import EXACT, TranspositionTable
+
+# Below this depth the root is cheaper to search in-process than to ship out.
+PARALLEL_MIN_DEPTH = 3
+
+_worker_search = None
+_worker_cancel = None
+
+
+def _init_worker(hash_mb, cancel=None):
+    # cancel (a multiprocessing.Event shared by the pool) stops the tasks
+    # already running, which Future.cancel() cannot.
+    global _worker_search, _worker_cancel
+    _worker_search = Search(TranspositionTable(hash_mb))
+    _worker_cancel = cancel
+
+
+def _search_root_move(fen, move, depth, alpha, deadline, node_limit):
+    # Runs in a pool process: score one root move with a window that can only
+    # prove it better than the first move's score.
+    search = _worker_search
+    search.reset()
+    # The caller has completed depth - 1, so limits may interrupt this one.
+    search.depth = depth - 1
+    if deadline is not None:
+        search.deadline = search.started + (deadline - time.time())
+    search.node_limit = node_limit
+    search.stop_event = _worker_cancel
+    position = Position.from_fen(fen)
+    position.make_move(move)
+    try:
+        score = -search.negamax(position, depth - 1, -INFINITY, -alpha, 1)[0]
+    except SearchTimeout:
+        return None, search.nodes
+    return score, search.nodes
+
+
+class ParallelSearch(Search):
+    # Splits the root across a process pool: the first (PV) move is searched
+    # here to set alpha, then every other root move goes to a worker with the
+    # window (alpha, +inf). Moves that fail low cannot be best, the others get
+    # exact scores, and the first best in root order wins, so the result is
+    # the same move and score as the single-process search at a fixed depth.
+
+    def __init__(self, workers=None, table=None, hash_mb=DEFAULT_HASH_MB):
+        super().__init__(table)
+        self.workers = workers or os.cpu_count() or 1
+        self.hash_mb = hash_mb
+        self.executor = None
+        self.cancel = None
+
+    def start(self):
+        if self.executor is None and self.workers > 1:
+            self.cancel = multiprocessing.Event()
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                initargs=(self.hash_mb, self.cancel))
+        return self
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def search_root(self, position, depth):
+        self.start()
+        if self.executor is None or depth < PARALLEL_MIN_DEPTH:
+            return super().search_root(position, depth)
+        # In the single-process search's order, so both find the same first
+        # best move.
+        moves = self.root_moves(position)
+        if len(moves) < 2:
+            return super().search_root(position, depth)
+
+        best_move = moves[0]
+        position.make_move(best_move)
+        best_score = -self.negamax(position, depth - 1, -INFINITY, INFINITY, 1)[0]
+        position.unmake_move()
+
+        fen = position.fen()
+        deadline = None
+        if self.deadline is not None:
+            deadline = time.time() + (self.deadline - time.perf_counter())
+        node_limit = None
+        if self.node_limit is not None:
+            node_limit = max(1, (self.node_limit - self.nodes) // len(moves))
+        self.cancel.clear()
+        futures = [self.executor.submit(_search_root_move, fen, move, depth, best_score, deadline, node_limit)
+                   for move in moves[1:]]
+        timed_out = False
+        for move, future in zip(moves[1:], futures):
+            # The limits can change (or be set, for a ponder search) after the
+            # tasks were sent, so they are checked here as well; on a stop the
+            # running tasks are told to finish before the next search clears
+            # the event.
+            while not future.done():
+                try:
+                    self.check_limits()
+                except SearchTimeout:
+                    for pending in futures:
+                        pending.cancel()
+                    self.cancel.set()
+                    wait(futures)
+                    raise
+                wait([future], timeout=0.01)
+            score, nodes = future.result()
+            self.nodes += nodes
+            if score is None:
+                timed_out = True
+            elif score > best_score:
+                best_score = score
+                best_move = move
+        if timed_out:
+            raise SearchTimeout
+        self.table.store(position.key, depth, EXACT, score_to_table(best_score, 0), best_move)
+        return best_score, best_move
@@ -0,0 +1,93 @@
+import argparse
+import sys
+import time
+
+from bitboard import START_FEN, Position, legal_moves, move_to_uci
+
+# Standard test positions with their published leaf counts for depth 1, 2, ...
+# Between them they cover castling through and out of attacked squares, en
+# passant (including the discovered-check case), promotions and pins.
+PERFT_POSITIONS = {
+    "start": (START_FEN, [20, 400, 8902, 197281, 4865609]),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 [48, 2039, 97862, 4085603]),
+    "endgame": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+    "promotions": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                   [6, 264, 9467, 422333]),
+    "middlegame": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+}
+
+
+def perft(position, depth):
+    # Leaves at depth are counted straight from the last move list rather
+    # than made and unmade one by one.
+    if depth == 0:
+        return 1
+    moves = legal_moves(position)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        position.make_move(move)
+        nodes += perft(position, depth - 1)
+        position.unmake_move()
+    return nodes
+
+
+def divide(position, depth):
+    # Leaf count below each root move, for finding the move a generator bug
+    # hides under.
+    counts = []
+    for move in legal_moves(position):
+        position.make_move(move)
+        counts.append((move_to_uci(move), perft(position, depth - 1)))
+        position.unmake_move()
+    return sorted(counts)
+
+
+def timed_perft(fen, depth):
+    position = Position.from_fen(fen)
+    start = time.perf_counter()
+    nodes = perft(position, depth)
+    return nodes, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count move-generator leaf nodes on standard positions")
+    parser.add_argument("positions", nargs="*", metavar="position",
+                        help=f"positions to run: {', '.join(PERFT_POSITIONS)} (default: all)")
+    parser.add_argument("--depth", type=int, default=3, help="depth to count to")
+    parser.add_argument("--fen", help="count a custom position instead")
+    parser.add_argument("--divide", action="store_true", help="also print the count below each root move")
+    args = parser.parse_args()
+    for name in args.positions:
+        if name not in PERFT_POSITIONS:
+            parser.error(f"unknown position: {name}")
+    if args.depth < 1:
+        parser.error("depth must be at least 1")
+
+    if args.fen:
+        runs = [("custom", args.fen, None)]
+    else:
+        runs = []
+        for name in args.positions or PERFT_POSITIONS:
+            fen, counts = PERFT_POSITIONS[name]
+            runs.append((name, fen, counts[args.depth - 1] if args.depth <= len(counts) else None))
+
+    failed = False
+    print(f"{'position':<12}{'depth':>6}{'nodes':>12}{'expected':>12}{'seconds':>10}{'nodes/s':>12}")
+    for name, fen, expected in runs:
+        nodes, seconds = timed_perft(fen, args.depth)
+        status = "" if expected is None or nodes == expected else "  MISMATCH"
+        failed = failed or bool(status)
+        expected_text = f"{expected:,}" if expected is not None else "-"
+        print(f"{name:<12}{args.depth:>6}{nodes:>12,}{expected_text:>12}{seconds:>10.2f}"
+              f"{nodes / seconds:>12,.0f}{status}")
+        if args.divide:
+            for move, count in divide(Position.from_fen(fen), args.depth):
+                print(f"  {move:<8}{count:>12,}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
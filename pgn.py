@@ -0,0 +1,186 @@
+import time
+
+from bitboard import (FILE_CHARS, FLAG_CAPTURE, FLAG_CASTLE, KING, PAWN, PIECE_CHARS, legal_moves, move_promotion,
+                      parse_square, square_name)
+
+# Tags every PGN game carries, in the order the standard requires.
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+LINE_LENGTH = 80
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+
+def move_to_san(position, move):
+    # Standard algebraic notation for a legal move in position; the position
+    # is left as it was found.
+    frm = move & 63
+    to = (move >> 6) & 63
+    ptype = position.squares[frm] % 6
+    if move & FLAG_CASTLE:
+        san = "O-O" if to > frm else "O-O-O"
+    elif ptype == PAWN:
+        san = square_name(frm)[0] + "x" if move & FLAG_CAPTURE else ""
+        san += square_name(to)
+        if move_promotion(move):
+            san += "=" + PIECE_CHARS[move_promotion(move)]
+    else:
+        san = PIECE_CHARS[ptype]
+        if ptype != KING:
+            rivals = [other & 63 for other in legal_moves(position)
+                      if (other >> 6) & 63 == to and other & 63 != frm and position.squares[other & 63] % 6 == ptype]
+            if rivals:
+                name = square_name(frm)
+                if all(other & 7 != frm & 7 for other in rivals):
+                    san += name[0]
+                elif all(other >> 3 != frm >> 3 for other in rivals):
+                    san += name[1]
+                else:
+                    san += name
+        if move & FLAG_CAPTURE:
+            san += "x"
+        san += square_name(to)
+    position.make_move(move)
+    if position.in_check():
+        san += "+" if legal_moves(position) else "#"
+    position.unmake_move()
+    return san
+
+
+def san_to_move(position, san):
+    # The legal move a SAN token names in position, or None if it names no
+    # move or more than one.
+    san = san.rstrip("+#!?")
+    moves = legal_moves(position)
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        kingside = len(san) == 3
+        for move in moves:
+            if move & FLAG_CASTLE and (((move >> 6) & 63) > (move & 63)) == kingside:
+                return move
+        return None
+    promotion = 0
+    if "=" in san:
+        san, piece = san.split("=", 1)
+        if piece.upper() not in "NBRQ" or len(piece) != 1:
+            return None
+        promotion = PIECE_CHARS.index(piece.upper())
+    elif len(san) > 2 and san[-1] in "NBRQ" and san[-2] in "18":
+        promotion = PIECE_CHARS.index(san[-1])
+        san = san[:-1]
+    if len(san) < 2 or san[-2] not in FILE_CHARS or san[-1] not in "12345678":
+        return None
+    to = parse_square(san[-2:])
+    if san[0] in "NBRQK":
+        ptype = PIECE_CHARS.index(san[0])
+        spec = san[1:-2].replace("x", "")
+    else:
+        ptype = PAWN
+        spec = san[:-2].replace("x", "")
+    found = None
+    for move in moves:
+        frm = move & 63
+        if ((move >> 6) & 63 != to or position.squares[frm] % 6 != ptype
+                or move_promotion(move) != promotion or not all(char in square_name(frm) for char in spec)):
+            continue
+        if found is not None:
+            return None
+        found = move
+    return found
+
+
+def _strip_comments(text):
+    # Drops {comments}, ;comments to the end of the line and (variations),
+    # which may nest.
+    out = []
+    depth = 0
+    in_brace = False
+    in_line_comment = False
+    for char in text:
+        if in_line_comment:
+            if char == "\n":
+                in_line_comment = False
+                out.append(" ")
+        elif in_brace:
+            if char == "}":
+                in_brace = False
+                out.append(" ")
+        elif char == "{":
+            in_brace = True
+        elif char == ";":
+            in_line_comment = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth = max(0, depth - 1)
+            out.append(" ")
+        elif not depth:
+            out.append(char)
+    return "".join(out)
+
+
+def _movetext_tokens(movetext):
+    for token in _strip_comments(movetext).split():
+        token = token.lstrip("0123456789").lstrip(".") if token[0].isdigit() and "." in token else token
+        if token and not token.startswith("$"):
+            yield token
+
+
+def read_games(lines):
+    # Yields (tags, SAN tokens, result) per game from an iterable of PGN
+    # lines, one game at a time, so files of any size stream through.
+    tags = {}
+    movetext = []
+
+    def finish():
+        sans = []
+        result = tags.get("Result", "*")
+        for token in _movetext_tokens("".join(movetext)):
+            if token in RESULTS:
+                result = token
+                break
+            sans.append(token)
+        return dict(tags), sans, result
+
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("[") and stripped.endswith("]"):
+            if movetext:
+                yield finish()
+                tags.clear()
+                movetext.clear()
+            name, _, value = stripped[1:-1].partition(" ")
+            tags[name] = value.strip().strip('"')
+        elif stripped or movetext:
+            movetext.append(line if line.endswith("\n") else line + "\n")
+    if movetext or tags:
+        yield finish()
+
+
+def format_pgn(tags, sans, result, first_ply=0):
+    # tags maps tag names to values; the seven tag roster comes first, in its
+    # order, with "?" for any that are missing. first_ply is the number of
+    # half-moves played before sans starts (odd when Black moves first).
+    tags = dict(tags, Result=result)
+    lines = [f'[{name} "{tags.get(name, "?")}"]' for name in SEVEN_TAG_ROSTER]
+    lines += [f'[{name} "{value}"]' for name, value in tags.items() if name not in SEVEN_TAG_ROSTER]
+    lines.append("")
+
+    tokens = []
+    for ply, san in enumerate(sans, first_ply):
+        if ply % 2 == 0:
+            tokens.append(f"{ply // 2 + 1}.")
+        elif ply == first_ply:
+            tokens.append(f"{ply // 2 + 1}...")
+        tokens.append(san)
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+
+def pgn_date(timestamp=None):
+    return time.strftime("%Y.%m.%d", time.localtime(timestamp))
@@ -0,0 +1,194 @@
+import os
+import sys
+import time
+
+# Opt-in instrumentation for the engine and the GUI, switched on by setting
+# CHESS_PROFILE=1 in the environment before start-up. The switch is read
+# once: while it is off, profiled() hands back the function it was given and
+# nothing else here is called, so the hot paths run exactly as they would
+# without this module.
+#
+# While on it keeps call counts and latencies of the functions marked
+# profiled, the counters of each finished AI search, a histogram of frame
+# times, and (once start_sampler() has been called) a statistical profile
+# from sampling every thread's stack. dump() writes them out as JSON and as
+# folded stacks, one "frame;frame;frame count" line per stack, the input
+# format of flamegraph.pl and speedscope.
+ENABLED = os.environ.get("CHESS_PROFILE", "") not in ("", "0")
+PROFILE_DIR = "profiles"
+
+# Function name -> [calls, total ns, slowest ns]. Counters are bumped from
+# the AI thread as well as the GUI's without a lock; a lost increment now
+# and then does not matter here.
+CALLS = {}
+# Frame time histogram: frames faster than each bound, in ms, then slower.
+FRAME_BOUNDS_MS = (5, 10, 17, 33, 50, 100)
+FRAMES = [0] * (len(FRAME_BOUNDS_MS) + 1)
+frame_total = 0.0
+frame_max = 0.0
+SEARCHES = []
+MAX_SEARCHES = 100
+SAMPLE_INTERVAL = 0.005
+SAMPLES = {}
+_sampler = None
+
+
+def profiled(function):
+    if not ENABLED:
+        return function
+    name = function.__qualname__
+    stats = CALLS[name] = [0, 0, 0]
+    clock = time.perf_counter_ns
+
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = clock() - start
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+
+    wrapper.__name__ = function.__name__
+    wrapper.__qualname__ = name
+    wrapper.__wrapped__ = function
+    return wrapper
+
+
+def record_frame(seconds):
+    global frame_total, frame_max
+    ms = seconds * 1000
+    for index, bound in enumerate(FRAME_BOUNDS_MS):
+        if ms < bound:
+            break
+    else:
+        index = len(FRAME_BOUNDS_MS)
+    FRAMES[index] += 1
+    frame_total += ms
+    frame_max = max(frame_max, ms)
+
+
+def search_summary(search):
+    # The counters of a finished Search as plain numbers and rates.
+    elapsed = search.elapsed()
+    interior = search.nodes - search.quiescence_nodes
+    table = search.table.stats()
+    return {
+        "depth": search.depth,
+        "nodes": search.nodes,
+        "seconds": round(elapsed, 4),
+        "nodes_per_s": round(search.nodes / elapsed) if elapsed else 0,
+        "quiescence_share": round(search.quiescence_nodes / search.nodes, 3) if search.nodes else 0.0,
+        "cutoff_rate": round(search.cutoffs / interior, 3) if interior > 0 else 0.0,
+        "first_move_cutoffs": round(search.first_move_cutoffs / search.cutoffs, 3) if search.cutoffs else 0.0,
+        "tt_hit_rate": round(table["hit_rate"], 3),
+        "tablebase_hits": search.tablebase_hits,
+    }
+
+
+def record_search(search):
+    SEARCHES.append(search_summary(search))
+    del SEARCHES[:-MAX_SEARCHES]
+
+
+def snapshot():
+    calls = {name: {"calls": calls, "total_ms": round(total / 1e6, 3),
+                    "mean_us": round(total / calls / 1e3, 2) if calls else 0.0, "max_us": round(slowest / 1e3, 2)}
+             for name, (calls, total, slowest) in CALLS.items()}
+    frames = sum(FRAMES)
+    return {
+        "calls": calls,
+        "frames": {
+            "count": frames,
+            "mean_ms": round(frame_total / frames, 2) if frames else 0.0,
+            "max_ms": round(frame_max, 2),
+            "histogram": {f"<{bound}ms": count for bound, count in zip(FRAME_BOUNDS_MS, FRAMES)}
+            | {f">={FRAME_BOUNDS_MS[-1]}ms": FRAMES[-1]},
+        },
+        "searches": SEARCHES,
+        "samples": sum(SAMPLES.values()),
+    }
+
+
+def overlay_lines():
+    # Short lines for the GUI's side panel.
+    if not ENABLED:
+        return ["Profiling is off;", "set CHESS_PROFILE=1", "and restart to record."]
+    frames = sum(FRAMES) or 1
+    # Shares of frames inside the 60 and 30 fps budgets.
+    lines = [f"Frame {frame_total / frames:.1f} ms, max {frame_max:.0f}",
+             f"<17ms {sum(FRAMES[:3]) / frames:.0%}  <33ms {sum(FRAMES[:4]) / frames:.0%}"]
+    if SEARCHES:
+        last = SEARCHES[-1]
+        lines.append(f"Search {last['nodes_per_s']:,} n/s d{last['depth']}")
+        lines.append(f"cut {last['cutoff_rate']:.0%} 1st {last['first_move_cutoffs']:.0%} "
+                     f"TT {last['tt_hit_rate']:.0%}")
+    slowest = sorted(CALLS.items(), key=lambda item: -item[1][1])
+    for name, (calls, total, _) in slowest[:5]:
+        if calls:
+            lines.append(f"{name.rsplit('.', 1)[-1][:14]} {calls:,}x {total / calls / 1e3:.0f}us")
+    return lines
+
+
+def _sample_loop(stop_event, interval):
+    import threading
+    me = threading.get_ident()
+    names = {}
+    while not stop_event.wait(interval):
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            if ident not in names:
+                names[ident] = next((thread.name for thread in threading.enumerate() if thread.ident == ident),
+                                    str(ident))
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(names[ident])
+            key = ";".join(reversed(stack))
+            SAMPLES[key] = SAMPLES.get(key, 0) + 1
+
+
+def start_sampler(interval=SAMPLE_INTERVAL):
+    # Samples the stacks of every other thread every interval seconds, on a
+    # daemon thread, until stop_sampler().
+    global _sampler
+    if not ENABLED or _sampler is not None:
+        return
+    import threading
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_sample_loop, args=(stop_event, interval), name="profiling sampler",
+                              daemon=True)
+    thread.start()
+    _sampler = thread, stop_event
+
+
+def stop_sampler():
+    global _sampler
+    if _sampler is not None:
+        thread, stop_event = _sampler
+        stop_event.set()
+        thread.join()
+        _sampler = None
+
+
+def dump(directory=PROFILE_DIR):
+    # Writes profile-<time>.json and, when stacks were sampled, the matching
+    # .folded file; returns the paths written.
+    import json
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S"))
+    paths = [base + ".json"]
+    with open(paths[0], "w") as f:
+        json.dump(snapshot(), f, indent=2)
+        f.write("\n")
+    if SAMPLES:
+        paths.append(base + ".folded")
+        with open(paths[1], "w") as f:
+            for stack, count in sorted(SAMPLES.items()):
+                f.write(f"{stack} {count}\n")
+    return paths
@@ -0,0 +1,488 @@
+import time
+
+from bitboard import (BISHOP, EMPTY, FLAG_CAPTURE, FLAG_EN_PASSANT, PAWN, PROMOTION_SHIFT, QUEEN, ROOK, WHITE,
+                      attackers_to, bishop_attacks, generate_legal, legal_moves, legal_moves_and_status, rook_attacks)
+from profiling import profiled
+from psqt import taper
+from transposition import EXACT, LOWER, UPPER, TranspositionTable
+
+MATE_SCORE = 100000
+# Scores beyond this are mates; they are stored in the table relative to the
+# node so that the same mate found at a different ply keeps its distance.
+MATE_BOUND = MATE_SCORE - 1000
+INFINITY = MATE_SCORE + 1
+
+DEFAULT_HASH_MB = 16
+MAX_DEPTH = 64
+MAX_PLY = 128
+# Limits are checked every this many nodes.
+CHECK_INTERVAL = 1024
+
+# Move ordering bands: hash/PV move, then captures and promotions by
+# MVV-LVA, then the two killer moves, then quiet moves by history score.
+ORDER_HASH_MOVE = 1 << 30
+ORDER_CAPTURE = 1 << 24
+ORDER_KILLER = 1 << 23
+MVV_LVA_VALUES = (1, 3, 3, 5, 9, 10)
+# Piece values for static exchange evaluation; the king's is large enough
+# that giving it up never pays.
+SEE_VALUES = (100, 320, 330, 500, 900, 20000)
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+@profiled
+def evaluate(position):
+    # Material and piece-square terms, tapered between middlegame and
+    # endgame. make_move keeps the sums current, so nothing is counted here.
+    score = taper(position.score, position.phase)
+    return score if position.side == WHITE else -score
+
+
+def mvv_lva(squares, move):
+    # Most valuable victim first, then least valuable attacker; promotions
+    # count the promoted piece as part of the gain.
+    promotion = (move >> PROMOTION_SHIFT) & 7
+    victim = squares[(move >> 6) & 63]
+    victim_value = MVV_LVA_VALUES[victim % 6] if victim != EMPTY else MVV_LVA_VALUES[0]
+    if promotion:
+        victim_value += MVV_LVA_VALUES[promotion]
+    return victim_value * 16 - MVV_LVA_VALUES[squares[move & 63] % 6]
+
+
+def static_exchange(position, move):
+    # Material the side to move comes out with if both sides keep
+    # recapturing on the target square with their least valuable attacker,
+    # each free to stop when going on would lose more (the swap algorithm).
+    # Pieces uncovered behind a capturer join in as they are revealed.
+    frm = move & 63
+    to = (move >> 6) & 63
+    squares = position.squares
+    occ = position.occupied[0] | position.occupied[1]
+    if move & FLAG_EN_PASSANT:
+        gains = [SEE_VALUES[PAWN]]
+        occ ^= 1 << (to - 8 if position.side == WHITE else to + 8)
+    else:
+        gains = [SEE_VALUES[squares[to] % 6] if squares[to] != EMPTY else 0]
+    on_square = SEE_VALUES[squares[frm] % 6]
+    promotion = (move >> PROMOTION_SHIFT) & 7
+    if promotion:
+        gains[0] += SEE_VALUES[promotion] - SEE_VALUES[PAWN]
+        on_square = SEE_VALUES[promotion]
+    pieces = position.pieces
+    diagonal = pieces[0][BISHOP] | pieces[0][QUEEN] | pieces[1][BISHOP] | pieces[1][QUEEN]
+    straight = pieces[0][ROOK] | pieces[0][QUEEN] | pieces[1][ROOK] | pieces[1][QUEEN]
+    occ ^= 1 << frm
+    attackers = attackers_to(position, to, occ) & occ
+    side = position.side ^ 1
+    while True:
+        gains.append(on_square - gains[-1])
+        if max(-gains[-2], gains[-1]) < 0:
+            break
+        ours = attackers & position.occupied[side]
+        if not ours:
+            break
+        for ptype in range(6):
+            bb = ours & pieces[side][ptype]
+            if bb:
+                break
+        occ ^= bb & -bb
+        if ptype in (PAWN, BISHOP, QUEEN):
+            attackers |= bishop_attacks(to, occ) & diagonal
+        if ptype in (ROOK, QUEEN):
+            attackers |= rook_attacks(to, occ) & straight
+        attackers &= occ
+        on_square = SEE_VALUES[ptype]
+        side ^= 1
+    # The last entry is a capture nobody made; fold the rest back, each side
+    # taking the better of stopping and going on.
+    gains.pop()
+    for index in range(len(gains) - 1, 0, -1):
+        gains[index - 1] = -max(-gains[index - 1], gains[index])
+    return gains[0]
+
+
+def tablebase_score(found, ply):
+    # A tablebase (result, plies) as a score at ply: wins and losses are
+    # mates at their exact distance.
+    result, plies = found
+    if result > 0:
+        return MATE_SCORE - ply - plies
+    if result < 0:
+        return -MATE_SCORE + ply + plies
+    return 0
+
+
+def score_to_table(score, ply):
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class Search:
+    def __init__(self, table=None, tablebases=None, batch_eval=False, quiescence=True):
+        self.table = table if table is not None else TranspositionTable(DEFAULT_HASH_MB)
+        # Without quiescence, leaves take the static evaluation as it stands,
+        # mid-exchange or not (kept for comparison in benchmark.py).
+        self.use_quiescence = quiescence
+        # With batch_eval, nodes one ply from the horizon score all their
+        # children in one batch_eval.evaluate_boards call (material,
+        # piece-square and mobility terms) instead of evaluate() per child.
+        self.batch_eval = None
+        if batch_eval:
+            import batch_eval as batch_module
+            self.batch_eval = batch_module
+        # Endgame tables (see tablebase.py); without any, probing costs one
+        # piece count per node. Imported here so that importing the search
+        # alone does not load the tablebase code.
+        if tablebases is None:
+            from tablebase import open_tablebases
+            tablebases = open_tablebases()
+        self.tablebases = tablebases
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        self.history = [0] * (12 * 64)
+        self.reset()
+
+    def reset(self):
+        self.nodes = 0
+        # Of the nodes, those searched by quiescence, and the beta cutoffs of
+        # the others (how many came from the first move tried tells how well
+        # moves are ordered).
+        self.quiescence_nodes = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.tablebase_hits = 0
+        self.depth = 0
+        self.best_move = 0
+        self.best_score = 0
+        self.pv = []
+        self.time_limit = None
+        self.deadline = None
+        self.node_limit = None
+        self.stop_event = None
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def limit(self, time_limit=None, node_limit=None):
+        # Sets the limits of a search that is already running (one started
+        # without any, to ponder), counted from its start. Called from
+        # another thread; the search reads them at its next check.
+        self.node_limit = node_limit
+        if time_limit is not None:
+            self.time_limit = time_limit
+            self.deadline = self.started + time_limit
+
+    def check_limits(self):
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchTimeout
+        # The first iteration always completes so there is a move to play.
+        if not self.depth:
+            return
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout
+
+    def order_moves(self, position, moves, hash_move, ply):
+        squares = position.squares
+        killer_1, killer_2 = self.killers[ply]
+        history = self.history
+
+        def order(move):
+            if move == hash_move:
+                return ORDER_HASH_MOVE
+            if move & FLAG_CAPTURE or (move >> PROMOTION_SHIFT) & 7:
+                return ORDER_CAPTURE + mvv_lva(squares, move)
+            if move == killer_1:
+                return ORDER_KILLER + 1
+            if move == killer_2:
+                return ORDER_KILLER
+            return history[squares[move & 63] * 64 + ((move >> 6) & 63)]
+
+        moves.sort(key=order, reverse=True)
+        return moves
+
+    def staged_moves(self, position, hash_move, ply):
+        # The legal moves in search order, generated a stage at a time: the
+        # hash move, captures and promotions by MVV-LVA, the killers, then
+        # the other quiet moves by history. A cutoff during the captures
+        # saves generating and sorting the quiet moves altogether. A quiet
+        # hash move has to be checked against the quiet moves, so those are
+        # generated up front when there is one. The check and pin analysis is
+        # done once and shared by both stages.
+        quiets = legality = None
+        if hash_move and not (hash_move & FLAG_CAPTURE or (hash_move >> PROMOTION_SHIFT) & 7):
+            quiets, legality = generate_legal(position, captures=False)
+            if hash_move in quiets:
+                yield hash_move
+            else:
+                hash_move = 0
+        squares = position.squares
+        captures, legality = generate_legal(position, quiets=False, legality=legality)
+        if hash_move in captures:
+            yield hash_move
+        captures.sort(key=lambda move: mvv_lva(squares, move), reverse=True)
+        for move in captures:
+            if move != hash_move:
+                yield move
+
+        if quiets is None:
+            quiets = generate_legal(position, captures=False, legality=legality)[0]
+        killers = [move for move in self.killers[ply] if move and move != hash_move and move in quiets]
+        yield from killers
+        history = self.history
+        quiets.sort(key=lambda move: history[squares[move & 63] * 64 + ((move >> 6) & 63)], reverse=True)
+        for move in quiets:
+            if move != hash_move and move not in killers:
+                yield move
+
+    def quiescence(self, position, alpha, beta, ply):
+        # Resolves captures past the horizon so that leaves are scored only
+        # once the position is quiet. The side to move may stand pat on the
+        # static score; captures that lose material by static exchange are
+        # not tried. In check there is no standing pat: every evasion is
+        # searched, and having none is mate.
+        self.nodes += 1
+        self.quiescence_nodes += 1
+        if not self.nodes % CHECK_INTERVAL:
+            self.check_limits()
+        tablebases = self.tablebases
+        if (position.occupied[0] | position.occupied[1]).bit_count() <= tablebases.max_pieces:
+            found = tablebases.probe(position)
+            if found is not None:
+                self.tablebase_hits += 1
+                return tablebase_score(found, ply)
+        if ply >= MAX_PLY - 1:
+            return evaluate(position)
+
+        if position.in_check():
+            moves, status = legal_moves_and_status(position)
+            if status:
+                return -MATE_SCORE + ply
+            self.order_moves(position, moves, 0, ply)
+            best_score = -INFINITY
+        else:
+            best_score = evaluate(position)
+            if best_score >= beta:
+                return best_score
+            if best_score > alpha:
+                alpha = best_score
+            squares = position.squares
+            moves = [move for move in legal_moves(position, quiets=False)
+                     if (move >> PROMOTION_SHIFT) & 7 in (0, QUEEN) and static_exchange(position, move) >= 0]
+            moves.sort(key=lambda move: mvv_lva(squares, move), reverse=True)
+        for move in moves:
+            position.make_move(move)
+            score = -self.quiescence(position, -beta, -alpha, ply + 1)
+            position.unmake_move()
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best_score
+
+    def negamax(self, position, depth, alpha, beta, ply):
+        if depth <= 0 and self.use_quiescence:
+            return self.quiescence(position, alpha, beta, ply), 0
+        self.nodes += 1
+        if not self.nodes % CHECK_INTERVAL:
+            self.check_limits()
+
+        key = position.key
+        entry = self.table.probe(key) if depth else None
+        hash_move = 0
+        if entry:
+            entry_depth, bound, score, hash_move = entry
+            if ply and entry_depth >= depth:
+                score = score_from_table(score, ply)
+                if bound == EXACT or (bound == LOWER and score >= beta) or (bound == UPPER and score <= alpha):
+                    return score, hash_move
+
+        tablebases = self.tablebases
+        if ply and (position.occupied[0] | position.occupied[1]).bit_count() <= tablebases.max_pieces:
+            found = tablebases.probe(position)
+            if found is not None:
+                self.tablebase_hits += 1
+                return tablebase_score(found, ply), 0
+
+        if depth == 0:
+            status = legal_moves_and_status(position)[1]
+            if status:
+                return (-MATE_SCORE + ply if status == "checkmate" else 0), 0
+            return evaluate(position), 0
+        if depth == 1 and self.batch_eval is not None:
+            moves, status = legal_moves_and_status(position)
+            if status:
+                return (-MATE_SCORE + ply if status == "checkmate" else 0), 0
+            return self.score_frontier(position, moves, ply)
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = 0
+        searched = 0
+        for move in self.staged_moves(position, hash_move, ply):
+            position.make_move(move)
+            score = -self.negamax(position, depth - 1, -beta, -alpha, ply + 1)[0]
+            position.unmake_move()
+            searched += 1
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        self.cutoffs += 1
+                        if searched == 1:
+                            self.first_move_cutoffs += 1
+                        if not move & FLAG_CAPTURE:
+                            self.update_quiet_cutoff(position, move, depth, ply)
+                        break
+
+        if not searched:
+            return (-MATE_SCORE + ply if position.in_check() else 0), 0
+        if best_score <= original_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table.store(key, depth, bound, score_to_table(best_score, ply), best_move)
+        return best_score, best_move
+
+    def score_frontier(self, position, moves, ply):
+        # Each child is still made to find mates, stalemates and tablebase
+        # hits, but the rest are scored together, statically: this mode has no
+        # quiescence search. Every child is scored, so the result is exact.
+        tablebases = self.tablebases
+        best_score = -INFINITY
+        best_move = 0
+        pending = []
+        boards = []
+        for move in moves:
+            self.nodes += 1
+            if not self.nodes % CHECK_INTERVAL:
+                self.check_limits()
+            position.make_move(move)
+            score = None
+            status = legal_moves_and_status(position)[1]
+            if status:
+                score = MATE_SCORE - ply - 1 if status == "checkmate" else 0
+            elif (position.occupied[0] | position.occupied[1]).bit_count() <= tablebases.max_pieces:
+                found = tablebases.probe(position)
+                if found is not None:
+                    self.tablebase_hits += 1
+                    score = -tablebase_score(found, ply + 1)
+            if score is None:
+                pending.append(move)
+                boards.append(position.squares[:])
+            position.unmake_move()
+            if score is not None and score > best_score:
+                best_score = score
+                best_move = move
+        if pending:
+            scores = self.batch_eval.evaluate_squares(boards)
+            sign = 1 if position.side == WHITE else -1
+            for move, score in zip(pending, scores):
+                score = sign * int(score)
+                if score > best_score:
+                    best_score = score
+                    best_move = move
+        self.table.store(position.key, 1, EXACT, score_to_table(best_score, ply), best_move)
+        return best_score, best_move
+
+    def update_quiet_cutoff(self, position, move, depth, ply):
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        index = position.squares[move & 63] * 64 + ((move >> 6) & 63)
+        self.history[index] += depth * depth
+        if self.history[index] >= ORDER_KILLER:
+            self.history = [value // 2 for value in self.history]
+
+    def principal_variation(self, position, limit):
+        pv = []
+        seen = set()
+        while len(pv) < limit and position.key not in seen:
+            seen.add(position.key)
+            entry = self.table.probe(position.key)
+            if not entry or entry[3] not in legal_moves(position):
+                break
+            pv.append(entry[3])
+            position.make_move(entry[3])
+        for _ in pv:
+            position.unmake_move()
+        return pv
+
+    def root_moves(self, position):
+        # The root's legal moves in the order negamax tries them there, for
+        # searches that split the root up themselves.
+        entry = self.table.probe(position.key)
+        return list(self.staged_moves(position, entry[3] if entry else 0, 0))
+
+    def search_root(self, position, depth):
+        return self.negamax(position, depth, -INFINITY, INFINITY, 0)
+
+    def run(self, position, depth=None, time_limit=None, node_limit=None, on_iteration=None, stop_event=None):
+        # stop_event (a threading.Event) lets another thread cancel the search;
+        # a cancelled search returns whatever its last finished iteration found.
+        self.reset()
+        self.stop_event = stop_event
+        self.table.new_search()
+        self.history = [value // 8 for value in self.history]
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        self.limit(time_limit, node_limit)
+        max_depth = depth or MAX_DEPTH
+
+        # A position the tablebases cover is played from them without a search.
+        found = self.tablebases.best_move(position) if self.tablebases.max_pieces else None
+        if found is not None:
+            move, result, plies = found
+            self.tablebase_hits += 1
+            self.best_move = move
+            self.best_score = tablebase_score((result, plies), 0)
+            self.pv = [move]
+            if on_iteration is not None:
+                on_iteration(self)
+            self.finished = time.perf_counter()
+            return self.best_move, self.best_score
+
+        root_length = len(position.history)
+        for iteration in range(1, max_depth + 1):
+            try:
+                score, move = self.search_root(position, iteration)
+            except SearchTimeout:
+                while len(position.history) > root_length:
+                    position.unmake_move()
+                break
+            self.depth = iteration
+            self.best_move = move
+            self.best_score = score
+            self.pv = self.principal_variation(position, iteration)
+            if on_iteration is not None:
+                on_iteration(self)
+            if not move or abs(score) > MATE_BOUND:
+                break
+            # An iteration costs several times the previous one; do not start
+            # one that cannot finish inside the budget.
+            if self.time_limit is not None and self.elapsed() > self.time_limit / 2:
+                break
+        self.finished = time.perf_counter()
+        return self.best_move, self.best_score
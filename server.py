@@ -0,0 +1,435 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from arena import CONFIG_KEYS, game_over, parse_config
+from bitboard import (BLACK, BLACK_OO, BLACK_OOO, COLOR_CHARS, KING, PAWN, PROMOTION_RANKS, ROOK, WHITE, WHITE_OO,
+                      WHITE_OOO, Position, legal_moves, move_to_uci, parse_uci, square_name)
+from engine import AI_HASH_MB, book_move
+import parallel
+
+# Hosts many games at once over a local socket, each its own Session rather
+# than the GUI's module globals. The protocol is one JSON object per line
+# each way; a connection's requests are answered in order, one at a time.
+#
+#   {"op": "new", "ai": "b", "time": 0.2}   start a game; "ai" is the colour
+#                                           the engine plays (omit for two
+#                                           humans), with optional depth,
+#                                           time and nodes limits and "fen"
+#   {"op": "move", "game": 1, "move": "e2e4"}
+#                                           play a move; in a game against
+#                                           the AI the reply carries its
+#                                           answer too
+#   {"op": "state", "game": 1}              FEN, side to move and result
+#   {"op": "legal", "game": 1}              the legal moves, as UCI
+#   {"op": "close", "game": 1}
+#   {"op": "stats"}                         server counters
+#
+# Replies have "ok": true and the answer, or "ok": false and "error". Games
+# belong to the server, not the connection, so two connections can play one
+# game between them.
+#
+# AI moves are searched on a process pool, so the event loop only parses
+# requests and checks moves. At most max_searches searches are handed to the
+# pool at once; up to max_queue more wait their turn, and a move that would
+# need a search beyond that is refused with "busy" (before it is played) and
+# retry_after, the seconds the client should wait before sending it again.
+DEFAULT_PORT = 8765
+DEFAULT_ENGINE = "time=0.2"
+# Per-game limits a client may ask for are capped at these.
+MAX_TIME_LIMIT = 10.0
+MAX_DEPTH_LIMIT = 12
+MAX_PLIES = 600
+MAX_LINE = 64 * 1024
+BUSY_RETRY_SECONDS = 0.1
+# Games nobody has touched for this long are dropped.
+IDLE_SECONDS = 15 * 60
+STATUS_INTERVAL = 10.0
+
+def _search_move(fen, limits):
+    # Runs in a pool process, whose one Search (and table) serves every game
+    # sent to it. Returns (move, nodes).
+    position = Position.from_fen(fen)
+    move = book_move(position)
+    if move:
+        return move, 0
+    search = parallel._worker_search
+    move, _ = search.run(position, depth=limits.get("depth"), time_limit=limits.get("time"),
+                         node_limit=limits.get("nodes"))
+    return move, search.nodes
+
+
+class Busy(Exception):
+    pass
+
+
+def read_fen(fen):
+    # The position of a client's FEN. Position.from_fen takes what it is
+    # given on trust, so anything the move generator could not play from
+    # correctly is refused here with ValueError.
+    if not isinstance(fen, str):
+        raise ValueError("bad FEN: not a string")
+    fields = fen.split()
+    if not fields:
+        raise ValueError("bad FEN: empty")
+    ranks = fields[0].split('/')
+    if len(ranks) != 8 or any(sum(int(char) if char.isdigit() else 1 for char in rank) != 8 for rank in ranks):
+        raise ValueError("bad FEN: the board needs eight ranks of eight squares")
+    if len(fields) > 1 and fields[1] not in ("w", "b"):
+        raise ValueError("bad FEN: the side to move is w or b")
+    try:
+        position = Position.from_fen(fen)
+    except (ValueError, IndexError) as e:
+        raise ValueError(f"bad FEN: {e}")
+    for color in (WHITE, BLACK):
+        if position.pieces[color][KING].bit_count() != 1:
+            raise ValueError(f"bad FEN: {COLOR_CHARS[color]} needs exactly one king")
+    if (position.pieces[WHITE][PAWN] | position.pieces[BLACK][PAWN]) & PROMOTION_RANKS:
+        raise ValueError("bad FEN: pawns on the first or last rank")
+    for right, color, king, rook in ((WHITE_OO, WHITE, 4, 7), (WHITE_OOO, WHITE, 4, 0),
+                                     (BLACK_OO, BLACK, 60, 63), (BLACK_OOO, BLACK, 60, 56)):
+        if position.castling & right and (position.squares[king] != color * 6 + KING
+                                          or position.squares[rook] != color * 6 + ROOK):
+            raise ValueError(f"bad FEN: castling right without the king and rook on {square_name(king)} "
+                             f"and {square_name(rook)}")
+    ep = position.ep
+    if ep >= 0:
+        # The square a pawn of the side that just moved has passed over: on
+        # the sixth rank when White is to move, the third when Black is,
+        # empty, with the pawn in front of it and its start square empty.
+        behind, pawn, start = (ep + 8, ep - 8, 40) if position.side == WHITE else (ep - 8, ep + 8, 16)
+        if (ep & ~7) != start or position.squares[ep] >= 0 or position.squares[behind] >= 0 \
+                or position.squares[pawn] != (position.side ^ 1) * 6 + PAWN:
+            raise ValueError(f"bad FEN: no double pawn push can have passed {square_name(ep)}")
+    if position.in_check(position.side ^ 1):
+        raise ValueError("bad FEN: the side not to move is in check")
+    return position
+
+
+class Session:
+    # One game: its position (whose history the repetition rule reads), the
+    # moves played, and the side and limits of the AI if there is one.
+
+    def __init__(self, game_id, position, ai, limits):
+        self.id = game_id
+        self.position = position
+        self.moves = []
+        self.ai = ai
+        self.limits = limits
+        self.outcome = game_over(position, MAX_PLIES, 0)
+        # Held while a move and the AI's answer are played.
+        self.lock = asyncio.Lock()
+        self.touched = time.monotonic()
+
+    def play(self, move):
+        self.position.make_move(move)
+        self.moves.append(move_to_uci(move))
+        self.outcome = game_over(self.position, MAX_PLIES, len(self.moves))
+
+    def take_back(self):
+        self.position.unmake_move()
+        self.moves.pop()
+        self.outcome = game_over(self.position, MAX_PLIES, len(self.moves))
+
+    def ai_to_move(self):
+        return self.outcome is None and self.ai == self.position.side
+
+    def state(self):
+        result, termination = self.outcome or (None, None)
+        return {
+            "game": self.id,
+            "fen": self.position.fen(),
+            "to_move": COLOR_CHARS[self.position.side],
+            "ply": len(self.moves),
+            "result": result,
+            "termination": termination,
+        }
+
+
+class GameServer:
+
+    def __init__(self, workers, max_searches, max_queue, max_games, limits, hash_mb=AI_HASH_MB):
+        self.sessions = {}
+        self.ids = itertools.count(1)
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=parallel._init_worker, initargs=(hash_mb,))
+        self.slots = asyncio.Semaphore(max_searches)
+        self.max_searches = max_searches
+        self.max_pending = max_searches + max_queue
+        self.max_games = max_games
+        self.limits = limits
+        # Searches waiting for a slot or running.
+        self.pending = 0
+        self.connections = 0
+        self.moves = 0
+        self.searches = 0
+        self.search_nodes = 0
+        self.search_seconds = 0.0
+        self.refused = 0
+        self.started = time.monotonic()
+        self.ops = {
+            "new": self.op_new,
+            "move": self.op_move,
+            "state": self.op_state,
+            "legal": self.op_legal,
+            "close": self.op_close,
+            "stats": self.op_stats,
+        }
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def game_limits(self, request):
+        # The request's depth, time and nodes limits, else the server's. A
+        # client's search is always given a time limit, so that no depth or
+        # node count it asks for can hold a pool process for long.
+        limits = {name: request[name] for name in ("depth", "time", "nodes") if request.get(name) is not None}
+        if not limits:
+            return self.limits
+        try:
+            limits = {name: CONFIG_KEYS[name](value) for name, value in limits.items()}
+        except (TypeError, ValueError):
+            raise ValueError("depth, time and nodes must be numbers")
+        limits["time"] = min(max(limits.get("time", MAX_TIME_LIMIT), 0.001), MAX_TIME_LIMIT)
+        if limits.get("depth") is not None:
+            limits["depth"] = min(max(limits["depth"], 1), MAX_DEPTH_LIMIT)
+        if limits.get("nodes") is not None:
+            limits["nodes"] = max(limits["nodes"], 1)
+        return limits
+
+    def session(self, request):
+        game_id = request.get("game")
+        if not isinstance(game_id, int) or isinstance(game_id, bool):
+            raise ValueError(f"game must be a game number, not {game_id!r}")
+        session = self.sessions.get(game_id)
+        if session is None:
+            raise ValueError(f"no game {request.get('game')!r}")
+        session.touched = time.monotonic()
+        return session
+
+    def check_capacity(self):
+        if self.pending >= self.max_pending:
+            self.refused += 1
+            raise Busy
+
+    def retry_after(self):
+        # Roughly how long the searches ahead will take to clear, so that
+        # refused clients do not poll faster than slots free up.
+        if not self.searches:
+            return BUSY_RETRY_SECONDS
+        wait = self.search_seconds / self.searches * self.pending / self.max_searches
+        return round(max(BUSY_RETRY_SECONDS, wait), 3)
+
+    async def ai_move(self, session):
+        self.pending += 1
+        try:
+            async with self.slots:
+                started = time.perf_counter()
+                loop = asyncio.get_running_loop()
+                move, nodes = await loop.run_in_executor(self.executor, _search_move, session.position.fen(),
+                                                         session.limits)
+        finally:
+            self.pending -= 1
+        self.searches += 1
+        self.search_nodes += nodes
+        self.search_seconds += time.perf_counter() - started
+        session.play(move)
+        self.moves += 1
+        return move_to_uci(move)
+
+    async def op_new(self, request):
+        if len(self.sessions) >= self.max_games:
+            raise ValueError(f"too many games (at most {self.max_games})")
+        ai = request.get("ai")
+        if ai not in (None, "w", "b"):
+            raise ValueError("ai must be \"w\", \"b\" or absent")
+        limits = self.game_limits(request)
+        fen = request.get("fen")
+        position = read_fen(fen) if fen is not None else Position.initial()
+        session = Session(next(self.ids), position, COLOR_CHARS.index(ai) if ai else None, limits)
+        played = []
+        async with session.lock:
+            if session.ai_to_move():
+                self.check_capacity()
+            self.sessions[session.id] = session
+            if session.ai_to_move():
+                try:
+                    played.append(await self.ai_move(session))
+                except BaseException:
+                    # A game the AI could not open is not kept.
+                    del self.sessions[session.id]
+                    raise
+        return {"played": played} | session.state()
+
+    async def op_move(self, request):
+        session = self.session(request)
+        async with session.lock:
+            if session.outcome is not None:
+                raise ValueError("the game is over")
+            if session.ai_to_move():
+                raise ValueError("it is the AI's move")
+            move = parse_uci(session.position, str(request.get("move", "")))
+            if move is None:
+                raise ValueError(f"illegal move {request.get('move')!r}")
+            # Refused before the move is played, so it can simply be sent again.
+            if session.ai is not None:
+                self.check_capacity()
+            session.play(move)
+            played = [move_to_uci(move)]
+            if session.ai_to_move():
+                try:
+                    played.append(await self.ai_move(session))
+                except BaseException:
+                    # Without the AI's answer the move is taken back, so the
+                    # game is as it was and the move can be sent again.
+                    session.take_back()
+                    raise
+            self.moves += 1
+        return {"played": played} | session.state()
+
+    async def op_state(self, request):
+        session = self.session(request)
+        return session.state() | {"moves": session.moves}
+
+    async def op_legal(self, request):
+        session = self.session(request)
+        return {"game": session.id, "moves": sorted(move_to_uci(move) for move in legal_moves(session.position))}
+
+    async def op_close(self, request):
+        session = self.session(request)
+        del self.sessions[session.id]
+        return {"game": session.id}
+
+    async def op_stats(self, request):
+        return {
+            "games": len(self.sessions),
+            "connections": self.connections,
+            "moves": self.moves,
+            "searches": self.searches,
+            "pending": self.pending,
+            "refused": self.refused,
+            "nodes": self.search_nodes,
+            "mean_search_ms": round(self.search_seconds / self.searches * 1000, 1) if self.searches else 0.0,
+            "uptime": round(time.monotonic() - self.started, 1),
+        }
+
+    async def handle_line(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {"ok": False, "error": "requests are JSON objects, one per line"}
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "requests are JSON objects, one per line"}
+        op = request.get("op")
+        handler = self.ops.get(op) if isinstance(op, str) else None
+        if handler is None:
+            return {"ok": False, "error": f"unknown op {op!r}; expected one of {', '.join(self.ops)}"}
+        try:
+            reply = await handler(request)
+        except Busy:
+            return {"ok": False, "error": "busy", "retry_after": self.retry_after()}
+        except ValueError as e:
+            return {"ok": False, "error": str(e)}
+        except BrokenProcessPool:
+            return {"ok": False, "error": "the search pool has stopped"}
+        except Exception as e:
+            print(f"error handling {request!r}: {e!r}")
+            return {"ok": False, "error": "internal error"}
+        return {"ok": True} | reply
+
+    async def handle_connection(self, reader, writer):
+        # Requests are read and answered one at a time, so a client that
+        # sends faster than its games are played is held back by TCP.
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(b'{"ok": false, "error": "request line too long"}\n')
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                reply = await self.handle_line(line)
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def housekeeping(self):
+        # Drops idle games and prints a status line now and then.
+        last_moves = self.moves
+        while True:
+            await asyncio.sleep(STATUS_INTERVAL)
+            now = time.monotonic()
+            for game_id, session in list(self.sessions.items()):
+                if now - session.touched > IDLE_SECONDS and not session.lock.locked():
+                    del self.sessions[game_id]
+            if self.moves != last_moves:
+                print(f"{len(self.sessions)} games, {self.connections} connections, "
+                      f"{(self.moves - last_moves) / STATUS_INTERVAL:.1f} moves/s, {self.pending} searches pending, "
+                      f"{self.refused} refused")
+                last_moves = self.moves
+
+
+async def serve(args, limits):
+    server = GameServer(args.workers, args.max_searches or args.workers, args.max_queue, args.max_games, limits,
+                        args.hash)
+    try:
+        if args.unix:
+            listener = await asyncio.start_unix_server(server.handle_connection, args.unix, limit=MAX_LINE)
+            where = args.unix
+        else:
+            listener = await asyncio.start_server(server.handle_connection, args.host, args.port, limit=MAX_LINE)
+            where = f"{args.host}:{args.port}"
+        print(f"serving on {where}: {args.workers} search processes, engine {args.engine}")
+        housekeeping = asyncio.create_task(server.housekeeping())
+        async with listener:
+            await listener.serve_forever()
+        housekeeping.cancel()
+    finally:
+        server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve many concurrent games over a local socket")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"TCP port (default: {DEFAULT_PORT})")
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket at PATH instead of TCP")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="search processes")
+    parser.add_argument("--max-searches", type=int,
+                        help="searches running at once (default: one per search process)")
+    parser.add_argument("--max-queue", type=int, default=256,
+                        help="searches waiting for a slot before moves are refused as busy")
+    parser.add_argument("--max-games", type=int, default=10000, help="games open at once")
+    parser.add_argument("--engine", default=DEFAULT_ENGINE,
+                        help=f"AI limits for games that do not set their own, as name=value pairs from "
+                             f"depth, time, nodes (default: {DEFAULT_ENGINE})")
+    parser.add_argument("--hash", type=int, default=AI_HASH_MB, help="transposition table MB per search process")
+    args = parser.parse_args()
+    try:
+        limits = parse_config(args.engine)
+    except ValueError as e:
+        parser.error(str(e))
+    del limits["hash"]
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    try:
+        asyncio.run(serve(args, limits))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import sqlite3
+import time
+
+from bitboard import legal_moves
+from history import MoveHistory
+
+# Games live in one SQLite file: a row per game, indexed by when it was
+# saved, and a row per move keyed by (game, ply). Every move is appended as
+# it is played, so a save only stamps the game and a load reads one game's
+# moves through the keys, however many games the file holds. The moves of a
+# save are never overwritten: a different move played inside them forks
+# the game (see GameStore.append_move).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    start_fen TEXT NOT NULL,
+    plies INTEGER NOT NULL DEFAULT 0,
+    saved REAL,
+    saved_plies INTEGER
+);
+CREATE INDEX IF NOT EXISTS games_saved ON games (saved);
+CREATE TABLE IF NOT EXISTS moves (
+    game_id INTEGER NOT NULL,
+    ply INTEGER NOT NULL,
+    move INTEGER NOT NULL,
+    PRIMARY KEY (game_id, ply)
+) WITHOUT ROWID;
+"""
+
+
+class GameStore:
+    # Moves are stored as the engine's move ints. A game's plies column is
+    # its current length: undo only lowers it, and the next move played
+    # replaces the record at that ply, so records past the end are ignored,
+    # unless they belong to the save.
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def new_game(self, start_fen):
+        now = time.time()
+        with self.connection:
+            cursor = self.connection.execute("INSERT INTO games (created, updated, start_fen) VALUES (?, ?, ?)",
+                                             (now, now, start_fen))
+        return cursor.lastrowid
+
+    def append_move(self, game_id, ply, move):
+        # Returns the id of the game the move went into: game_id, or a new
+        # game holding the first ply moves of it when move would replace a
+        # different one of its save.
+        with self.connection:
+            row = self.connection.execute(
+                "SELECT g.start_fen, g.saved_plies, m.move FROM games g LEFT JOIN moves m "
+                "ON m.game_id = g.id AND m.ply = ? WHERE g.id = ?", (ply, game_id)).fetchone()
+            if row is not None and row[1] is not None and ply < row[1] and row[2] not in (None, move):
+                game_id = self.fork(game_id, row[0], ply)
+            self.connection.execute("INSERT OR REPLACE INTO moves (game_id, ply, move) VALUES (?, ?, ?)",
+                                    (game_id, ply, move))
+            self.connection.execute("UPDATE games SET plies = ?, updated = ? WHERE id = ?",
+                                    (ply + 1, time.time(), game_id))
+        return game_id
+
+    def fork(self, game_id, start_fen, plies):
+        # A new game with the first plies moves of game_id; the caller holds
+        # the transaction.
+        now = time.time()
+        cursor = self.connection.execute("INSERT INTO games (created, updated, start_fen, plies) VALUES (?, ?, ?, ?)",
+                                         (now, now, start_fen, plies))
+        self.connection.execute("INSERT INTO moves (game_id, ply, move) SELECT ?, ply, move FROM moves "
+                                "WHERE game_id = ? AND ply < ?", (cursor.lastrowid, game_id, plies))
+        return cursor.lastrowid
+
+    def truncate(self, game_id, plies):
+        with self.connection:
+            self.connection.execute("UPDATE games SET plies = ?, updated = ? WHERE id = ?",
+                                    (plies, time.time(), game_id))
+
+    def save(self, game_id):
+        with self.connection:
+            self.connection.execute("UPDATE games SET saved = ?, saved_plies = plies WHERE id = ?",
+                                    (time.time(), game_id))
+
+    def list_saves(self, limit=20):
+        # (game id, saved time, plies) of the most recent saves, newest first.
+        return self.connection.execute("SELECT id, saved, saved_plies FROM games WHERE saved IS NOT NULL "
+                                       "ORDER BY saved DESC LIMIT ?", (limit,)).fetchall()
+
+    def latest_save(self):
+        saves = self.list_saves(1)
+        return saves[0][0] if saves else None
+
+    def load(self, game_id, plies=None):
+        # (start FEN, moves) of a game as last saved, or its first plies
+        # moves; None if there is no such game.
+        row = self.connection.execute("SELECT start_fen, saved_plies, plies FROM games WHERE id = ?",
+                                      (game_id,)).fetchone()
+        if row is None:
+            return None
+        start_fen, saved_plies, current_plies = row
+        if plies is None:
+            plies = saved_plies if saved_plies is not None else current_plies
+        moves = [move for (move,) in self.connection.execute(
+            "SELECT move FROM moves WHERE game_id = ? AND ply < ? ORDER BY ply", (game_id, plies))]
+        return start_fen, moves
+
+
+def restore_game(start_fen, moves):
+    # Replays a stored game into the MoveHistory the GUI keeps, at its last
+    # ply. A move that is not legal where it is stored raises ValueError.
+    history = MoveHistory(start_fen)
+    for ply, move in enumerate(moves):
+        if move not in legal_moves(history.position):
+            raise ValueError(f"illegal move {move} at ply {ply} of the stored game")
+        history.push(move)
+    return history
@@ -0,0 +1,534 @@
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+from bitboard import (BISHOP, BLACK, KING, KING_ATTACKS, KNIGHT, KNIGHT_ATTACKS, PAWN, PIECE_CHARS, QUEEN, ROOK,
+                      WHITE, Position, bishop_attacks, legal_moves, move_to_uci, rook_attacks)
+
+# Distance-to-mate tables for pawnless endings of up to four pieces, built
+# offline by retrograde analysis (python tablebase.py generate) and
+# memory-mapped when probed.
+#
+# A table is named after its material, White first: KRK, KQKR, KBNK. It
+# covers the mirror-image material too, by swapping the colours. A file is
+# a header, then one byte per index with White to move, then one per index
+# with Black to move. A byte holds, for the side to move, 0 for a draw (or
+# an index that is not a legal position) or plies + 1 for a result plies
+# half-moves from mate: odd plies are wins, even plies losses.
+TABLEBASE_DIR = "tablebases"
+HEADER = struct.Struct(">4s8sI")
+MAGIC = b"CTB1"
+MAX_PIECES = 4
+PIECE_ORDER = (QUEEN, ROOK, BISHOP, KNIGHT)
+PIECE_STRENGTH = {QUEEN: 9, ROOK: 5, BISHOP: 3, KNIGHT: 3}
+# Endings the generator builds by default: every pawnless 3- and 4-piece
+# ending that is not drawn by material alone.
+DEFAULT_TABLES = ("KQK", "KRK", "KQQK", "KQRK", "KQBK", "KQNK", "KRRK", "KRBK", "KRNK", "KBBK", "KBNK", "KNNK",
+                  "KQKQ", "KQKR", "KQKB", "KQKN", "KRKR", "KRKB", "KRKN", "KBKB", "KBKN", "KNKN")
+
+
+def _mirror(sq, symmetry):
+    file, rank = sq & 7, sq >> 3
+    if symmetry & 1:
+        file = 7 - file
+    if symmetry & 2:
+        rank = 7 - rank
+    if symmetry & 4:
+        file, rank = rank, file
+    return rank * 8 + file
+
+
+# Without pawns the board has eight symmetries, so the white king is always
+# moved into the a1-d1-d4 triangle and only ten king squares are indexed.
+# A king on the a1-d4 diagonal keeps two symmetries; the smaller placement
+# of the other pieces decides between them.
+SYMMETRIES = [[_mirror(sq, symmetry) for sq in range(64)] for symmetry in range(8)]
+TRIANGLE = [sq for sq in range(64) if (sq >> 3) <= (sq & 7) <= 3]
+TRIANGLE_INDEX = {sq: index for index, sq in enumerate(TRIANGLE)}
+KING_SYMMETRIES = [[table for table in SYMMETRIES if table[sq] in TRIANGLE_INDEX] for sq in range(64)]
+
+
+def piece_attacks(ptype, sq, occ):
+    if ptype == KNIGHT:
+        return KNIGHT_ATTACKS[sq]
+    if ptype == KING:
+        return KING_ATTACKS[sq]
+    if ptype == BISHOP:
+        return bishop_attacks(sq, occ)
+    if ptype == ROOK:
+        return rook_attacks(sq, occ)
+    return bishop_attacks(sq, occ) | rook_attacks(sq, occ)
+
+
+# What each piece type attacks from each square on an empty board: a cheap
+# first test before the sliders' occupancy lookups.
+EMPTY_BOARD_ATTACKS = [[piece_attacks(ptype, sq, 0) if ptype != PAWN else 0 for sq in range(64)]
+                       for ptype in range(6)]
+
+
+def table_name(white, black):
+    # white and black are the piece types besides the kings.
+    return "K" + "".join(PIECE_CHARS[ptype] for ptype in white) + "K" + "".join(PIECE_CHARS[ptype] for ptype in black)
+
+
+def parse_table_name(name):
+    if name.count("K") != 2 or not name.startswith("K"):
+        raise ValueError(f"bad table name {name!r}; expected material such as KRK or KQKR")
+    white, black = name[1:].split("K")
+    try:
+        sides = [sorted((PIECE_CHARS.index(char) for char in side), key=PIECE_ORDER.index) for side in (white, black)]
+    except ValueError:
+        raise ValueError(f"bad table name {name!r}; pieces are Q, R, B and N") from None
+    if len(name) > MAX_PIECES:
+        raise ValueError(f"bad table name {name!r}; tables hold at most {MAX_PIECES} pieces")
+    return sides
+
+
+def material_drawn(white, black):
+    # Bare kings, or a lone minor piece: nothing left that could mate.
+    pieces = white + black
+    return not pieces or (len(pieces) == 1 and pieces[0] in (BISHOP, KNIGHT))
+
+
+def _strength(pieces):
+    return sum(PIECE_STRENGTH[ptype] for ptype in pieces), [-PIECE_ORDER.index(ptype) for ptype in pieces]
+
+
+def material(placed):
+    # (White's, Black's) piece types besides the kings, strongest first.
+    sides = ([], [])
+    for color, ptype, _ in placed:
+        if ptype != KING:
+            sides[color].append(ptype)
+    return [sorted(side, key=lambda ptype: PIECE_ORDER.index(ptype) if ptype != PAWN else -1) for side in sides]
+
+
+def canonical_name(name):
+    # The name the table for name's material is stored under: the stronger
+    # side is White.
+    white, black = parse_table_name(name)
+    if _strength(black) > _strength(white):
+        white, black = black, white
+    return table_name(white, black)
+
+
+def _layout_order(item):
+    color, ptype, _ = item
+    return (0, color, 0) if ptype == KING else (1, color, PIECE_ORDER.index(ptype))
+
+
+def encode_result(plies):
+    return plies + 1
+
+
+def decode_result(value):
+    # (result, plies) for a table byte: result is 1 for a win of the side to
+    # move, -1 for a loss and 0 for a draw.
+    if not value:
+        return 0, 0
+    plies = value - 1
+    return (1 if plies & 1 else -1), plies
+
+
+class TableLayout:
+    # How one ending's positions map to indexes. Pieces are listed white
+    # king, black king, then White's and Black's other pieces, and a
+    # position is the list of their squares. Two like pieces are
+    # interchangeable, so they are indexed in square order.
+
+    def __init__(self, name):
+        self.name = name
+        white, black = parse_table_name(name)
+        self.pieces = [(WHITE, KING), (BLACK, KING)] + [(WHITE, ptype) for ptype in white] + \
+                      [(BLACK, ptype) for ptype in black]
+        self.count = len(self.pieces)
+        self.size = len(TRIANGLE) * 64 ** (self.count - 1)
+        self.twins = [(i, i + 1) for i in range(2, self.count - 1) if self.pieces[i] == self.pieces[i + 1]]
+        self.sides = ([], [])
+        for i, (color, ptype) in enumerate(self.pieces):
+            self.sides[color].append((i, ptype))
+
+    def index(self, squares):
+        best = None
+        for table in KING_SYMMETRIES[squares[0]]:
+            mapped = [table[sq] for sq in squares]
+            for i, j in self.twins:
+                if mapped[i] > mapped[j]:
+                    mapped[i], mapped[j] = mapped[j], mapped[i]
+            if best is None or mapped < best:
+                best = mapped
+        index = TRIANGLE_INDEX[best[0]]
+        for sq in best[1:]:
+            index = index * 64 + sq
+        return index
+
+    def squares(self, index):
+        squares = []
+        for _ in range(self.count - 1):
+            index, sq = divmod(index, 64)
+            squares.append(sq)
+        squares.append(TRIANGLE[index])
+        squares.reverse()
+        return squares
+
+    def attacked(self, squares, target, by_color, ignored=-1):
+        # Whether by_color attacks target; the piece at index ignored (just
+        # captured, or lifted to see what it shields) does not count.
+        occ = 0
+        for i, sq in enumerate(squares):
+            if i != ignored:
+                occ |= 1 << sq
+        for i, ptype in self.sides[by_color]:
+            if i != ignored and EMPTY_BOARD_ATTACKS[ptype][squares[i]] >> target & 1:
+                if ptype == KNIGHT or ptype == KING or piece_attacks(ptype, squares[i], occ) >> target & 1:
+                    return True
+        return False
+
+    def legal(self, squares, side):
+        # A placement is a position when no two pieces share a square and the
+        # side that has just moved is not in check.
+        return len(set(squares)) == self.count and not self.attacked(squares, squares[side ^ 1], side)
+
+    def moves(self, squares, side):
+        # Legal moves for side as (piece index, to square, captured piece
+        # index or -1).
+        enemy = side ^ 1
+        occ = own = 0
+        for i, sq in enumerate(squares):
+            occ |= 1 << sq
+            if self.pieces[i][0] == side:
+                own |= 1 << sq
+        king = squares[side]
+        # Everything the enemy attacks with the king lifted off the board, so
+        # that it cannot step back along a slider's line.
+        danger = 0
+        for i, ptype in self.sides[enemy]:
+            danger |= piece_attacks(ptype, squares[i], occ ^ (1 << king))
+        in_check = danger >> king & 1
+        found = []
+        for i, ptype in self.sides[side]:
+            targets = piece_attacks(ptype, squares[i], occ) & ~own
+            if ptype == KING:
+                targets &= ~danger
+                exposed = False
+            else:
+                # Another piece's move can only matter when the king is in
+                # check or the piece is shielding it from a slider.
+                exposed = in_check or self.attacked(squares, king, enemy, i)
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                to = bit.bit_length() - 1
+                captured = squares.index(to) if occ & bit else -1
+                if exposed:
+                    after = squares[:]
+                    after[i] = to
+                    if self.attacked(after, king, enemy, captured):
+                        continue
+                found.append((i, to, captured))
+        return found
+
+    def predecessors(self, squares, side):
+        # Indexes of the positions, side ^ 1 to move, from which a move
+        # without a capture reaches squares.
+        mover = side ^ 1
+        occ = 0
+        for sq in squares:
+            occ |= 1 << sq
+        found = set()
+        for i, ptype in self.sides[mover]:
+            sources = piece_attacks(ptype, squares[i], occ) & ~occ
+            while sources:
+                bit = sources & -sources
+                sources ^= bit
+                before = squares[:]
+                before[i] = bit.bit_length() - 1
+                if not self.attacked(before, before[side], mover):
+                    found.add(self.index(before))
+        return found
+
+
+class Tablebase:
+    # One memory-mapped table file.
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, name, size = HEADER.unpack_from(self.data)
+        name = name.rstrip(b"\0").decode("ascii")
+        if magic != MAGIC or len(self.data) != HEADER.size + 2 * size:
+            self.close()
+            raise ValueError(f"{path} is not a tablebase file")
+        self.layout = TableLayout(name)
+        if self.layout.size != size:
+            self.close()
+            raise ValueError(f"{path} does not match the {name} layout")
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def probe(self, squares, side):
+        return decode_result(self.data[HEADER.size + side * self.layout.size + self.layout.index(squares)])
+
+
+class Tablebases:
+    # Every table file in a directory, opened on first use. Probes take
+    # (colour, piece type, square) triples so that captures into smaller
+    # endings and colour-swapped material are looked up the same way.
+
+    def __init__(self, directory=TABLEBASE_DIR):
+        self.directory = directory
+        self.tables = {}
+        self.names = set()
+        if os.path.isdir(directory):
+            self.names = {entry[:-3] for entry in os.listdir(directory) if entry.endswith(".tb")}
+        # Positions with more pieces than this are never probed.
+        self.max_pieces = max((len(name) for name in self.names), default=0)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        self.tables.clear()
+
+    def table(self, name):
+        if name not in self.names:
+            return None
+        table = self.tables.get(name)
+        if table is None:
+            table = self.tables[name] = Tablebase(os.path.join(self.directory, name + ".tb"))
+        return table
+
+    def probe_pieces(self, placed, side):
+        # (result, plies) for side to move, or None if no table covers the
+        # material.
+        white, black = material(placed)
+        if PAWN in white or PAWN in black or len(placed) > MAX_PIECES:
+            return None
+        if material_drawn(white, black):
+            return 0, 0
+        if _strength(black) > _strength(white):
+            white, black = black, white
+            placed = [(color ^ 1, ptype, sq ^ 56) for color, ptype, sq in placed]
+            side ^= 1
+        table = self.table(table_name(white, black))
+        if table is None:
+            return None
+        squares = [sq for _, _, sq in sorted(placed, key=_layout_order)]
+        return table.probe(squares, side)
+
+    def probe(self, position):
+        # (result, plies) for the side to move in a Position, or None when
+        # no table applies. Castling rights rule a position out; without
+        # pawns there is never an en passant square.
+        if position.castling or (position.occupied[0] | position.occupied[1]).bit_count() > self.max_pieces:
+            return None
+        placed = [(code // 6, code % 6, sq) for sq, code in enumerate(position.squares) if code >= 0]
+        return self.probe_pieces(placed, position.side)
+
+    def best_move(self, position):
+        # (move, result, plies) for the fastest win, else a drawing move, else
+        # the slowest loss; None when no table covers the position.
+        found = self.probe(position)
+        if found is None:
+            return None
+        best = None
+        for move in legal_moves(position):
+            position.make_move(move)
+            reply = self.probe(position)
+            position.unmake_move()
+            if reply is None:
+                continue
+            result, plies = -reply[0], reply[1] + 1
+            # Wins rank by speed, losses by how long they hold out.
+            rank = (result, -plies if result > 0 else plies)
+            if best is None or rank > best[0]:
+                best = rank, move, result, plies
+        if best is None:
+            return None
+        _, move, result, plies = best
+        return move, result, (plies if result else 0)
+
+
+_tablebases = None
+
+
+def open_tablebases(directory=TABLEBASE_DIR):
+    # Shared per process and directory, so every search probes the same
+    # mappings.
+    global _tablebases
+    if _tablebases is None or _tablebases.directory != directory:
+        _tablebases = Tablebases(directory)
+    return _tablebases
+
+
+def generate(name, directory=TABLEBASE_DIR, log=print):
+    # Builds name's table by retrograde analysis and writes it to directory,
+    # where the tables for every ending it can capture into must already be.
+    #
+    # Mates are found first, and wins and losses that start with a capture
+    # are read from the smaller tables. Then, a ply at a time: a position
+    # one move before a loss is a win, and a position whose every move leads
+    # to a win for the opponent is a loss, found by counting down its moves
+    # as their results come in. Whatever is left is a draw.
+    started = time.perf_counter()
+    layout = TableLayout(name)
+    smaller = Tablebases(directory)
+    size = layout.size
+    values = [bytearray(size), bytearray(size)]
+    # Per position: moves whose result is still open (0 until counted), or
+    # ESCAPE when some capture already avoids losing; and the loss distance
+    # the losing captures alone force.
+    ESCAPE = 255
+    remaining = [bytearray(size), bytearray(size)]
+    capture_floor = [bytearray(size), bytearray(size)]
+    # Positions decided at each ply, as side * size + index.
+    layers = {}
+    capture_wins = {}
+
+    for index in range(size):
+        squares = layout.squares(index)
+        if len(set(squares)) != layout.count:
+            continue
+        # Only the index a placement's symmetries agree on is solved.
+        if (len(KING_SYMMETRIES[squares[0]]) > 1 or layout.twins) and layout.index(squares) != index:
+            continue
+        for side in (WHITE, BLACK):
+            if not layout.legal(squares, side):
+                continue
+            moves = layout.moves(squares, side)
+            if not moves:
+                if layout.attacked(squares, squares[side], side ^ 1):
+                    values[side][index] = encode_result(0)
+                    layers.setdefault(0, array("Q")).append(side * size + index)
+                continue
+            quiet = False
+            win = floor = 0
+            escape = False
+            for piece, to, captured in moves:
+                if captured < 0:
+                    quiet = True
+                    continue
+                placed = [(color, ptype, to if i == piece else squares[i])
+                          for i, (color, ptype) in enumerate(layout.pieces) if i != captured]
+                found = smaller.probe_pieces(placed, side ^ 1)
+                if found is None:
+                    raise ValueError(f"{name} needs the {table_name(*material(placed))} table in {directory}")
+                result, plies = found
+                if result < 0:
+                    win = min(win, plies + 1) if win else plies + 1
+                elif result == 0:
+                    escape = True
+                else:
+                    floor = max(floor, plies + 1)
+            if win:
+                capture_wins.setdefault(win, array("Q")).append(side * size + index)
+            if win or escape:
+                remaining[side][index] = ESCAPE
+            elif floor:
+                capture_floor[side][index] = floor
+                if not quiet:
+                    values[side][index] = encode_result(floor)
+                    layers.setdefault(floor, array("Q")).append(side * size + index)
+    smaller.close()
+    log(f"{name}: {size:,} indexes scanned in {time.perf_counter() - started:.1f}s")
+
+    plies = 0
+    while plies <= max(list(layers) + list(capture_wins), default=-1):
+        layer = layers.setdefault(plies, array("Q"))
+        for entry in capture_wins.pop(plies, ()):
+            side, index = divmod(entry, size)
+            if not values[side][index]:
+                values[side][index] = encode_result(plies)
+                layer.append(entry)
+        for entry in layer:
+            side, index = divmod(entry, size)
+            mover = side ^ 1
+            mover_values = values[mover]
+            if plies & 1 == 0:
+                # A loss for side: any move into it wins.
+                for before in layout.predecessors(layout.squares(index), side):
+                    if not mover_values[before]:
+                        mover_values[before] = encode_result(plies + 1)
+                        layers.setdefault(plies + 1, array("Q")).append(mover * size + before)
+                continue
+            # A win for side: one more move of the mover's known to lose.
+            mover_remaining = remaining[mover]
+            for before in layout.predecessors(layout.squares(index), side):
+                if mover_values[before] or mover_remaining[before] == ESCAPE:
+                    continue
+                if not mover_remaining[before]:
+                    before_squares = layout.squares(before)
+                    successors = set()
+                    for piece, to, captured in layout.moves(before_squares, mover):
+                        if captured < 0:
+                            after = before_squares[:]
+                            after[piece] = to
+                            successors.add(layout.index(after))
+                    mover_remaining[before] = len(successors)
+                mover_remaining[before] -= 1
+                if not mover_remaining[before]:
+                    loss = max(plies + 1, capture_floor[mover][before])
+                    mover_values[before] = encode_result(loss)
+                    layers.setdefault(loss, array("Q")).append(mover * size + before)
+        del layers[plies]
+        plies += 1
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + ".tb")
+    with open(path + ".tmp", "wb") as table_file:
+        table_file.write(HEADER.pack(MAGIC, name.encode("ascii"), size))
+        table_file.write(values[WHITE])
+        table_file.write(values[BLACK])
+    os.replace(path + ".tmp", path)
+    log(f"{name}: longest mate {plies - 1} plies, written to {path} in {time.perf_counter() - started:.1f}s")
+    return path
+
+
+def main():
+    # argparse is imported here so that the search, which imports this
+    # module for probing, does not pay for it.
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate or probe endgame tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("generate", help="build tables by retrograde analysis")
+    build.add_argument("tables", nargs="*", metavar="table",
+                       help="endings to build, such as KRK or KQKR (default: all 3- and 4-piece endings)")
+    build.add_argument("--dir", default=TABLEBASE_DIR, help=f"directory for the tables (default: {TABLEBASE_DIR})")
+    build.add_argument("--force", action="store_true", help="rebuild tables that already exist")
+    probe = commands.add_parser("probe", help="look a position up")
+    probe.add_argument("fen", help="position to look up")
+    probe.add_argument("--dir", default=TABLEBASE_DIR, help=f"directory of the tables (default: {TABLEBASE_DIR})")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        try:
+            names = [canonical_name(name) for name in args.tables] or list(DEFAULT_TABLES)
+        except ValueError as e:
+            parser.error(str(e))
+        # Smaller endings first: the larger ones capture into them.
+        for name in sorted(dict.fromkeys(names), key=len):
+            if args.force or not os.path.exists(os.path.join(args.dir, name + ".tb")):
+                generate(name, args.dir)
+        return 0
+
+    tablebases = Tablebases(args.dir)
+    position = Position.from_fen(args.fen)
+    found = tablebases.best_move(position)
+    if found is None:
+        print("not in the tablebases")
+        return 1
+    move, result, plies = found
+    if not result:
+        print(f"draw, bestmove {move_to_uci(move)}")
+    else:
+        print(f"{'win' if result > 0 else 'loss'}: mate in {plies} plies, bestmove {move_to_uci(move)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
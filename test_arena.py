@@ -0,0 +1,16 @@
+from arena import game_over, repetitions
+from bitboard import Position, parse_uci
+
+SHUFFLE = ["a1a2", "e8d8", "a2a1", "d8e8"]
+
+
+def test_repetition_from_fen_with_halfmove_clock():
+    # The clock (2) is longer than the history when the shuffling starts.
+    position = Position.from_fen("4k3/8/8/8/8/8/8/R3K3 w - - 2 40")
+    outcomes = []
+    for text in SHUFFLE * 2:
+        position.make_move(parse_uci(position, text))
+        outcomes.append(game_over(position, 1000, len(outcomes) + 1))
+    assert repetitions(position) == 3
+    assert outcomes[-1] == ("1/2-1/2", "threefold repetition")
+    assert not any(outcomes[:-1])
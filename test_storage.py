@@ -0,0 +1,56 @@
+import pytest
+
+from bitboard import START_FEN, move_to_uci, parse_uci
+from history import MoveHistory
+from storage import GameStore, restore_game
+
+OPENING = ["e2e4", "e7e5", "g1f3", "b8c6", "f1c4", "g8f6"]
+
+
+def play(store, game_id, history, texts):
+    # Plays texts as the GUI does; returns the game id they ended up in.
+    for text in texts:
+        move = parse_uci(history.position, text)
+        history.push(move)
+        game_id = store.append_move(game_id, history.ply - 1, move)
+    return game_id
+
+
+def test_save_undo_new_move_load(tmp_path):
+    store = GameStore(str(tmp_path / "games.sqlite3"))
+    history = MoveHistory()
+    saved = play(store, store.new_game(START_FEN), history, OPENING)
+    store.save(saved)
+
+    history.go_to(2)
+    store.truncate(saved, 2)
+    game_id = play(store, saved, history, ["f1c4"])
+    assert game_id != saved
+
+    start_fen, moves = store.load(store.latest_save())
+    assert [move_to_uci(move) for move in moves] == OPENING
+    assert restore_game(start_fen, moves).moves() == moves
+    start_fen, moves = store.load(game_id)
+    assert [move_to_uci(move) for move in moves] == OPENING[:2] + ["f1c4"]
+    store.close()
+
+
+def test_unsaved_moves_are_replaced(tmp_path):
+    store = GameStore(str(tmp_path / "games.sqlite3"))
+    history = MoveHistory()
+    game_id = play(store, store.new_game(START_FEN), history, OPENING[:4])
+    history.go_to(2)
+    store.truncate(game_id, 2)
+    assert play(store, game_id, history, ["f1c4"]) == game_id
+    assert [move_to_uci(move) for move in store.load(game_id)[1]] == OPENING[:2] + ["f1c4"]
+    store.close()
+
+
+def test_restore_rejects_illegal_moves():
+    history = MoveHistory()
+    for text in ["e2e4", "e7e5", "f1c4", "b8c6"]:
+        history.push(parse_uci(history.position, text))
+    e4, e5, bc4, nc6 = history.moves()
+    # Bc4 twice: the second moves from an empty square.
+    with pytest.raises(ValueError):
+        restore_game(START_FEN, [e4, e5, bc4, nc6, bc4])
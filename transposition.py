@@ -0,0 +1,117 @@
+from array import array
+
+EXACT = 1
+LOWER = 2
+UPPER = 3
+
+# Every slot is two unsigned 64-bit words (key, packed data), so the memory
+# cap translates directly into a slot count.
+ENTRY_BYTES = 16
+
+# Packed data layout: move (19 bits) | score + SCORE_OFFSET (20 bits) |
+# depth (7 bits) | bound (2 bits) | generation (8 bits).
+MOVE_BITS = 19
+SCORE_BITS = 20
+SCORE_OFFSET = 1 << (SCORE_BITS - 1)
+SCORE_SHIFT = MOVE_BITS
+DEPTH_SHIFT = SCORE_SHIFT + SCORE_BITS
+BOUND_SHIFT = DEPTH_SHIFT + 7
+GENERATION_SHIFT = BOUND_SHIFT + 2
+
+
+class TranspositionTable:
+    # Slots come in buckets of two: the first keeps the deepest (or most
+    # recent generation) result, the second is always overwritten, so deep
+    # results survive while fresh shallow ones still find room.
+
+    def __init__(self, size_mb=16):
+        self.resize(size_mb)
+
+    def resize(self, size_mb):
+        slots = max(2, int(size_mb * 1024 * 1024) // ENTRY_BYTES)
+        slots = 1 << (slots.bit_length() - 1)
+        self.size_mb = size_mb
+        self.slots = slots
+        self.mask = slots - 2
+        self.keys = array('Q', bytes(8 * slots))
+        self.data = array('Q', bytes(8 * slots))
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def clear(self):
+        self.resize(self.size_mb)
+
+    def new_search(self):
+        self.generation = (self.generation + 1) & 0xFF
+
+    def probe(self, key):
+        index = key & self.mask
+        keys = self.keys
+        if keys[index] == key and self.data[index]:
+            self.hits += 1
+            return _unpack(self.data[index])
+        if keys[index + 1] == key and self.data[index + 1]:
+            self.hits += 1
+            return _unpack(self.data[index + 1])
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, bound, score, move):
+        index = key & self.mask
+        keys = self.keys
+        data = self.data
+        packed = (move | ((score + SCORE_OFFSET) << SCORE_SHIFT) | (depth << DEPTH_SHIFT)
+                  | (bound << BOUND_SHIFT) | (self.generation << GENERATION_SHIFT))
+        self.stores += 1
+
+        old = data[index]
+        if keys[index] == key or not old:
+            if old and not move:
+                packed |= old & ((1 << MOVE_BITS) - 1)
+            keys[index] = key
+            data[index] = packed
+            return
+        old_depth = (old >> DEPTH_SHIFT) & 0x7F
+        old_generation = old >> GENERATION_SHIFT
+        if depth >= old_depth or old_generation != self.generation:
+            # The deep slot is demoted to the always-replace slot.
+            if data[index + 1] and keys[index + 1] != key:
+                self.evictions += 1
+            keys[index + 1] = keys[index]
+            data[index + 1] = old
+            keys[index] = key
+            data[index] = packed
+            return
+        if data[index + 1] and keys[index + 1] != key:
+            self.evictions += 1
+        keys[index + 1] = key
+        data[index + 1] = packed
+
+    def hashfull(self, sample=1000):
+        # Permille of sampled slots written during the current generation.
+        sample = min(sample, self.slots)
+        used = sum(1 for value in self.data[:sample] if value and value >> GENERATION_SHIFT == self.generation)
+        return used * 1000 // sample
+
+    def stats(self):
+        probes = self.hits + self.misses
+        return {
+            "size_mb": self.size_mb,
+            "slots": self.slots,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / probes if probes else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hashfull": self.hashfull(),
+        }
+
+
+def _unpack(packed):
+    return ((packed >> DEPTH_SHIFT) & 0x7F,
+            (packed >> BOUND_SHIFT) & 3,
+            ((packed >> SCORE_SHIFT) & ((1 << SCORE_BITS) - 1)) - SCORE_OFFSET,
+            packed & ((1 << MOVE_BITS) - 1))